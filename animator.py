@@ -11,11 +11,31 @@ from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+import numpy as np
+import time
+from diagnostics import ConservationMonitor
+from export import save_gif
+from pacing import RealTimeClock
+from scheduler import ArtistSchedule, LayeredBlitter
+from worker import SimulationWorker
+
+
+def _is_graphic(value):
+    """是否为 matplotlib 对象(或由其组成的列表)，这类对象不随模拟器一起 pickle"""
+    if isinstance(value, (list, tuple)):
+        return len(value) > 0 and any(_is_graphic(item) for item in value)
+    return type(value).__module__.startswith("matplotlib")
 
 class Animator2D:
     """二维动画基类"""
+    conserved = ()    # 理想情况下应当守恒的量，由子类声明
+    state_fields = () # 后台运行时从模拟端同步到界面端的属性，由子类声明
+
     def __init__(self):
-        pass
+        self.step_count = 0  # 已推进的物理步数
+        self.observers  = [] # 按步长挂接的观测器
+        self.monitor    = self.add_observer(ConservationMonitor()) # 默认开启守恒量监测
+        self.schedule   = ArtistSchedule() # 动画部件的刷新计划
 
     def initialize_figure(self, xlim: tuple | list, ylim: tuple | list, figsize=None, title=None, grid=True):
         """初始化画布"""
@@ -34,15 +54,191 @@ class Animator2D:
         self.fig.tight_layout()
 
     @abstractmethod
-    def update(self, frame) -> Tuple[Line2D | Patch]:
-        """更新函数，需重载"""
+    def step(self):
+        """推进一个物理步长，需重载"""
         pass
 
-    def play(self, frames=1000, interval=10, blit=True):
-        """运行动画"""
+    def draw(self) -> Tuple[Line2D | Patch]:
+        """
+        依据当前状态更新动画部件，返回需要重绘的部件
+
+        默认按 register_artist 登记的刷新计划只更新到期的部件；未登记部件的子类需重载。
+        """
+        self.schedule.refresh()
+        return tuple(self.schedule.artists)
+
+    def register_artist(self, name, artists, update, every=1, key=None, tolerance=0.0):
+        """
+        登记一组动画部件及其刷新频率
+
+        参数:
+            name: 组名，重复登记时替换
+            artists: 单个部件或部件列表
+            update: 无参数的更新函数
+            every: 每隔多少帧更新一次
+            key: 无参数函数，给出时只有其返回值变化超过 tolerance 才更新
+        """
+        # 组名带上实例标识，多个模拟器共用一个刷新计划(多场景拼图)时不会冲突
+        self.schedule.add((id(self), name), artists, update, every=every, key=key, tolerance=tolerance)
+
+    def attach(self, ax, schedule=None):
+        """
+        把动画部件改画到给定的坐标轴上，用于多场景拼图
+
+        关闭自己的画布，沿用原坐标轴的范围，由 plot_variable 重新创建部件；
+        schedule 给出时与其他模拟器共用同一个刷新计划。
+        """
+        assert hasattr(self, "plot_variable"), f"{type(self).__name__} 未实现 plot_variable，不支持拼图"
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        plt.close(self.fig)
+        self.fig, self.ax = ax.figure, ax
+        self.ax_phase = None # 拼图中不绘制相图
+        ax.set(xlim=xlim, ylim=ylim)
+        ax.set_aspect("equal")
+        self.schedule = schedule if schedule is not None else ArtistSchedule()
+        self.plot_variable()
+
+    def advance(self, n_steps=1):
+        """推进 n_steps 个物理步长，并按各自的步长调用观测器"""
+        for _ in range(n_steps):
+            self.step()
+            self.notify_observers()
+
+    def notify_observers(self):
+        """步数加一，并按各自的步长调用观测器"""
+        self.step_count += 1
+        for observer in self.observers:
+            if self.step_count % observer.stride == 0:
+                observer.observe(self)
+
+    @classmethod
+    def step_batch(cls, simulators):
+        """把同类的多个实例各推进一个物理步长，默认逐个调用 step，可重载为向量化的批量计算"""
+        for simulator in simulators:
+            simulator.step()
+
+    def update(self, frame) -> Tuple[Line2D | Patch]:
+        """每一帧更新时调用的方法"""
+        self.advance()
+        return self.draw()
+
+    def update_realtime(self, frame) -> Tuple[Line2D | Patch]:
+        """
+        实时节拍下每一帧调用的方法：按节拍推进若干步，落后时跳过绘制并沿用上一帧的部件
+
+        绘制耗时包括更新部件与分层 blit 的渲染；不使用分层 blit 时只能测得更新部件的耗时。
+        """
+        n_steps, draw = self.clock.plan()
+        if n_steps:
+            start = time.perf_counter()
+            self.advance(n_steps)
+            self.clock.record_steps(n_steps, time.perf_counter() - start)
+        if draw or not hasattr(self, "artists"):
+            start = time.perf_counter()
+            self.artists = self.draw()
+            render = getattr(getattr(self, "loop", None), "render_time", 0.0) # 上一次 blit 的耗时
+            self.clock.record_draw(time.perf_counter() - start + render)
+        else:
+            self.clock.record_draw(None)
+        if time.perf_counter() - self.clock_shown > 1.0:
+            # 每秒在窗口标题中显示一次实际速率
+            self.clock_shown = time.perf_counter()
+            if self.fig.canvas.manager is not None:
+                self.fig.canvas.manager.set_window_title(str(self.clock))
+        return self.artists
+
+    def add_observer(self, observer):
+        """挂接观测器，观测器需提供 stride 属性与 observe(simulator) 方法"""
+        self.observers.append(observer)
+        return observer
+
+    def diagnostic_quantities(self) -> dict:
+        """返回能量、动量、角动量等诊断量，需重载"""
+        return {}
+
+    def __getstate__(self):
+        """pickle 时只保留物理状态，去掉 matplotlib 对象与后台模拟"""
+        return {
+            key: value for key, value in self.__dict__.items()
+            if key not in ("worker", "ani", "loop", "schedule", "clock", "domain") and not _is_graphic(value)
+        }
+
+    def get_state(self) -> dict:
+        """打包 state_fields 中的属性与步数，供后台模拟写入共享内存"""
+        assert self.state_fields, f"{type(self).__name__} 未声明 state_fields，不支持后台运行"
+        state = {key: np.asarray(getattr(self, key)) for key in self.state_fields}
+        state["step_count"] = np.asarray(self.step_count)
+        return state
+
+    def set_state(self, state: dict):
+        """界面端载入后台模拟的一帧，跨过观测器步长时在界面端补做一次观测"""
+        previous = self.step_count
+        for key, value in state.items():
+            setattr(self, key, value if np.ndim(value) else value.item())
+        for observer in self.observers:
+            if self.step_count // observer.stride > previous // observer.stride:
+                observer.observe(self)
+
+    @property
+    def is_background(self):
+        """物理部分是否在后台运行"""
+        return getattr(self, "worker", None) is not None and self.worker.running
+
+    def send_command(self, name, *args):
+        """交互命令：后台运行时发送给模拟端，否则直接执行"""
+        if self.is_background:
+            self.worker.send(name, *args)
+        else:
+            self.handle_command(name, *args)
+
+    def handle_command(self, name, *args):
+        """在模拟端执行交互命令，默认调用同名方法"""
+        getattr(self, name)(*args)
+
+    def update_from_worker(self, frame) -> Tuple[Line2D | Patch]:
+        """后台运行时每一帧调用的方法：有新状态时重绘，否则沿用上一帧的部件"""
+        if self.worker.poll() or not hasattr(self, "artists"):
+            self.artists = self.draw()
+        return self.artists
+
+    def play(self, frames=1000, interval=10, blit=True, background=None, steps_per_frame=1, realtime=None):
+        """
+        运行动画
+
+        参数:
+            frames: 帧数，分层 blit 时推进这么多帧后停止
+            background: None 表示在界面线程中计算；"thread" 或 "process" 表示物理部分在后台线程/进程中运行，
+                        界面只读取共享内存中的最新一帧，计算慢时不会卡住窗口
+            steps_per_frame: 后台运行时每发布一帧推进的物理步数
+            realtime: 目标速率(模拟时间 / 墙上时间)，给出时每帧按实测的步长与绘制耗时调整步数，
+                      落后时跳过绘制，窗口标题中显示实际速率；None 表示每帧固定推进一步
+
+        返回:
+            给出 realtime 时为窗口关闭时实时节拍的统计(RealTimeClock.report)，否则为 None
+        """
         assert hasattr(self, 'fig'), "画布未初始化，请在 __init__ 中调用 self.initialize_figure 方法"
-        self.ani = animation.FuncAnimation(self.fig, self.update, frames=frames, interval=interval, blit=blit)
+        assert not (background and realtime), "后台运行由 steps_per_frame 控制步数，不支持实时节拍"
+        if realtime:
+            self.clock = RealTimeClock(self.dt, ratio=realtime, interval=interval / 1000)
+            self.clock_shown = time.perf_counter()
+            func = self.update_realtime
+        elif background:
+            self.worker = SimulationWorker(self, mode=background, steps_per_frame=steps_per_frame, rate=1000 / interval)
+            self.worker.start()
+            self.fig.canvas.mpl_connect("close_event", lambda event: self.worker.stop())
+            func = self.update_from_worker
+        else:
+            func = self.update
+        if blit and self.schedule.entries:
+            # 登记了刷新计划时使用分层 blit，低频部件只在到期时重新渲染
+            self.loop = LayeredBlitter(self.fig, self.schedule, func, interval=interval, frames=frames)
+        else:
+            self.ani = animation.FuncAnimation(self.fig, func, frames=frames, interval=interval, blit=blit)
         plt.show()
+        if background:
+            self.worker.stop()
+        if realtime:
+            return self.clock.report()
 
     def save_animation(self, filename, fps=30, dpi=100, writer="ffmpeg", extra_args=None, 
                       frames=None, interval=None, **kwargs):
@@ -66,6 +262,7 @@ class Animator2D:
             1. 需要先调用play()方法或手动创建self.ani
             2. 保存MP4需要安装ffmpeg
             3. 保存GIF需要安装imagemagick
+            4. 只需要GIF时可以使用save_gif()，只重绘与写入变化的部分，速度更快、文件更小
         """
         if not hasattr(self, 'ani'):
             # 如果没有创建动画，先创建一个
@@ -93,3 +290,14 @@ class Animator2D:
         self.ani.save(filename, **save_kwargs)
         print(f"动画已保存为 {filename}")
 
+    def save_gif(self, filename, frames=500, fps=30, dpi=100, max_bytes=None):
+        """
+        以增量方式保存 GIF，不依赖 imagemagick
+
+        静态背景只渲染一次，每帧只重绘动画部件，并只写入与上一帧相比变化的矩形，
+        帧边渲染边写入文件。max_bytes 为文件大小预算(字节)，超出时自动跳帧。
+
+        返回:
+            写入的统计(DeltaGifWriter.report)：提交、写入与跳过的帧数，以及文件大小
+        """
+        return save_gif(self, filename, frames=frames, fps=fps, dpi=dpi, max_bytes=max_bytes).report()
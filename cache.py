@@ -0,0 +1,228 @@
+#------------------------------------------------
+# name: cache.py
+# author: taster
+# date: 2025-05-27 20:41:06 星期二
+# id: 2f8c4a6e1d9b47038c5e7a0b3d6f1e94
+# description: 按内容寻址的轨迹缓存
+#------------------------------------------------
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+"""
+同一个模拟(模拟器类型、参数、初始状态、积分方式都相同)的轨迹是确定的，因此可以按这些内容的
+哈希值缓存在磁盘上。键中不含步数：文件中保存已算出的最长轨迹，较短的请求直接截取前缀，
+较长的请求从缓存轨迹的最后一个状态继续推进，与一次算完的结果逐位一致。
+每条轨迹存为一个 .npy 文件，写入时先写临时文件再原子地替换，读取的进程不会看到写了一半的文件；
+比较长度、替换与淘汰在目录锁内进行，多个进程同时写入同一条轨迹时只保留最长的一条。
+读取时更新文件的修改时间，超出容量时按修改时间淘汰最久未使用的轨迹(LRU)。
+"""
+
+INTEGRATOR = "semi-implicit-euler" # 各摆类 step 默认的积分方式，模拟器可以用 integrator 属性给出其他方式
+
+
+def _encode(value):
+    """把参数转换为可 JSON 序列化且逐位精确的形式，浮点数用十六进制表示"""
+    if isinstance(value, dict):
+        return {str(key): _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_encode(item) for item in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value).hex()
+    return str(value)
+
+
+def code_fingerprint(func, seen=None):
+    """
+    函数代码的哈希，修改函数体后旧的键随之失效
+
+    优先使用源代码；取不到源代码时(交互式定义等)改用编译后的代码对象。
+    函数调用的同一模块中的函数一并计入，修改其中任何一个都会使键改变。
+    """
+    seen = set() if seen is None else seen
+    seen.add(func)
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = marshal.dumps(func.__code__)
+    digest = hashlib.sha256(code)
+    for name in func.__code__.co_names:
+        helper = func.__globals__.get(name)
+        if inspect.isfunction(helper) and helper.__module__ == func.__module__ and helper not in seen:
+            digest.update(code_fingerprint(helper, seen).encode())
+    return digest.hexdigest()
+
+
+def simulation_key(simulator, q, q_dot):
+    """
+    模拟的内容哈希
+
+    由模拟器类型、加速度函数(名称与代码)及其绑定的参数、积分方式、步长、阻尼与初始状态计算，
+    模拟器需实现 equations()，并提供 dt 与 damping_factor。
+    """
+    equations = simulator.equations()
+    description = {
+        "class": f"{type(simulator).__module__}.{type(simulator).__qualname__}",
+        "equations": f"{equations.func.__module__}.{equations.func.__qualname__}",
+        "code": code_fingerprint(equations.func),
+        "parameters": _encode(equations.keywords),
+        "integrator": getattr(simulator, "integrator", INTEGRATOR),
+        "dt": _encode(simulator.dt),
+        "damping": _encode(simulator.damping_factor),
+        "q": _encode(np.asarray(q, dtype=float)),
+        "q_dot": _encode(np.asarray(q_dot, dtype=float)),
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class DirectoryLock:
+    """
+    跨进程的目录锁
+
+    os.mkdir 在各平台上都是原子的：创建成功即持有锁。持锁进程异常退出时锁目录会残留，
+    超过 stale 秒的锁视为失效并被移除。
+    """
+    def __init__(self, path, stale=30.0, poll=0.005):
+        self.path  = path
+        self.stale = stale
+        self.poll  = poll
+
+    def __enter__(self):
+        while True:
+            try:
+                os.mkdir(self.path)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(self.path).st_mtime > self.stale:
+                        shutil.rmtree(self.path, ignore_errors=True)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(self.poll)
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TrajectoryCache:
+    """
+    磁盘上的轨迹缓存
+
+    参数:
+        directory: 缓存目录，不存在时创建
+        max_bytes: 缓存的总容量(字节)，超出时淘汰最久未使用的轨迹
+    """
+    def __init__(self, directory, max_bytes=256 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock      = DirectoryLock(os.path.join(directory, ".lock"))
+        self.hits      = 0 # 完全命中的次数
+        self.extended  = 0 # 命中前缀并续算的次数
+        self.misses    = 0 # 未命中的次数
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def load(self, key, n_steps):
+        """读取缓存轨迹的前 n_steps 步(不足时为全部)，没有缓存时返回 None"""
+        filename = self.filename(key)
+        try:
+            data = np.load(filename, mmap_mode="r")
+            trajectory = np.array(data[:n_steps])
+            del data # 尽快解除映射，Windows 下映射中的文件不能被替换
+            os.utime(filename) # 记录最近一次使用
+        except (FileNotFoundError, ValueError):
+            return None # 不存在，或已被其他进程淘汰
+        return trajectory
+
+    def store(self, key, trajectory):
+        """写入轨迹，已有的缓存更长时保留已有的缓存"""
+        fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(trajectory))
+            with self.lock:
+                filename = self.filename(key)
+                try:
+                    existing = np.load(filename, mmap_mode="r").shape[0]
+                except (FileNotFoundError, ValueError):
+                    existing = 0
+                if len(trajectory) > existing:
+                    os.replace(temp, filename)
+                self.evict(keep=filename)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def evict(self, keep=None):
+        """超出容量时按最近使用时间淘汰，keep 为刚写入、不淘汰的文件(需持有锁)"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+    def trajectory(self, simulator, n_steps, q=None, q_dot=None):
+        """
+        带缓存的 simulator.trajectory
+
+        参数:
+            simulator: 摆类模拟器
+            n_steps: 步数
+            q, q_dot: 初始状态，默认为模拟器的当前状态
+
+        返回:
+            (n_steps, 2, 自由度) 的轨迹，与 simulator.trajectory(q, q_dot, n_steps) 逐位一致
+        """
+        if q is None:
+            q, q_dot = simulator.get_coordinates()
+        key = simulation_key(simulator, q, q_dot)
+        cached = self.load(key, n_steps)
+        if cached is not None and len(cached) == n_steps:
+            self.hits += 1
+            return cached
+        if cached is None or len(cached) == 0:
+            self.misses += 1
+            trajectory = simulator.trajectory(q, q_dot, n_steps)
+        else:
+            # 从缓存轨迹的最后一个状态继续推进
+            self.extended += 1
+            rest = simulator.trajectory(cached[-1, 0], cached[-1, 1], n_steps - len(cached))
+            trajectory = np.concatenate([cached, rest])
+        self.store(key, trajectory)
+        return trajectory
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    from double_pendulum import DoublePendulum
+
+    # 同一配置的双摆重复请求：第一次计算，第二次直接读取，更长的请求只续算多出的部分
+    pendulum = DoublePendulum(L1=1.0, L2=1.0, damping=1.0)
+    plt.close(pendulum.fig)
+    pendulum.theta1, pendulum.theta2 = 2.0, 2.5
+    cache = TrajectoryCache(os.path.join(tempfile.gettempdir(), "physics_simulator_cache"))
+    for n_steps in (20000, 20000, 50000):
+        start = time.perf_counter()
+        trajectory = cache.trajectory(pendulum, n_steps)
+        print(f"{n_steps} 步用时 {time.perf_counter() - start:.3f} 秒", trajectory[-1, 0])
+    print(f"命中 {cache.hits} 次，续算 {cache.extended} 次，未命中 {cache.misses} 次")
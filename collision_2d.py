@@ -11,22 +11,118 @@ from matplotlib.widgets import Button
 import matplotlib.animation as animation
 import numpy as np
 import datetime
+import heapq
 import matplotlib.gridspec as gridspec
 from utils import random_color, weighted_color
 from animator import Animator2D
+from domain import DomainDecomposition
+from neighbor import StaticCells, VerletList, cell_list_pairs, connected_components, minimum_image, wrap_positions
+from scenario import grid_positions, load_scenario, poisson_disk, save_scenario
+
+
+def contact_time(c0, c1, c2, limit):
+    """
+    间隙 gap(tau) = c0 + c1 * tau + c2 * tau^2 在 [0, limit] 内第一次以减小的方式降到 0 的时刻，没有则为 inf
+
+    初始已接触(c0 <= 0)且正在接近(c1 < 0)时为 0。
+    """
+    tau = np.full(len(c0), np.inf)
+    disc = c1 ** 2 - 4 * c2 * c0
+    real = disc >= 0
+    q = -0.5 * (c1 + np.copysign(np.sqrt(np.where(real, disc, 0)), c1)) # 数值稳定的求根形式
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for root in (c0 / q, q / c2):
+            hit = real & np.isfinite(root) & (root >= 0) & (root <= limit) & (c1 + 2 * c2 * root < 0)
+            tau = np.where(hit, np.minimum(tau, root), tau)
+    tau[(c0 <= 0) & (c1 < 0)] = 0.0
+    return tau
+
+
+def quartic_contact_time(d, w, alpha, contact, limit, samples=8, iterations=20):
+    """
+    两个加速度不同的小球的接触时刻，间隙 |d + w tau + alpha tau^2 / 2|^2 - contact^2 是四次多项式
+
+    先在 [0, limit] 内均匀采样，找到第一次由正变为非正的区间，再用二分法求出接触时刻。
+    """
+    def gap(sel, tau):
+        tau = tau[..., np.newaxis]
+        rel = d[sel, np.newaxis] + w[sel, np.newaxis] * tau + 0.5 * alpha[sel, np.newaxis] * tau ** 2
+        return (rel ** 2).sum(axis=-1) - contact ** 2
+
+    rows = np.arange(len(d))
+    taus = np.linspace(0, limit, samples + 1)
+    values = gap(rows, np.broadcast_to(taus, (len(rows), samples + 1)))
+    crossing = (values[:, :-1] > 0) & (values[:, 1:] <= 0)
+    found = np.flatnonzero(crossing.any(axis=1))
+    tau = np.full(len(rows), np.inf)
+    if len(found) > 0:
+        first = np.argmax(crossing[found], axis=1)
+        lo, hi = taus[first], taus[first + 1]
+        for _ in range(iterations): # 二分法求接触时刻
+            mid = 0.5 * (lo + hi)
+            inside = gap(found, mid[:, np.newaxis])[:, 0] <= 0
+            hi = np.where(inside, mid, hi)
+            lo = np.where(inside, lo, mid)
+        tau[found] = hi
+    tau[(values[:, 0] <= 0) & ((d * w).sum(axis=1) < 0)] = 0.0 # 初始已接触且正在接近
+    return tau
 
 
 class CollisionSimulator2D(Animator2D):
-    def __init__(self, xlim=[0, 1], ylim=[0, 1], N=2):
+    state_fields = ("pos", "vol", "mass", "sleeping", "wall_impulse", "collision_count")
+
+    def __init__(self, xlim=[0, 1], ylim=[0, 1], N=2, boundary="wall", sleep=False, ccd=False, placement="uniform", scenario=None, domains=None):
+        """
+        参数:
+            xlim, ylim: 区域范围
+            N: 小球数量
+            boundary: "wall" 为反射墙壁；"periodic" 为周期性边界，小球从一侧离开后从对侧进入，
+                      通常与 g = 0 配合用于模拟体相气体
+            sleep: 是否允许静止的小球堆休眠，休眠的小球不再参与重力、碰撞与重叠修正
+            ccd: 是否使用连续碰撞检测，开启后可以使用大一个数量级的 dt 而不会穿透
+            placement: 随机生成位置的方式，"uniform" 为均匀分布(可能重叠)；"poisson" 为泊松圆盘采样；
+                       "grid" 为随机选取的格点，后两者生成的小球互不重叠
+            scenario: 场景目录或 Scenario，给出时从场景载入初始状态，区域、边界、数量与半径以场景为准
+            domains: 区域分解，None 为单进程；整数 K 把盒子沿 x 方向分为 K 个条带，(列数, 行数) 分为矩形区域，
+                     每块区域由一个工作进程推进，见 domain.py
+        """
         super(CollisionSimulator2D, self).__init__()
+        self.scenario = None if scenario is None else load_scenario(scenario)
+        if self.scenario is not None:
+            xlim = self.scenario.metadata.get("xlim", xlim)
+            ylim = self.scenario.metadata.get("ylim", ylim)
+            boundary = self.scenario.metadata.get("boundary", boundary)
+            N = len(self.scenario)
         # 全局参数设置
         self.xmin, self.xmax = xlim  # 边界
         self.ymin, self.ymax = ylim  # 边界
+        self.boundary        = boundary
+        self.lower           = np.array([self.xmin, self.ymin])                         # 区域左下角
+        self.size            = np.array([self.xmax - self.xmin, self.ymax - self.ymin]) # 区域边长
+        self.period          = self.size if boundary == "periodic" else None            # 周期，墙壁边界为 None
         self.g               = 98    # 重力加速度
         self.damping         = 0.995 # 阻尼
         self.N               = N     # 物体数量
         self.radius          = 0.05  # 小球的直径
+        self.placement       = placement # 随机生成位置的方式
         self.dt              = 1e-3  # 时间步长
+        self.ccd             = ccd   # 连续碰撞检测
+        self.max_events      = 20    # 连续碰撞检测中每个小球每步最多处理的事件数
+
+        # 休眠参数
+        self.allow_sleep     = sleep # 是否允许休眠
+        self.sleep_speed     = 0.2   # 平均速度低于此值视为静止
+        self.sleep_steps     = 100   # 连续静止多少步后可以休眠
+        if self.scenario is not None and self.scenario["radius"] is not None:
+            radius = np.asarray(self.scenario["radius"])
+            assert np.ptp(radius) == 0, "CollisionSimulator2D 只支持半径相同的小球"
+            self.radius = float(radius.flat[0])
+        self.contact_margin  = 0.1 * self.radius # 判断接触时的距离余量
+        # 碰撞与重叠修正共用的 Verlet 近邻表，皮层厚度 skin 内的位移不必重新搜索；设为 None 时每次都用格子链表
+        self.verlet          = VerletList(2 * self.radius, self.radius, self.lower, self.size, periodic=boundary == "periodic")
+        self.domains         = domains # 区域分解
+        self.domain          = None    # 区域分解的工作进程，第一次推进时启动
+        self.owned           = None    # 计入墙壁冲量与碰撞次数的小球，None 为全部(区域分解中为本区域拥有的小球)
 
         self.initialize_parameters() # 随机生成位置、质量、速度
         self.initialize_figure(
@@ -46,111 +142,139 @@ class CollisionSimulator2D(Animator2D):
         self.fig.canvas.mpl_connect("motion_notify_event", self.on_motion)
         self.fig.canvas.mpl_connect("button_release_event", self.on_release)
 
-        # 添加文本框用于显示动量和
+        # 添加文本框用于显示动量和，仅在守恒量监测器采样后刷新
         self.momentum = self.cal_momentum()
         self.text_box = self.ax.text(
             0.02, 0.95, f'Momentum: {np.round(self.momentum, 2)}', 
             transform=self.ax.transAxes, fontsize=8, verticalalignment='top',
         )
+        self.register_artist("text", self.text_box, self.update_text, key=lambda: self.monitor.count)
 
-        # # 记录动能
-        # self.energy = [(0.5 * self.mass[:, np.newaxis] * self.vol ** 2).sum()]
-        # self.energy_line, = self.curve_ax.plot(np.arange(len(self.energy)), self.energy)
-
-    def update(self, frame):
-        """每一帧更新时调用的方法"""
+    def step(self):
+        """推进一个物理步长"""
         if self.selected_ball is not None:
             # 如果存在被选择的球，那么在更新状态前需要保存它的原状态
             selected_pos = self.pos[self.selected_ball].copy()
             selected_vol = self.vol[self.selected_ball].copy()
-        self.handle_wall_collision()  # 处理与墙的碰撞
-        self.handle_block_collision() # 处理小球间的碰撞
-        self.handle_gravity()         # 加入重力
-        # self.handle_damping()         # 加入阻尼
-        self.update_positions()       # 更新位置
+        if self.ccd:
+            # 连续碰撞检测在推进位置时处理碰撞与重力
+            self.update_positions()
+        else:
+            self.handle_wall_collision()  # 处理与墙的碰撞
+            self.handle_block_collision() # 处理小球间的碰撞
+            self.handle_gravity()         # 加入重力
+            # self.handle_damping()         # 加入阻尼
+            self.update_positions()       # 更新位置
         if self.selected_ball is not None:
             self.pos[self.selected_ball] = selected_pos
             self.vol[self.selected_ball] = selected_vol
+        if self.allow_sleep:
+            self.update_sleep()       # 更新休眠状态
+
+    def advance(self, n_steps=1):
+        """推进 n_steps 步；区域分解时交给工作进程，在观测器的采样步之间整段推进"""
+        if self.domains is None:
+            return super().advance(n_steps)
+        if getattr(self, "domain", None) is None: # pickle 时不复制工作进程
+            self.domain = DomainDecomposition(self, self.domains)
+        while n_steps > 0:
+            chunk = min([n_steps] + [observer.stride - self.step_count % observer.stride for observer in self.observers])
+            self.domain.advance(chunk)
+            self.step_count += chunk - 1
+            self.notify_observers()
+            n_steps -= chunk
+
+    def stop_domains(self):
+        """停止区域分解的工作进程，之后再推进时重新启动"""
+        if getattr(self, "domain", None) is not None:
+            self.domain.stop()
+            self.domain = None
+
+    def update_balls(self):
+        """更新小球位置"""
         for i in range(self.N):
             self.balls[i].set_center(self.pos[i])
 
-        # 更新动量和
-        self.momentum = self.cal_momentum()
+    def update_text(self):
+        """动量和取自守恒量监测器的最近一次采样"""
+        momentum = self.monitor.latest("momentum")
+        if momentum is not None:
+            self.momentum = momentum
         self.text_box.set_text(f"Momentum: {np.round(self.momentum, 2)}")
-        # self.energy.append((0.5 * self.mass[:, np.newaxis] * self.vol ** 2).sum())
-        # self.energy_line.set_data(np.arange(len(self.energy)), self.energy)
-        # self.curve_ax.set_xlim(0, len(self.energy))
-        # self.curve_ax.set_ylim(np.min(self.energy), np.max(self.energy))
-
-        # return (*self.balls, self.text_box, self.energy_line)
-        return (*self.balls, self.text_box)
 
     def gen_non_contact_balls(self):
-        """生成无接触的球，废弃"""
-        ball_list = []
-        for i in range(self.N):
-            tmp_ball = np.array([0., 0.])
-            for _ in range(100): # 最多尝试生成的次数
-                tmp_ball = np.array([
-                    np.random.uniform(self.xmin + self.radius, self.xmax - self.radius),
-                    np.random.uniform(self.ymin + self.radius, self.ymax - self.radius),
-                ])
-                flag = True
-                for ball in ball_list:
-                    # 计算距离
-                    if np.linalg.vector_norm(tmp_ball - ball) <= 2 * self.radius:
-                        flag = False
-                if flag:
-                    break
-            ball_list.append(tmp_ball)
-        return np.stack(ball_list)
+        """按 placement 生成互不接触的小球位置，随机种子取自 np.random，与全局种子一起可复现"""
+        generate = grid_positions if self.placement == "grid" else poisson_disk
+        return generate(
+            self.N, self.lower + self.radius, self.size - 2 * self.radius, 2 * self.radius,
+            seed=np.random.randint(2 ** 32),
+        )
 
     """
     物理更新
     """
     def handle_wall_collision(self):
         """处理与墙的碰撞"""
-        self.vol[(self.pos[:, 0] >= self.xmax - self.radius) | (self.pos[:, 0] <= self.xmin + self.radius), 0] *= -1
-        self.vol[(self.pos[:, 1] >= self.ymax - self.radius) | (self.pos[:, 1] <= self.ymin + self.radius), 1] *= -1
+        if self.period is not None: # 周期性边界没有墙
+            return
+        for axis, (low, high) in enumerate([(self.xmin, self.xmax), (self.ymin, self.ymax)]):
+            hit = (self.pos[:, axis] >= high - self.radius) | (self.pos[:, axis] <= low + self.radius)
+            counted = hit if self.owned is None else hit & self.owned
+            self.wall_impulse += 2 * (self.mass[counted] * np.abs(self.vol[counted, axis])).sum() # 墙壁受到的冲量，用于计算压强
+            self.vol[hit, axis] *= -1
 
     def handle_block_collision(self):
         """处理小球间的碰撞"""
-        for i in range(self.N):
-            # 逐一计算是否碰撞
-            for j in range(i + 1, self.N):
-                # 获取法向量
-                if np.linalg.vector_norm(self.pos[i] - self.pos[j]) <= 2 * self.radius: # 发生了碰撞
-                    # n_vec = self.pos[i] - self.pos[j]
-                    # n_vec = n_vec / np.linalg.vector_norm(n_vec)
-                    # u1, u2 = self.vol[i], self.vol[j]
-                    # m1, m2 = self.mass[i], self.mass[j]
-                    #
-                    # # 方向
-                    # u1_direction = u1 - 2 * np.dot(u1, n_vec) * n_vec
-                    # u2_direction = u2 - 2 * np.dot(u2, n_vec) * n_vec
-                    # self.vol[i] = u1_direction
-                    # self.vol[j] = u2_direction
-
-                    # 碰撞的切向速度分量不变，而碰撞的法向速度分量服从一维完全弹性碰撞的关系
-                    m1, m2 = self.mass[i], self.mass[j]
-
-                    n = self.pos[i] - self.pos[j]
-                    n = n / np.linalg.vector_norm(n) # 单位法向量
-                    t = np.array([-n[1], n[0]]) # 对应的单位切向量
-
-                    vi, vj = self.vol[i], self.vol[j]
-                    vin, vjn = np.dot(vi, n), np.dot(vj, n) # 法向分量
-                    vit, vjt = np.dot(vi, t), np.dot(vj, t) # 切向分量
-
-                    # 计算碰撞后的法向速度
-                    vin_new = ((m1 - m2) * vin + 2 * m2 * vjn) / (m1 + m2)
-                    vjn_new = ((m2 - m1) * vjn + 2 * m1 * vin) / (m1 + m2)
-                    
-                    self.vol[i] = vin_new * n + vit * t
-                    self.vol[j] = vjn_new * n + vjt * t
+        i_idx, j_idx, _ = self.neighbor_pairs(2 * self.radius) # 发生了碰撞的小球对
+        if self.sleeping.any() and self.wake_touched(i_idx, j_idx):
+            # 唤醒的小球堆内部原先两端都在休眠的点对也要参与碰撞，重新搜索
+            i_idx, j_idx, _ = self.neighbor_pairs(2 * self.radius)
+        # 只统计相互接近的小球对，仍在接触中但已经分离的不算新的碰撞
+        d = minimum_image(self.pos[i_idx] - self.pos[j_idx], self.period)
+        approaching = ((self.vol[i_idx] - self.vol[j_idx]) * d).sum(axis=1) < 0
+        if self.owned is not None: # 跨越区域边界的小球对只由拥有编号较小者的区域计数
+            approaching &= self.owned[i_idx]
+        self.collision_count += int(np.count_nonzero(approaching))
+        for i, j in zip(i_idx, j_idx):
+            if self.sleeping[i] or self.sleeping[j]:
+                self.bounce_off_sleeping(i, j)
+                continue
+            self.collide_pair(i, j)
+
+    def collide_pair(self, i, j):
+        """两个小球的完全弹性碰撞"""
+        # 碰撞的切向速度分量不变，而碰撞的法向速度分量服从一维完全弹性碰撞的关系
+        m1, m2 = self.mass[i], self.mass[j]
+
+        n = minimum_image(self.pos[i] - self.pos[j], self.period)
+        n = n / np.linalg.vector_norm(n) # 单位法向量
+        t = np.array([-n[1], n[0]]) # 对应的单位切向量
+
+        vi, vj = self.vol[i], self.vol[j]
+        vin, vjn = np.dot(vi, n), np.dot(vj, n) # 法向分量
+        vit, vjt = np.dot(vi, t), np.dot(vj, t) # 切向分量
+
+        # 计算碰撞后的法向速度
+        vin_new = ((m1 - m2) * vin + 2 * m2 * vjn) / (m1 + m2)
+        vjn_new = ((m2 - m1) * vjn + 2 * m1 * vin) / (m1 + m2)
+        
+        self.vol[i] = vin_new * n + vit * t
+        self.vol[j] = vjn_new * n + vjt * t
+
+    def bounce_off_sleeping(self, i, j):
+        """与休眠小球碰撞：休眠小球视为静止的无穷大质量，活动小球的法向速度反向"""
+        if self.sleeping[i]:
+            i, j = j, i
+        n = minimum_image(self.pos[i] - self.pos[j], self.period)
+        n = n / np.linalg.vector_norm(n)
+        self.vol[i] -= 2 * np.dot(self.vol[i], n) * n
 
     def handle_gravity(self):
         """引入重力"""
+        if self.sleeping.any():
+            awake = ~self.sleeping
+            self.vol[awake, 1] -= self.mass[awake] * self.g * self.dt
+            return
         self.vol[:, 1] -= self.mass * self.g * self.dt 
 
     def handle_damping(self):
@@ -159,12 +283,136 @@ class CollisionSimulator2D(Animator2D):
 
     def update_positions(self):
         """更新位置"""
-        self.pos += self.vol * self.dt
+        if self.ccd:
+            self.sweep_positions()
+        else:
+            self.pos += self.vol * self.dt
         self.solve_overlaps() # 重叠检查
+        if self.period is not None:
+            # 周期性边界：折回盒内
+            self.pos = wrap_positions(self.pos, self.lower, self.period)
+            return
         # 边界检查
         self.pos[:, 0] = np.clip(self.pos[:, 0], self.xmin + self.radius, self.xmax - self.radius)
         self.pos[:, 1] = np.clip(self.pos[:, 1], self.ymin + self.radius, self.ymax - self.radius)
 
+    """
+    连续碰撞检测
+    """
+    def sweep_positions(self):
+        """
+        用连续碰撞检测推进一个步长
+
+        步长内小球沿重力下的抛物线运动，对可能相遇的小球对与墙壁求最早的接触时刻，
+        按时间顺序逐个处理碰撞事件：只把参与碰撞的小球推进到碰撞时刻并更新速度，
+        再重新计算它们之后的事件。没有发生碰撞的小球在最后一次性推进整个步长。
+        """
+        dt, N = self.dt, self.N
+        self.sweep_acc = np.zeros((N, 2)) # 步长内的加速度，休眠小球为 0
+        self.sweep_acc[~self.sleeping, 1] = -self.mass[~self.sleeping] * self.g
+        reach = np.linalg.norm(self.vol, axis=1).max() * dt + np.abs(self.sweep_acc).max() * dt ** 2
+        # 弹性碰撞后速度最多增大到两倍，候选范围留出余量
+        i, j, _ = self.neighbor_pairs(2 * self.radius + 3 * reach)
+        keep = ~(self.sleeping[i] & self.sleeping[j])
+        i, j = i[keep], j[keep]
+        partners = [[] for _ in range(N)]
+        for a, b in zip(i, j):
+            partners[a].append(b)
+            partners[b].append(a)
+        partners = [np.array(p, dtype=int) for p in partners]
+
+        self.sweep_time = np.zeros(N)                # 各小球已推进到的时刻
+        self.sweep_version = np.zeros(N, dtype=int)  # 速度改变时加一，用于丢弃过期事件
+        events = []
+        self.schedule_events(events, i, j, 0.0)
+        self.schedule_events(events, np.arange(N), None, 0.0)
+
+        budget = self.max_events * N
+        while events and budget > 0:
+            t, k, other, version_k, version_other = heapq.heappop(events)
+            if version_k != self.sweep_version[k] or (other >= 0 and version_other != self.sweep_version[other]):
+                continue # 事件已过期
+            budget -= 1
+            members = [k] if other < 0 else [k, other]
+            self.sweep_to(members, t) # 推进到碰撞时刻
+            if other < 0:
+                axis = (-other - 1) // 2
+                self.wall_impulse += 2 * self.mass[k] * abs(self.vol[k, axis])
+                self.vol[k, axis] *= -1 # 墙壁碰撞：反转对应的速度分量
+            elif self.sleeping[k] or self.sleeping[other]:
+                self.collision_count += 1
+                self.wake_touched(np.array([k]), np.array([other]))
+                if self.sleeping[k] or self.sleeping[other]:
+                    self.bounce_off_sleeping(k, other)
+                else:
+                    self.collide_pair(k, other)
+            else:
+                self.collision_count += 1
+                self.collide_pair(k, other)
+            for m in members:
+                self.sweep_version[m] += 1
+            for m in members:
+                self.schedule_events(events, np.full(len(partners[m]), m), partners[m], t)
+                self.schedule_events(events, np.array([m]), None, t)
+
+        self.sweep_to(np.arange(N), dt)
+
+    def sweep_to(self, idx, t):
+        """把 idx 中的小球沿抛物线推进到时刻 t"""
+        tau = (t - self.sweep_time[idx])[:, np.newaxis]
+        self.pos[idx] += self.vol[idx] * tau + 0.5 * self.sweep_acc[idx] * tau ** 2
+        self.vol[idx] += self.sweep_acc[idx] * tau
+        self.sweep_time[idx] = t
+
+    def sweep_state(self, idx, t):
+        """小球 idx 在时刻 t 的位置与速度(不修改状态)"""
+        tau = (t - self.sweep_time[idx])[:, np.newaxis]
+        pos = self.pos[idx] + self.vol[idx] * tau + 0.5 * self.sweep_acc[idx] * tau ** 2
+        vol = self.vol[idx] + self.sweep_acc[idx] * tau
+        return pos, vol
+
+    def schedule_events(self, events, a, b, t):
+        """
+        计算自时刻 t 起本步长内的最早接触，加入事件队列
+
+        b 为 None 时计算 a 中小球与四面墙的接触，否则计算小球对 (a, b) 的接触。
+        """
+        remaining = self.dt - t
+        if len(a) == 0 or remaining <= 0:
+            return
+        r = self.radius
+        pos_a, vol_a = self.sweep_state(a, t)
+        acc_a = self.sweep_acc[a]
+        if b is None:
+            if self.period is not None:
+                return
+            # 墙壁间隙是时间的二次多项式，四面墙依次为 x 下、x 上、y 下、y 上，编号 -1 ~ -4
+            n = len(a)
+            rows = np.repeat(np.arange(n), 4)
+            axis = np.tile([0, 0, 1, 1], n)
+            sign = np.tile([1.0, -1.0, 1.0, -1.0], n)
+            offset = np.tile([self.xmin + r, self.xmax - r, self.ymin + r, self.ymax - r], n)
+            tau = contact_time(
+                sign * (pos_a[rows, axis] - offset), sign * vol_a[rows, axis], 0.5 * sign * acc_a[rows, axis], remaining,
+            )
+            first, second = a[rows], np.tile(-np.arange(4) - 1, n)
+        else:
+            pos_b, vol_b = self.sweep_state(b, t)
+            d = minimum_image(pos_a - pos_b, self.period)
+            w = vol_a - vol_b
+            alpha = acc_a - self.sweep_acc[b]
+            # 相对加速度为 0 时间隙 |d + w tau|^2 - (2r)^2 是二次多项式，否则是四次多项式
+            tau = contact_time((d ** 2).sum(axis=1) - (2 * r) ** 2, 2 * (d * w).sum(axis=1), (w ** 2).sum(axis=1), remaining)
+            curved = np.flatnonzero(np.any(alpha != 0, axis=1))
+            if len(curved) > 0:
+                tau[curved] = quartic_contact_time(d[curved], w[curved], alpha[curved], 2 * r, remaining)
+            first, second = a, b
+
+        for idx in np.flatnonzero(np.isfinite(tau)):
+            k, other = first[idx], second[idx]
+            version_other = self.sweep_version[other] if other >= 0 else 0
+            heapq.heappush(events, (t + tau[idx], k, other, self.sweep_version[k], version_other))
+
     """
     重叠检查
     """
@@ -177,17 +425,59 @@ class CollisionSimulator2D(Animator2D):
             for i, j in pairs:
                 self.adjust_overlapping_pair(i, j)
 
+    def neighbor_pairs(self, cutoff):
+        """
+        找出距离不超过 cutoff 的小球对 (i < j)
+
+        有休眠小球时只搜索活动小球及其附近的休眠小球，不含两端都在休眠的点对；
+        否则截断与近邻表相同时查询近邻表，其余情况用格子链表
+        """
+        if self.sleeping.any():
+            return self.awake_pairs(cutoff)
+        if self.verlet is not None and cutoff == self.verlet.cutoff:
+            return self.verlet.pairs(self.pos)
+        return cell_list_pairs(self.pos, cutoff, self.lower, self.size, periodic=self.period is not None)
+
+    def awake_pairs(self, cutoff):
+        """
+        活动小球之间、活动小球与休眠小球之间距离不超过 cutoff 的小球对 (i < j)
+
+        休眠小球不动，它们的格子索引只在休眠集合改变(或截断变大)时重建；每一步只在活动小球
+        与其相邻格子中的休眠小球组成的子集上用格子链表搜索，代价与活动小球数成正比，
+        不随静止的小球堆增大。结果与全体搜索后去掉两端都在休眠的点对完全相同。
+        """
+        if self.sleeping_cells is None or cutoff > self.sleeping_cells.cutoff:
+            self.sleeping_ids = np.flatnonzero(self.sleeping)
+            self.sleeping_cells = StaticCells(
+                self.pos[self.sleeping_ids], cutoff, self.lower, self.size, periodic=self.period is not None,
+            )
+        awake = np.flatnonzero(~self.sleeping)
+        subset = np.union1d(awake, self.sleeping_ids[self.sleeping_cells.near(self.pos[awake])])
+        pos = self.pos[subset]
+        if self.period is None and len(subset) > 0: # 只在子集的包围盒内划分格子
+            lower, size = pos.min(axis=0), np.maximum(np.ptp(pos, axis=0), cutoff)
+        else:
+            lower, size = self.lower, self.size
+        i, j, dist = cell_list_pairs(pos, cutoff, lower, size, periodic=self.period is not None)
+        i, j = subset[i], subset[j] # 子集按编号排列，换回全局编号后仍按字典序排列
+        keep = ~(self.sleeping[i] & self.sleeping[j])
+        return i[keep], j[keep], dist[keep]
+
     def find_overlapping_pairs(self):
         """找出所有重叠的小球对"""
-        delta = self.pos[:, np.newaxis, :] - self.pos[np.newaxis, :, :] # 计算所有小球的坐标差矩阵
-        dist = np.sqrt(np.sum(delta**2, axis=2))                        # 计算每对小球之间的距离平方
-        np.fill_diagonal(dist, np.inf)                                  # 忽略对角线元素（自身比较）
-        overlap_mask = dist < 2 * self.radius - 1e-5                    # 判断是否存在重叠
-        return np.argwhere(overlap_mask)
+        i, j, dist = self.neighbor_pairs(2 * self.radius)
+        overlap = dist < 2 * self.radius - 1e-5 # 判断是否存在重叠
+        i, j = i[overlap], j[overlap]
+        if self.sleeping.any(): # 两个都在休眠的小球对无需修正
+            awake = ~(self.sleeping[i] & self.sleeping[j])
+            i, j = i[awake], j[awake]
+        # 与遍历距离矩阵的结果一致：(i, j) 与 (j, i) 都出现，并按字典序排列
+        pairs = np.column_stack([np.concatenate([i, j]), np.concatenate([j, i])])
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
 
     def adjust_overlapping_pair(self, i, j):
         """调整两个重叠小球的位置"""
-        delta = self.pos[i] - self.pos[j] # 方向向量
+        delta = minimum_image(self.pos[i] - self.pos[j], self.period) # 方向向量
         distance = np.linalg.norm(delta)
         if distance == 0: # 如果圆心重叠，随机确定一个方向向量
             delta = np.random.rand(2) - 0.5
@@ -197,26 +487,136 @@ class CollisionSimulator2D(Animator2D):
         overlap = (2 * self.radius - distance) / 2
         direction = delta / distance
 
-        # 根据质量分配移动比例
+        # 根据质量分配移动比例，休眠小球不动
         total_mass = self.mass[i] + self.mass[j]
-        self.pos[i] += direction * overlap * (self.mass[j] / total_mass)
-        self.pos[j] -= direction * overlap * (self.mass[i] / total_mass)
+        ratio_i, ratio_j = self.mass[j] / total_mass, self.mass[i] / total_mass
+        if self.sleeping[i]:
+            ratio_i, ratio_j = 0.0, 1.0
+        elif self.sleeping[j]:
+            ratio_i, ratio_j = 1.0, 0.0
+        self.pos[i] += direction * overlap * ratio_i
+        self.pos[j] -= direction * overlap * ratio_j
+
+    """
+    休眠
+    """
+    def update_sleep(self):
+        """
+        让静止的小球堆进入休眠
+
+        重力下贴地的小球每步都会在碰撞中翻转速度，瞬时速度并不小，因此用位移判断：
+        小球离开锚点超过 sleep_speed * dt * sleep_steps 时重置锚点与计数，
+        计数达到 sleep_steps 即说明这段时间内的平均速度低于 sleep_speed。
+
+        以接触关系划分小球堆(island)，只有当堆内所有活动小球都已静止，且堆贴着地面或压在
+        休眠小球上(无重力时不要求)，整堆才进入休眠。
+
+        只在活动小球与接触到的休眠小球上划分：休眠小球不动，彼此的接触关系就是入睡时记下的
+        小球堆标号，不必重新搜索，因此代价与活动小球数成正比，与静止的小球堆大小无关。
+        """
+        awake = np.flatnonzero(~self.sleeping)
+        tolerance = self.sleep_speed * self.dt * self.sleep_steps
+        pos = self.pos[awake]
+        drift = np.linalg.norm(minimum_image(pos - self.rest_pos[awake], self.period), axis=1)
+        moved = drift > tolerance
+        self.rest_pos[awake[moved]] = pos[moved]
+        self.calm_steps[awake] = np.where(moved, 0, self.calm_steps[awake] + 1)
+        if self.selected_ball is not None:
+            self.calm_steps[self.selected_ball] = 0 # 拖拽中的小球不休眠
+        if not (self.calm_steps[awake] >= self.sleep_steps).any():
+            return
+
+        i, j, _ = self.neighbor_pairs(2 * self.radius + self.contact_margin) # 不含两端都在休眠的点对
+        nodes = np.union1d(awake, np.concatenate([i, j])) # 活动小球与接触到的休眠小球，按编号排列
+        resting = nodes[self.sleeping[nodes]]
+        # 同一休眠小球堆中接触到的小球依次相连
+        resting = resting[np.argsort(self.island[resting], kind="stable")]
+        same = self.island[resting[1:]] == self.island[resting[:-1]]
+        i = np.searchsorted(nodes, np.concatenate([i, resting[:-1][same]]))
+        j = np.searchsorted(nodes, np.concatenate([j, resting[1:][same]]))
+        labels = connected_components(len(nodes), i, j)
+
+        sleeping = self.sleeping[nodes]
+        restless = ~sleeping & (self.calm_steps[nodes] < self.sleep_steps)
+        restless = np.bincount(labels, weights=restless, minlength=len(nodes)) > 0 # 堆内还有在运动的小球
+        if self.g != 0 and self.period is None:
+            on_floor = self.pos[nodes, 1] <= self.ymin + self.radius + self.contact_margin
+            grounded = np.bincount(labels, weights=on_floor | sleeping, minlength=len(nodes)) > 0
+        else:
+            grounded = np.ones(len(nodes), dtype=bool)
+
+        fall_asleep = ~restless[labels] & grounded[labels] & ~sleeping
+        if not fall_asleep.any():
+            return
+        # 入睡的堆并入与之接触的休眠小球堆(包括没有接触到的部分)，标号取堆中最小的节点编号
+        joined = np.isin(labels, labels[fall_asleep])
+        old, first = np.unique(self.island[nodes[joined & sleeping]], return_index=True)
+        new = nodes[labels[joined & sleeping]][first]
+        merged = self.sleeping & np.isin(self.island, old)
+        self.island[merged] = new[np.searchsorted(old, self.island[merged])]
+        self.island[nodes[joined]] = nodes[labels[joined]]
+
+        fall_asleep = nodes[fall_asleep]
+        self.sleeping[fall_asleep] = True
+        self.calm_steps[fall_asleep] = 0
+        self.vol[fall_asleep] = 0.0
+        self.sleeping_cells = None # 休眠集合改变，重建格子索引
+
+    def wake(self, idx):
+        """唤醒 idx 所在的整个小球堆"""
+        members = np.isin(self.island, self.island[idx]) & self.sleeping
+        self.sleeping[members] = False
+        self.calm_steps[members] = 0
+        self.rest_pos[members] = self.pos[members]
+        self.sleeping_cells = None # 休眠集合改变，重建格子索引
+
+    def wake_touched(self, i, j):
+        """
+        尚未静止的活动小球(或被拖拽的小球)碰到休眠小球时，唤醒其所在的堆
+
+        返回是否唤醒了小球堆
+        """
+        moving = self.calm_steps < self.sleep_steps
+        if self.selected_ball is not None:
+            moving[self.selected_ball] = True
+        hit = np.concatenate([
+            j[self.sleeping[j] & ~self.sleeping[i] & moving[i]],
+            i[self.sleeping[i] & ~self.sleeping[j] & moving[j]],
+        ])
+        if len(hit) > 0:
+            self.wake(hit)
+        return len(hit) > 0
 
     """
     初始化函数
     """
     def initialize_parameters(self):
-        """初始化物理参数"""
-        self.mass = np.random.uniform(1, 10, self.N) # 质量 (N)
-        # self.pos = self.gen_non_contact_balls() # 位置 (N, 2)
-        self.pos = np.column_stack([
-            np.random.uniform(self.xmin + self.radius, self.xmax - self.radius, self.N),
-            np.random.uniform(self.ymin + self.radius, self.ymax - self.radius, self.N),
-        ])
-        self.vol = np.column_stack([
-            np.random.uniform(0.0, 5.0, self.N),
-            np.random.uniform(0.0, 5.0, self.N),
-        ]) # 速度 (N, 2)
+        """初始化物理参数，给出场景时从场景载入(写时复制，修改不影响场景文件)"""
+        if self.scenario is not None:
+            self.mass = self.scenario["mass"]
+            self.pos = self.scenario["pos"]
+            self.vol = self.scenario["vol"]
+        else:
+            self.mass = np.random.uniform(1, 10, self.N) # 质量 (N)
+            if self.placement == "uniform":
+                self.pos = np.column_stack([
+                    np.random.uniform(self.xmin + self.radius, self.xmax - self.radius, self.N),
+                    np.random.uniform(self.ymin + self.radius, self.ymax - self.radius, self.N),
+                ])
+            else:
+                self.pos = self.gen_non_contact_balls() # 位置 (N, 2)
+            self.vol = np.column_stack([
+                np.random.uniform(0.0, 5.0, self.N),
+                np.random.uniform(0.0, 5.0, self.N),
+            ]) # 速度 (N, 2)
+        self.sleeping = np.zeros(self.N, dtype=bool)    # 是否休眠
+        self.calm_steps = np.zeros(self.N, dtype=int)   # 连续静止的步数
+        self.rest_pos = self.pos.copy()                 # 判断静止用的锚点
+        self.island = np.arange(self.N)                 # 所在小球堆的标号(只对休眠小球有意义)
+        self.sleeping_cells = None                      # 休眠小球的格子索引，休眠集合改变时清空
+        self.sleeping_ids = np.zeros(0, dtype=int)      # 建格子索引时的休眠小球编号
+        self.wall_impulse = 0.0                         # 墙壁受到的累计冲量
+        self.collision_count = 0                        # 小球间的累计碰撞次数
 
     def initialize_balls(self):
         """初始化小球图形"""
@@ -231,15 +631,16 @@ class CollisionSimulator2D(Animator2D):
         ]
         for ball in self.balls:
             self.ax.add_patch(ball)
+        self.register_artist("balls", self.balls, self.update_balls)
 
     """
     交互相关函数
     """
     def reset(self, event):
         """重置按钮的回调函数"""
-        self.initialize_parameters()
-        self.initialize_balls()
-        # self.energy = [(0.5 * self.mass[:, np.newaxis] * self.vol ** 2).sum()]
+        self.send_command("restart")
+        if not self.is_background:
+            self.initialize_balls()
 
     def on_press(self, event):
         """鼠标按下时选择小球"""
@@ -251,35 +652,109 @@ class CollisionSimulator2D(Animator2D):
             if dist <= self.radius:
                 self.dragging = True
                 self.selected_ball = idx
-                self.vol[idx] = [0, 0] # 拖拽的时候将速度清零
+                self.send_command("select_ball", idx)
                 break
 
     def on_motion(self, event):
         """鼠标拖动的时候更新小球的位置"""
         if not self.dragging or event.inaxes != self.ax:
             return
-        self.pos[self.selected_ball] = [
-            np.clip(event.xdata, self.xmin + self.radius, self.xmax - self.radius),
-            np.clip(event.ydata, self.ymin + self.radius, self.ymax - self.radius)
-        ]
-        self.balls[self.selected_ball].set_center(self.pos[self.selected_ball])
+        x = np.clip(event.xdata, self.xmin + self.radius, self.xmax - self.radius)
+        y = np.clip(event.ydata, self.ymin + self.radius, self.ymax - self.radius)
+        self.send_command("move_ball", self.selected_ball, x, y)
+        self.balls[self.selected_ball].set_center((x, y)) # 界面端立即响应，不等待下一帧
     
     def on_release(self, event):
         """鼠标释放时的操作"""
         self.dragging = False
         self.selected_ball = None
+        self.send_command("release_ball")
+
+    """
+    交互命令，在模拟端执行(后台运行时由 SimulationWorker 转发)
+    """
+    def restart(self):
+        """重新生成小球"""
+        self.initialize_parameters()
+        for observer in self.observers:
+            observer.reset()
+
+    def select_ball(self, idx):
+        """选中小球：速度清零，休眠时唤醒其所在的堆"""
+        self.selected_ball = idx
+        self.vol[idx] = [0, 0] # 拖拽的时候将速度清零
+        if self.sleeping[idx]:
+            self.wake(idx)     # 拖拽休眠的小球时唤醒其所在的堆
+
+    def move_ball(self, idx, x, y):
+        """拖拽小球到 (x, y)"""
+        self.pos[idx] = [x, y]
+
+    def release_ball(self):
+        """松开小球"""
+        self.selected_ball = None
+
+    def set_state(self, state):
+        """载入后台模拟的一帧，质量改变说明模拟端已重置，需要重新生成图形"""
+        restarted = not np.array_equal(state["mass"], self.mass)
+        super().set_state(state)
+        self.sleeping_cells = None # 休眠集合随状态一起改变
+        if restarted:
+            self.initialize_balls()
+            for observer in self.observers:
+                observer.reset()
 
     """
     其他函数
     """
+    def save_scenario(self, path):
+        """把当前状态保存为场景，之后可以用 scenario=path 复现"""
+        save_scenario(
+            path, self.pos, self.vol, self.mass, radius=self.radius,
+            xlim=[self.xmin, self.xmax], ylim=[self.ymin, self.ymax], boundary=self.boundary,
+        )
+
     def cal_momentum(self):
         """计算动量和"""
         return (self.vol * self.mass[:, np.newaxis]).sum(axis=0)
 
+    @property
+    def conserved(self):
+        """墙壁与重力会改变动量；无重力的周期性边界下动量守恒"""
+        if self.period is None:
+            return ("energy",)
+        return ("energy", "momentum") if self.g == 0 else ()
+
+    def diagnostic_quantities(self):
+        """能量、动量、角动量(相对原点)"""
+        # handle_gravity 中的加速度为 mass * g，对应的势能为 mass^2 * g * h
+        kinetic = 0.5 * (self.mass * (self.vol ** 2).sum(axis=1)).sum()
+        potential = (self.mass ** 2 * self.g * (self.pos[:, 1] - self.ymin)).sum()
+        angular = (self.mass * (self.pos[:, 0] * self.vol[:, 1] - self.pos[:, 1] * self.vol[:, 0])).sum()
+        return {
+            "energy": kinetic + potential,
+            "momentum": self.cal_momentum(),
+            "angular_momentum": angular,
+        }
+
 if __name__ == "__main__":
     # 使用示例
     # 这里的动量和不相等不是因为碰撞过程计算有误，而是因为小球会被墙反弹，反弹之后会改变其动量
     simulator = CollisionSimulator2D(N=5)
+    # 周期性边界下的体相气体
+    # simulator = CollisionSimulator2D(N=100, boundary="periodic"); simulator.g = 0
+    # 静止的小球堆休眠，只有活动小球参与计算
+    # simulator = CollisionSimulator2D(N=60, sleep=True)
+    # 连续碰撞检测，步长可以放大一个数量级
+    # simulator = CollisionSimulator2D(N=20, ccd=True); simulator.dt = 1e-2
+    # 泊松圆盘采样生成互不重叠的小球；保存为场景后可以原样复现
+    # simulator = CollisionSimulator2D(N=60, placement="poisson"); simulator.save_scenario("./example/balls")
+    # simulator = CollisionSimulator2D(scenario="./example/balls")
     simulator.play()
+    # 物理部分在后台进程中运行，界面只负责绘制与交互
+    # simulator.play(background="process", steps_per_frame=5)
+    # 多进程区域分解：盒子分为 4 个条带，各由一个工作进程推进
+    # simulator = CollisionSimulator2D(xlim=[0, 8], ylim=[0, 8], N=2000, placement="poisson", domains=4)
+    # simulator.play(background="thread", steps_per_frame=20)
     # simulator.save_animation("./example/collision_2d.mp4", fps=30, interval=1, frames=500, dpi=200)
 
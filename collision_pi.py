@@ -11,6 +11,8 @@ import matplotlib.animation as animation
 from animator import Animator2D
 
 class CollisionSimulator(Animator2D):
+    conserved = ("energy",)
+
     def __init__(self, m1=1.0, m2=1.0, w=0.5, dt=0.1, x1=0.0, v1=0.0, x2=5.0, v2=-2.0):
         super(CollisionSimulator, self).__init__()
         # 参数初始化
@@ -43,9 +45,6 @@ class CollisionSimulator(Animator2D):
         """更新位置"""
         self.x1 += self.v1 * self.dt
         self.x2 += self.v2 * self.dt
-        
-        self.rect1.set_x(self.x1 - self.w/2)
-        self.rect2.set_x(self.x2 - self.w/2)
     
     def handle_wall_collision(self):
         """处理与墙的碰撞"""
@@ -67,8 +66,15 @@ class CollisionSimulator(Animator2D):
             self.v2 = ((self.m2 - self.m1)*u2 + 2*self.m1*u1) / (self.m1 + self.m2)
             self.collision_count += 1  # 增加碰撞计数
     
-    def update(self, frame):
-        """每一帧更新时调用的方法"""
+    def diagnostic_quantities(self):
+        """动能与动量，墙壁碰撞会反转动量，故只检查能量"""
+        return {
+            "energy": 0.5 * self.m1 * self.v1**2 + 0.5 * self.m2 * self.v2**2,
+            "momentum": self.m1 * self.v1 + self.m2 * self.v2,
+        }
+
+    def step(self):
+        """推进一个物理步长"""
         # 更新位置
         self.update_positions()
         
@@ -78,6 +84,11 @@ class CollisionSimulator(Animator2D):
         # 处理方块间的碰撞
         self.handle_block_collision()
 
+    def draw(self):
+        """更新方块位置与碰撞次数"""
+        self.rect1.set_x(self.x1 - self.w/2)
+        self.rect2.set_x(self.x2 - self.w/2)
+
         # 更新文本框中的碰撞次数
         self.text_box.set_text(f'Collisions: {self.collision_count}')
         
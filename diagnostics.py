@@ -0,0 +1,83 @@
+#------------------------------------------------
+# name: diagnostics.py
+# author: taster
+# date: 2025-04-12 10:21:37 星期六
+# id: 1c0f6a8e5b2d4f7a9e3c8b6d0a4f2e71
+# description: 守恒量监测
+#------------------------------------------------
+from collections import deque
+import numpy as np
+
+
+class ConservationMonitor:
+    """
+    守恒量监测器
+
+    每隔 stride 个物理步长，调用模拟器的 diagnostic_quantities() 取得能量、动量、角动量等量，
+    写入定长的环形缓冲区，并与第一次采样的参考值比较，漂移超过 atol + rtol * |参考值| 时记录一次违规。
+
+    参数:
+        stride: 采样间隔(物理步数)
+        capacity: 环形缓冲区长度，超过后覆盖最旧的样本
+        rtol: 允许的相对漂移
+        atol: 允许的绝对漂移，参考值接近 0 时起作用
+        watch: 需要检查漂移的量，None 表示使用模拟器声明的 conserved
+    """
+    def __init__(self, stride=10, capacity=1000, rtol=1e-2, atol=1e-6, watch=None):
+        self.stride   = stride
+        self.capacity = capacity
+        self.rtol     = rtol
+        self.atol     = atol
+        self.watch    = watch
+        self.reset()
+
+    def reset(self):
+        """清空缓冲区与参考值，在模拟器重置后调用"""
+        self.count      = 0                                      # 总采样次数
+        self.steps      = np.zeros(self.capacity, dtype=np.int64) # 采样时的步数
+        self.buffers    = {}                                     # 量名 -> (capacity, dim) 数组
+        self.reference  = {}                                     # 量名 -> 参考值
+        self.drift      = {}                                     # 量名 -> 最近一次的相对漂移
+        self.violations = deque(maxlen=self.capacity)            # (步数, 量名, 相对漂移)
+
+    def observe(self, simulator):
+        """由 Animator2D.advance 按步长调用"""
+        watch = self.watch if self.watch is not None else simulator.conserved
+        self.record(simulator.step_count, simulator.diagnostic_quantities(), watch)
+
+    def record(self, step, quantities, watch=()):
+        """写入一次采样"""
+        slot = self.count % self.capacity
+        self.steps[slot] = step
+        for name, value in quantities.items():
+            value = np.atleast_1d(np.asarray(value, dtype=float))
+            if name not in self.buffers:
+                self.buffers[name] = np.full((self.capacity, value.size), np.nan)
+                self.reference[name] = value.copy()
+            self.buffers[name][slot] = value
+
+            # 与 np.isclose 相同的判据：|x - x0| > atol + rtol * |x0| 视为漂移
+            reference = self.reference[name]
+            error = np.max(np.abs(value - reference))
+            scale = np.max(np.abs(reference))
+            self.drift[name] = error / max(scale, self.atol)
+            if name in watch and error > self.atol + self.rtol * scale:
+                self.violations.append((step, name, self.drift[name]))
+        self.count += 1
+
+    def latest(self, name):
+        """最近一次采样的值"""
+        if self.count == 0 or name not in self.buffers:
+            return None
+        return self.buffers[name][(self.count - 1) % self.capacity]
+
+    def history(self, name):
+        """按时间顺序返回缓冲区中的 (步数, 数值)"""
+        n = min(self.count, self.capacity)
+        order = (np.arange(n) + self.count - n) % self.capacity
+        return self.steps[order], self.buffers[name][order]
+
+    @property
+    def drifting(self):
+        """是否出现过超出阈值的漂移"""
+        return len(self.violations) > 0
@@ -0,0 +1,263 @@
+#------------------------------------------------
+# name: domain.py
+# author: taster
+# date: 2025-06-09 20:41:26 星期一
+# id: 21aa8f4d30514492b3c7cd66255118cf
+# description: 二维碰撞的多进程区域分解：每个进程负责一块区域内的小球，经共享内存交换边界
+#------------------------------------------------
+import atexit
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+"""
+把盒子划分为 列数 x 行数 块区域(只给出一个数时为沿 x 方向的条带)，每个工作进程拥有
+位于自己区域内的小球，负责推进它们：墙壁碰撞、小球间碰撞、重力、位置更新与重叠修正，
+与 CollisionSimulator2D.step 完全相同，实际上就是在本地的小球子集上调用 step。
+
+全部小球的位置、速度、质量与所属区域放在共享内存中，每一步分两段，用屏障同步：
+1. 读：每个进程取出自己拥有的小球，以及其他区域中离本区域不超过 halo 的小球(幽灵小球)，
+   所有进程读完后才能开始写
+2. 写：在本地子集上推进一步，只把自己拥有的小球写回，并按新位置写入所属区域。
+   小球越过区域边界时只需改写所属区域，下一步由新的区域读取，即完成迁移
+halo = 4r + 4 v_max dt：碰撞与重叠的距离为 2r，再留出一层邻居(幽灵小球本身先与
+更外侧的小球碰撞)与一步之内的位移。
+
+本地子集按全局编号排序，小球对的处理顺序与单进程时相同；跨越边界的一对小球由两侧的进程
+各算一次，用的是同样的数据与同样的运算，结果逐位相同。因此一块区域时与单进程的结果逐位相同，
+多块区域时只有跨越边界的多体接触(同一步内一串小球接连碰撞)在链条超出 halo 时才会不同。
+
+不支持休眠与连续碰撞检测(两者都需要全局的事件顺序或小球堆)。
+"""
+
+RUN, STOP = 1, 2 # 命令
+
+
+class SharedArrays:
+    """
+    按 layout 依次放在一块共享内存中的若干数组
+
+    与 SharedFrameBuffer 不同，只有一份数据，读写的先后由调用方的屏障保证。
+    """
+    def __init__(self, layout, name=None):
+        """
+        参数:
+            layout: 量名 -> (形状, dtype)
+            name: 已存在的共享内存名，None 时新建
+        """
+        self.layout = {key: (tuple(shape), np.dtype(dtype)) for key, (shape, dtype) in layout.items()}
+        size = sum(int(np.prod(shape)) * dtype.itemsize for shape, dtype in self.layout.values())
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.arrays = {}
+        offset = 0
+        for key, (shape, dtype) in self.layout.items():
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            offset += int(np.prod(shape)) * dtype.itemsize
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self):
+        """释放共享内存，创建者负责删除"""
+        self.arrays = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def tile_index(pos, lower, size, tiles):
+    """位置所在区域的编号，区域按 (列, 行) 编号为 列 * 行数 + 行"""
+    cell = np.floor((pos - lower) / size * tiles).astype(np.int64)
+    cell = np.clip(cell, 0, np.asarray(tiles) - 1)
+    return cell[:, 0] * tiles[1] + cell[:, 1]
+
+
+def interval_gap(x, lo, hi, period=None):
+    """坐标 x 到区间 [lo, hi) 的距离，period 不为 None 时按周期计算"""
+    if period is None:
+        return np.maximum(np.maximum(lo - x, x - hi), 0.0)
+    offset = (x - lo) % period
+    width = hi - lo
+    return np.where(offset < width, 0.0, np.minimum(offset - width, period - offset))
+
+
+def run_domain(rank, simulator, tiles, shm_name, layout, start, done, sync):
+    """
+    工作进程：等待主进程的命令，推进若干步，每一步先读入本区域与幽灵小球，同步后推进并写回
+
+    simulator 是模拟器的一份副本，只使用其中的参数与物理方法，状态每一步从共享内存读入。
+    """
+    shared = SharedArrays(layout, name=shm_name)
+    pos, vol, mass, owner = shared["pos"], shared["vol"], shared["mass"], shared["owner"]
+    speed, counters = shared["speed"], shared["counters"]
+    column, row = divmod(rank, tiles[1])
+    width = simulator.size / tiles
+    lo = simulator.lower + width * (column, row) # 本区域的左下角
+    hi = lo + width                              # 本区域的右上角
+    period = simulator.period if simulator.period is not None else (None, None)
+    simulator.selected_ball = None
+    try:
+        while True:
+            start.wait()
+            command, n_steps = shared["command"]
+            if command == STOP:
+                break
+            for _ in range(n_steps):
+                # 读：本区域的小球与 halo 内的幽灵小球，按全局编号排序
+                halo = 4 * simulator.radius + 4 * speed.max() * simulator.dt
+                near = (interval_gap(pos[:, 0], lo[0], hi[0], period[0]) < halo) & \
+                       (interval_gap(pos[:, 1], lo[1], hi[1], period[1]) < halo)
+                ids = np.flatnonzero(near | (owner == rank))
+                owned = owner[ids] == rank
+                simulator.pos = pos[ids]
+                simulator.vol = vol[ids]
+                simulator.mass = mass[ids]
+                simulator.N = len(ids)
+                simulator.sleeping = np.zeros(len(ids), dtype=bool)
+                simulator.owned = owned
+                if simulator.verlet is not None:
+                    simulator.verlet.reset() # 本地子集每一步都不同，近邻表在本步内重建
+                simulator.wall_impulse, simulator.collision_count = 0.0, 0
+                sync.wait() # 所有进程读完后才能写
+
+                # 写：推进一步，只写回本区域拥有的小球
+                simulator.step()
+                mine = ids[owned]
+                pos[mine] = simulator.pos[owned]
+                vol[mine] = simulator.vol[owned]
+                moved_to = tile_index(simulator.pos[owned], simulator.lower, simulator.size, tiles)
+                owner[mine] = moved_to
+                speed[rank] = np.sqrt((simulator.vol[owned] ** 2).sum(axis=1).max()) if len(mine) else 0.0
+                counters[rank] += (simulator.wall_impulse, simulator.collision_count, np.count_nonzero(moved_to != rank))
+                sync.wait() # 所有进程写完后才能读下一步
+            done.wait()
+    except BaseException:
+        # 让等待中的其他进程与主进程退出等待，而不是永远卡在屏障上
+        for barrier in (start, done, sync):
+            barrier.abort()
+        raise
+    finally:
+        shared.close()
+
+
+class DomainDecomposition:
+    """
+    在多个工作进程中按区域分解推进 CollisionSimulator2D
+
+    每次 advance 先把模拟器的状态写入共享内存(其间可能有拖拽、重置等交互)，
+    各进程推进 n_steps 步后再读回。工作进程在第一次 advance 时启动。
+    """
+    def __init__(self, simulator, tiles):
+        """
+        参数:
+            simulator: CollisionSimulator2D，不支持休眠与连续碰撞检测
+            tiles: 区域数，整数 K 为沿 x 方向的 K 个条带，(列数, 行数) 为矩形区域
+        """
+        assert not simulator.ccd, "区域分解不支持连续碰撞检测"
+        assert not simulator.allow_sleep, "区域分解不支持休眠"
+        self.simulator  = simulator
+        self.tiles      = np.array((tiles, 1) if np.ndim(tiles) == 0 else tiles, dtype=np.int64)
+        self.size       = int(self.tiles.prod()) # 区域(工作进程)数
+        self.migrations = 0                      # 小球越过区域边界的累计次数
+        self.running    = False
+
+    def start(self):
+        """创建共享内存并启动工作进程"""
+        if mp.current_process().daemon:
+            raise RuntimeError("后台进程中不能再启动区域分解的工作进程，请使用 background=\"thread\"")
+        N, K = self.simulator.N, self.size
+        layout = {
+            "command": ((2,), np.int64),       # [命令, 步数]
+            "pos": ((N, 2), np.float64),
+            "vol": ((N, 2), np.float64),
+            "mass": ((N,), np.float64),
+            "owner": ((N,), np.int64),         # 所属区域
+            "speed": ((K,), np.float64),       # 各区域小球的最大速率
+            "counters": ((K, 3), np.float64),  # 各区域的墙壁冲量、碰撞次数、迁出的小球数
+        }
+        self.shared = SharedArrays(layout)
+        self.start_barrier = mp.Barrier(K + 1) # 主进程发出命令
+        self.done_barrier = mp.Barrier(K + 1)  # 工作进程完成命令
+        sync = mp.Barrier(K)                   # 工作进程之间每一步的读写同步
+        self.processes = [
+            mp.Process(
+                target=run_domain, daemon=True,
+                args=(rank, self.simulator, self.tiles, self.shared.name, layout, self.start_barrier, self.done_barrier, sync),
+            )
+            for rank in range(K)
+        ]
+        for process in self.processes:
+            process.start()
+        self.running = True
+        atexit.register(self.stop)
+        return self
+
+    def advance(self, n_steps=1):
+        """各工作进程推进 n_steps 步，结果写回模拟器"""
+        if not self.running:
+            self.start()
+        sim, shared = self.simulator, self.shared
+        if sim.selected_ball is not None:
+            # 被拖拽的小球保持不动
+            selected_pos = sim.pos[sim.selected_ball].copy()
+            selected_vol = sim.vol[sim.selected_ball].copy()
+        shared["pos"][:] = sim.pos
+        shared["vol"][:] = sim.vol
+        shared["mass"][:] = sim.mass
+        shared["owner"][:] = tile_index(sim.pos, sim.lower, sim.size, self.tiles)
+        shared["speed"][:] = np.sqrt((sim.vol ** 2).sum(axis=1).max()) if sim.N else 0.0
+        shared["counters"][:] = 0
+        shared["command"][:] = (RUN, n_steps)
+        self.start_barrier.wait()
+        self.done_barrier.wait()
+        sim.pos = shared["pos"].copy()
+        sim.vol = shared["vol"].copy()
+        if sim.selected_ball is not None:
+            sim.pos[sim.selected_ball] = selected_pos
+            sim.vol[sim.selected_ball] = selected_vol
+        wall_impulse, collision_count, migrations = shared["counters"].sum(axis=0)
+        sim.wall_impulse += wall_impulse
+        sim.collision_count += int(collision_count)
+        self.migrations += int(migrations)
+
+    def stop(self):
+        """停止工作进程并释放共享内存"""
+        if not self.running:
+            return
+        self.running = False
+        atexit.unregister(self.stop)
+        self.shared["command"][:] = (STOP, 0)
+        try:
+            self.start_barrier.wait(timeout=5)
+        except Exception:
+            pass # 工作进程已经退出
+        for process in self.processes:
+            process.join(timeout=5)
+        self.shared.close()
+
+
+if __name__ == "__main__":
+    import time
+    from collision_2d import CollisionSimulator2D
+
+    # 与单进程的结果比较，并比较推进速度
+    N, steps = 2000, 100
+    results = {}
+    for domains in (None, 1, 2, 4):
+        np.random.seed(0)
+        simulator = CollisionSimulator2D(xlim=[0, 8], ylim=[0, 8], N=N, placement="poisson", boundary="periodic", domains=domains)
+        simulator.g = 0
+        simulator.advance(1) # 启动工作进程
+        start = time.perf_counter()
+        simulator.advance(steps)
+        elapsed = time.perf_counter() - start
+        results[domains] = simulator.pos
+        same = np.all(simulator.pos == results[None], axis=1).mean()
+        migrations = simulator.domain.migrations if simulator.domain is not None else 0
+        print(f"区域 {domains}: {elapsed:.2f} 秒，与单进程逐位相同的小球 {same:.1%}，迁移 {migrations} 次")
+        simulator.stop_domains()
@@ -11,16 +11,67 @@ from matplotlib.widgets import Button
 import matplotlib.animation as animation
 import matplotlib.path as path
 import numpy as np
+from functools import partial
 from animator import Animator2D
+from lookahead import TrajectoryBuffer, euler_batch_step, euler_trajectory
+from lyapunov import angle_grid, lyapunov_exponent, lyapunov_map
+from phase_portrait import PhaseDensity
 import matplotlib.gridspec as gridspec
 
 
+def double_pendulum_angular_accelerations(theta1, theta2, theta1_dot, theta2_dot, g, L1, L2, m1, m2):
+    """双摆两个摆的角加速度，各量可以是浮点数或形状相同的数组"""
+    delta_theta = theta1 - theta2  # 修正角度差方向
+
+    # 公共分母计算
+    denom = 2 * m1 + m2 - m2 * np.cos(2 * delta_theta)
+
+    # 第一个摆的角加速度
+    theta1_double_dot = (
+        -g * (2 * m1 + m2) * np.sin(theta1)
+        - m2 * g * np.sin(theta1 - 2 * theta2)
+        - 2 * np.sin(delta_theta) * m2 * (
+            theta2_dot**2 * L2
+            + theta1_dot**2 * L1 * np.cos(delta_theta)
+        )
+    ) / (L1 * denom)
+
+    # 第二个摆的角加速度
+    theta2_double_dot = (
+        2 * np.sin(delta_theta) * (
+            theta1_dot**2 * L1 * (m1 + m2)
+            + g * (m1 + m2) * np.cos(theta1)
+            + theta2_dot**2 * L2 * m2 * np.cos(delta_theta)
+        )
+    ) / (L2 * denom)
+    return theta1_double_dot, theta2_double_dot
+
+
+def double_pendulum_accelerations(q, q_dot, g, L1, L2, m1, m2):
+    """
+    双摆的角加速度，q = [theta1, theta2]，q_dot = [theta1_dot, theta2_dot]
+
+    最后一维为自由度，前面的维度可以是任意批量，用于一次计算整片初始条件。
+    """
+    accelerations = double_pendulum_angular_accelerations(
+        q[..., 0], q[..., 1], q_dot[..., 0], q_dot[..., 1], g, L1, L2, m1, m2,
+    )
+    return np.stack(accelerations, axis=-1)
+
+
 class DoublePendulum(Animator2D):
     """双摆系统"""
     def __init__(self, 
                  L1=1.0, L2=1.0, 
                  m1=1.0, m2=1.0,
-                 damping=0.998):
+                 damping=0.998,
+                 lookahead=False,
+                 phase_decay=1.0):
+        """
+        参数:
+            lookahead: 是否预先成段计算轨迹，动画每一步只从缓冲中取出下一个状态
+            phase_decay: 相图密度每个新样本的衰减系数，1 表示保留全部历史
+        """
         super(DoublePendulum, self).__init__()
         # 物理参数
         self.g = 9.8               # 重力加速度
@@ -32,7 +83,8 @@ class DoublePendulum(Animator2D):
         # 系统变量
         # self.theta1, self.theta2         = theta1, theta2  # 初始角度
         # self.theta1_dot, self.theta2_dot = 0.0, 0.0        # 角速度
-        self.variable_added = False # 动画部件是否已被添加过
+        self.lookahead = TrajectoryBuffer(self.trajectory) if lookahead else None # 预计算轨迹缓冲
+        self.phase = PhaseDensity([-np.pi, np.pi], [-10, 10], colors=("red", "blue"), decay=phase_decay) # 两个摆的相图密度
         self.random_init()
 
         self.initialize_figure([-2.5, 2.5], [-2.5, 2.5], figsize=(8, 8), title="Double Pendulum Chaos Demo")  # 初始化画布
@@ -50,8 +102,8 @@ class DoublePendulum(Animator2D):
         self.ax.set_title("Single Pendulum")
 
         # 配置相图
-        self.ax_phase.set(xlim=[-10, 10], ylim=[-10, 10], xlabel=r'$\theta$', ylabel=r'$\dot{\theta}$')
-        self.ax_phase.set_aspect('equal')
+        self.ax_phase.set(xlim=self.phase.xlim, ylim=self.phase.ylim, xlabel=r'$\theta$', ylabel=r'$\dot{\theta}$')
+        self.ax_phase.set_aspect('auto') # 角度只跨 2π，等比例时面板会很窄
         self.ax_phase.grid(True)
         self.ax_phase.set_title("Phase Diagram")
 
@@ -62,6 +114,25 @@ class DoublePendulum(Animator2D):
 
     def reset(self, event):
         self.random_init()
+        self.monitor.reset()
+        self.schedule.invalidate()
+
+    @property
+    def conserved(self):
+        """无阻尼时机械能守恒"""
+        return ("energy",) if self.damping == 1.0 else ()
+
+    def diagnostic_quantities(self):
+        """机械能与角动量(相对悬挂点)"""
+        (x1, y1), (x2, y2) = self.get_positions()
+        vx1 = self.L1 * self.theta1_dot * np.cos(self.theta1)
+        vy1 = self.L1 * self.theta1_dot * np.sin(self.theta1)
+        vx2 = vx1 + self.L2 * self.theta2_dot * np.cos(self.theta2)
+        vy2 = vy1 + self.L2 * self.theta2_dot * np.sin(self.theta2)
+        kinetic = 0.5 * self.m1 * (vx1 ** 2 + vy1 ** 2) + 0.5 * self.m2 * (vx2 ** 2 + vy2 ** 2)
+        potential = self.g * (self.m1 * y1 + self.m2 * y2)
+        angular = self.m1 * (x1 * vy1 - y1 * vx1) + self.m2 * (x2 * vy2 - y2 * vx2)
+        return {"energy": kinetic + potential, "angular_momentum": angular}
 
     def random_init(self):
         # 系统变量
@@ -69,38 +140,40 @@ class DoublePendulum(Animator2D):
         self.theta2 = np.random.uniform(-np.pi, np.pi)
         self.theta1_dot = 0.0 # 角速度
         self.theta2_dot = 0.0
-        self.theta1_history = []
-        self.theta2_history = []
-        self.theta1_dot_history = []
-        self.theta2_dot_history = []
+        self.phase.reset() # 清空相图
+        if self.lookahead is not None:
+            self.lookahead.reset(*self.get_coordinates())
 
     def plot_variable(self):
-        """依据系统变量绘制动画部件"""
-        # 创建图形元素
-        # 更新图形
+        """创建动画部件，并登记各自的刷新频率：摆每帧更新，相图每 5 帧更新"""
         pos1, pos2 = self.get_positions()
-
+        # 杆的 Path 只创建一次，之后原地修改端点
         pole1 = path.Path([(0, 0), pos1], [path.Path.MOVETO, path.Path.LINETO])
         pole2 = path.Path([pos1, pos2], [path.Path.MOVETO, path.Path.LINETO])
-        if not self.variable_added:
-            self.ball1 = Circle(pos1, radius=0.08, color="red", zorder=3)
-            self.ball2 = Circle(pos2, radius=0.08, color="blue", zorder=3)
-            self.rod1 = PathPatch(pole1, lw=2, edgecolor="gray", facecolor='none')
-            self.rod2 = PathPatch(pole2, lw=2, edgecolor="gray", facecolor='none')
-            for patch in [self.ball1, self.ball2, self.rod1, self.rod2]:
-                self.ax.add_patch(patch)
-            self.variable_added = True
-            # 绘制相图
-            self.phase1, = self.ax_phase.plot(self.theta1_history, self.theta1_dot_history, 'r-', lw=1)
-            self.phase2, = self.ax_phase.plot(self.theta2_history, self.theta2_dot_history, 'b-', lw=1)
-        else:
-            self.rod1.set_path(pole1)
-            self.rod2.set_path(pole2)
-            self.ball1.set_center(pos1)
-            self.ball2.set_center(pos2)
-            # 绘制相图
-            self.phase1.set_data(self.theta1_history, self.theta1_dot_history)
-            self.phase2.set_data(self.theta2_history, self.theta2_dot_history)
+        self.ball1 = Circle(pos1, radius=0.08, color="red", zorder=3)
+        self.ball2 = Circle(pos2, radius=0.08, color="blue", zorder=3)
+        self.rod1 = PathPatch(pole1, lw=2, edgecolor="gray", facecolor='none')
+        self.rod2 = PathPatch(pole2, lw=2, edgecolor="gray", facecolor='none')
+        for patch in [self.ball1, self.ball2, self.rod1, self.rod2]:
+            self.ax.add_patch(patch)
+        self.register_artist("pendulum", [self.rod1, self.rod2, self.ball1, self.ball2], self.update_pendulum)
+        if self.ax_phase is not None:
+            # 相图为固定分辨率的密度图像，两个摆分别为红色与蓝色，绘制耗时不随运行时间增长
+            self.phase_image = self.ax_phase.imshow(self.phase.image(), extent=self.phase.extent, origin="lower", interpolation="nearest", aspect="auto")
+            self.register_artist("phase", self.phase_image, self.update_phase, every=5)
+
+    def update_pendulum(self):
+        """更新摆锤与杆，杆的 Path 原地修改而不重建"""
+        pos1, pos2 = self.get_positions()
+        self.rod1.get_path().vertices[1] = pos1
+        self.rod2.get_path().vertices[:] = pos1, pos2
+        self.rod1.stale = self.rod2.stale = True
+        self.ball1.set_center(pos1)
+        self.ball2.set_center(pos2)
+
+    def update_phase(self):
+        """更新相图"""
+        self.phase_image.set_data(self.phase.image())
 
     def get_positions(self):
         """计算两个摆锤的坐标"""
@@ -110,55 +183,75 @@ class DoublePendulum(Animator2D):
         y2 = y1 - self.L2 * np.cos(self.theta2)
         return (x1, y1), (x2, y2)
 
-    def update(self, frame):
-        """更新动画帧"""
-        # 更新系统变量
-        delta_theta = self.theta1 - self.theta2  # 修正角度差方向
+    def get_coordinates(self):
+        """广义坐标与广义速度"""
+        return [self.theta1, self.theta2], [self.theta1_dot, self.theta2_dot]
 
-        # 公共分母计算
-        denom = 2 * self.m1 + self.m2 - self.m2 * np.cos(2 * delta_theta)
-        
-        # 第一个摆的角加速度
-        theta1_double_dot = (
-            -self.g * (2 * self.m1 + self.m2) * np.sin(self.theta1)
-            - self.m2 * self.g * np.sin(self.theta1 - 2 * self.theta2)
-            - 2 * np.sin(delta_theta) * self.m2 * (
-                self.theta2_dot**2 * self.L2 
-                + self.theta1_dot**2 * self.L1 * np.cos(delta_theta)
-            )
-        ) / (self.L1 * denom)
-
-        # 第二个摆的角加速度
-        theta2_double_dot = (
-            2 * np.sin(delta_theta) * (
-                self.theta1_dot**2 * self.L1 * (self.m1 + self.m2)
-                + self.g * (self.m1 + self.m2) * np.cos(self.theta1)
-                + self.theta2_dot**2 * self.L2 * self.m2 * np.cos(delta_theta)
+    @property
+    def damping_factor(self):
+        """每步乘在速度上的阻尼系数"""
+        return self.damping
+
+    def equations(self):
+        """绑定了当前参数的加速度函数"""
+        return partial(double_pendulum_accelerations, g=self.g, L1=self.L1, L2=self.L2, m1=self.m1, m2=self.m2)
+
+    def trajectory(self, q, q_dot, n_steps):
+        """从 (q, q_dot) 出发推进 n_steps 步，返回 (n_steps, 2, ..., 2) 的轨迹"""
+        return euler_trajectory(self.equations(), q, q_dot, n_steps, self.dt, self.damping)
+
+    def lyapunov_exponent(self, n_steps=5000, **kwargs):
+        """从当前状态出发的最大李雅普诺夫指数"""
+        return float(lyapunov_exponent(self.equations(), *self.get_coordinates(), n_steps, self.dt, self.damping, **kwargs))
+
+    def lyapunov_map(self, resolution=100, n_steps=5000, **kwargs):
+        """
+        以两个初始角度为坐标(初始角速度为 0)的最大李雅普诺夫指数图
+
+        返回 (图像, extent)，图像的行对应 theta2，列对应 theta1；kwargs 传递给 lyapunov.lyapunov_map
+        """
+        grid, extent = angle_grid(resolution)
+        image = lyapunov_map(self.equations(), grid, np.zeros_like(grid), self.dt, self.damping, n_steps=n_steps, **kwargs)
+        return image, extent
+
+    def set_coordinates(self, q, q_dot):
+        """写入广义坐标与广义速度，并记录相图数据"""
+        self.theta1, self.theta2 = float(q[0]), float(q[1])
+        self.theta1_dot, self.theta2_dot = float(q_dot[0]), float(q_dot[1])
+
+        # 记录相图样本
+        self.phase.push((self.theta1, self.theta1_dot), (self.theta2, self.theta2_dot))
+
+    def step(self):
+        """推进一个物理步长"""
+        # 更新系统变量(欧拉法，阻尼在 euler_trajectory 中施加)
+        if self.lookahead is not None:
+            q, q_dot = self.lookahead.next()
+        else:
+            # 单步直接用浮点数计算，避免小数组的开销，与 euler_trajectory 逐位一致
+            a1, a2 = double_pendulum_angular_accelerations(
+                self.theta1, self.theta2, self.theta1_dot, self.theta2_dot, self.g, self.L1, self.L2, self.m1, self.m2,
             )
-        ) / (self.L2 * denom)
+            theta1_dot = self.theta1_dot + a1 * self.dt
+            theta2_dot = self.theta2_dot + a2 * self.dt
+            q = [self.theta1 + theta1_dot * self.dt, self.theta2 + theta2_dot * self.dt]
+            q_dot = [theta1_dot * self.damping, theta2_dot * self.damping]
+        self.set_coordinates(q, q_dot)
 
-        # 欧拉法更新角速度
-        self.theta1_dot += theta1_double_dot * self.dt
-        self.theta2_dot += theta2_double_dot * self.dt
-        
-        # 更新角度（注意阻尼）
-        self.theta1 += self.theta1_dot * self.dt
-        self.theta2 += self.theta2_dot * self.dt
-        self.theta1_dot *= self.damping
-        self.theta2_dot *= self.damping
-
-        # 更新相图
-        self.theta1_history.append(self.theta1)
-        self.theta2_history.append(self.theta2)
-        self.theta1_dot_history.append(self.theta1_dot)
-        self.theta2_dot_history.append(self.theta2_dot)
-
-        # 更新图形
-        self.plot_variable()
-        return self.rod1, self.rod2, self.ball1, self.ball2, self.phase1, self.phase2
+    @classmethod
+    def step_batch(cls, simulators):
+        """参数不同的多个双摆作为一个批量推进一步"""
+        if any(sim.lookahead is not None for sim in simulators):
+            return super().step_batch(simulators)
+        parameters = {name: [getattr(sim, name) for sim in simulators] for name in ("g", "L1", "L2", "m1", "m2")}
+        euler_batch_step(simulators, double_pendulum_accelerations, parameters, [sim.damping for sim in simulators])
 
 if __name__ == "__main__":
     # 示例：创建初始角度为 170 度的混沌双摆
     pendulum = DoublePendulum(L1=1.0, L2=1.0, damping=1.0)
+    # 预先成段计算轨迹，每帧只取出缓冲中的下一个状态
+    # pendulum = DoublePendulum(L1=1.0, L2=1.0, damping=1.0, lookahead=True)
     pendulum.play(interval=3)
+    # 按真实时间播放：每帧的步数随机器快慢自动调整，落后时跳过绘制
+    # print(pendulum.play(interval=16, realtime=1.0)) # 关闭窗口后输出实际速率等统计
     # pendulum.save_animation("./example/double_pendulum.mp4", fps=60, interval=1, frames=1000, dpi=200)
@@ -0,0 +1,284 @@
+#------------------------------------------------
+# name: export.py
+# author: taster
+# date: 2025-05-10 16:12:48 星期六
+# id: 6c2e9b0f4d7a41858e3b1f5a0c9d27e4
+# description: 增量 GIF 导出
+#------------------------------------------------
+import os
+import struct
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+"""
+动画中通常只有少数部件在动，网格、墙壁、坐标轴等静态背景占据了大部分画面。
+这里的导出流程：
+1. 背景只渲染一次，之后每帧用 blit 恢复背景并只绘制 draw() 返回的部件；
+2. 用前几帧一次性计算全局调色板，之后每帧只需查表，查找表按需填充；
+3. 每帧只写入与上一帧相比发生变化的矩形，矩形内未变化的像素设为透明色，
+   帧边写边落盘，内存中只保留当前帧与已显示的画面。
+"""
+
+TRANSPARENT = 255 # 保留给透明色的调色板下标，同时在查找表中表示尚未查询的颜色
+MIN_DURATION = 2  # 每帧的最短显示时长(1/100 秒)，多数解码器把更短的时长当作 1/10 秒
+
+
+def build_palette(samples, colors=TRANSPARENT, exact=64):
+    """
+    由若干帧 (H, W, 3) 的采样计算全局调色板，返回 (n, 3) 的 uint8 数组
+
+    出现最多的 exact 种颜色(背景、网格、部件的填充色)原样保留，其余名额由中位切分给出，
+    用于抗锯齿边缘等过渡色。
+    """
+    pixels = np.concatenate([rgb.reshape(-1, 3) for rgb in samples])
+    key = (pixels[:, 0].astype(np.int32) << 16) | (pixels[:, 1].astype(np.int32) << 8) | pixels[:, 2]
+    unique, counts = np.unique(key, return_counts=True)
+    unique = np.stack([unique >> 16, (unique >> 8) & 255, unique & 255], axis=1)
+    if len(unique) <= colors:
+        return unique.astype(np.uint8)
+    common = unique[np.argsort(counts)[::-1][:exact]]
+    mosaic = Image.fromarray(pixels.reshape(1, -1, 3))
+    quantized = mosaic.quantize(colors=colors - exact, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    n = len(np.unique(np.asarray(quantized)))
+    cut = np.asarray(quantized.getpalette()[:3 * n], dtype=np.uint8).reshape(-1, 3)
+    return np.unique(np.concatenate([common.astype(np.uint8), cut]), axis=0)
+
+
+def nearest_color(colors, palette):
+    """(M, 3) 的颜色在调色板中最近的下标"""
+    colors = colors.astype(np.int32)
+    palette = palette.astype(np.int32)
+    index = np.empty(len(colors), dtype=np.uint8)
+    for start in range(0, len(colors), 4096): # 分块计算，避免过大的中间数组
+        dist = ((colors[start:start + 4096, np.newaxis, :] - palette[np.newaxis, :, :]) ** 2).sum(axis=2)
+        index[start:start + 4096] = np.argmin(dist, axis=1)
+    return index
+
+
+class DeltaGifWriter:
+    """
+    增量 GIF 写入器
+
+    参数:
+        filename: 输出文件名
+        size: (宽, 高) 像素
+        palette: (n, 3) 的全局调色板，n 不超过 255
+        fps: 帧率，超过 50 时每帧仍至少显示 MIN_DURATION，播放会比实际慢
+        max_bytes: 文件大小预算，超出进度对应的配额时跳过帧(变化累积到下一帧写入)，None 表示不限
+        total_frames: 总帧数，用于按进度分配预算
+    """
+    def __init__(self, filename, size, palette, fps=30, max_bytes=None, total_frames=None):
+        assert len(palette) <= TRANSPARENT, "调色板最多 255 色，最后一个下标保留给透明色"
+        assert max_bytes is None or total_frames, "设置 max_bytes 时需要给出 total_frames"
+        self.width, self.height = size
+        self.fps          = fps
+        self.max_bytes    = max_bytes
+        self.total_frames = total_frames
+        self.colors       = np.asarray(palette, dtype=np.uint8)
+        self.lookup       = np.full(1 << 24, TRANSPARENT, dtype=np.uint8) # 24 位颜色 -> 调色板下标
+        self.palette      = np.zeros((256, 3), dtype=np.uint8)
+        self.palette[:len(palette)] = palette
+        self.frames    = 0    # 已提交的帧数
+        self.written   = 0    # 已写入的帧数
+        self.skipped   = 0    # 因无变化或超出预算而跳过的帧数
+        self.shown     = None # 播放器当前显示的画面(调色板下标)
+        self.dirty     = None # 自上次写入以来可能发生变化的区域 (x0, y0, x1, y1)
+        self.pending   = None # 等待确定持续时间的帧 (图像, 偏移, 是否透明, 起始帧序号)
+        self.bytes     = 0    # 已写入的字节数
+        self.last_size = 0    # 最近写出的一帧的字节数
+        self.filename  = filename
+        self.file      = open(filename, "wb")
+        self._write_header()
+
+    def _write(self, data):
+        self.file.write(data)
+        self.bytes += len(data)
+
+    def _write_header(self):
+        """文件头、全局调色板与循环播放扩展"""
+        self._write(b"GIF89a" + struct.pack("<HHBBB", self.width, self.height, 0xF7, 0, 0))
+        self._write(self.palette.tobytes())
+        self._write(b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00") # 无限循环
+
+    def quantize(self, rgb):
+        """(H, W, 3) 的 RGB 查表转换为调色板下标，第一次出现的颜色计算最近色后写入查找表"""
+        key = (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2]
+        index = self.lookup[key]
+        missing = index == TRANSPARENT
+        if missing.any():
+            new = np.unique(key[missing])
+            self.lookup[new] = nearest_color(np.stack([new >> 16, (new >> 8) & 255, new & 255], axis=1), self.colors)
+            index = self.lookup[key]
+        return index
+
+    def add(self, rgb, region=None):
+        """
+        提交一帧
+
+        参数:
+            rgb: (H, W, 3) 或 (H, W, 4) 的 uint8 像素
+            region: 本帧可能变化的像素区域 (x0, y0, x1, y1)，None 表示整帧
+        """
+        rgb = rgb[..., :3]
+        self.frames += 1
+        if self.shown is None: # 第一帧写入整幅画面
+            self.shown = self.quantize(rgb)
+            self._emit(self.shown.copy(), (0, 0), False)
+            return
+
+        # 累积自上次写入以来可能变化的区域
+        region = region or (0, 0, self.width, self.height)
+        if self.dirty is None:
+            self.dirty = region
+        else:
+            self.dirty = (min(self.dirty[0], region[0]), min(self.dirty[1], region[1]),
+                          max(self.dirty[2], region[2]), max(self.dirty[3], region[3]))
+        # 挂起的帧尚未写出，按上一帧的大小预估
+        if self.max_bytes is not None and self.bytes + self.last_size > self.max_bytes * self.frames / self.total_frames:
+            self.skipped += 1 # 超出预算，变化留到下一帧
+            return
+
+        x0, y0, x1, y1 = self.dirty
+        index = self.quantize(rgb[y0:y1, x0:x1])
+        changed = index != self.shown[y0:y1, x0:x1]
+        self.dirty = None
+        if not changed.any():
+            self.skipped += 1
+            return
+
+        # 收紧到实际变化的矩形，未变化的像素设为透明
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        index, changed = index[r0:r1, c0:c1], changed[r0:r1, c0:c1]
+        self.shown[y0 + r0:y0 + r1, x0 + c0:x0 + c1][changed] = index[changed]
+        self._emit(np.where(changed, index, TRANSPARENT).astype(np.uint8), (x0 + c0, y0 + r0), True)
+
+    def _emit(self, index, offset, transparent):
+        """写出上一帧(此时其持续时间已确定)，并把本帧挂起"""
+        self._flush(self.frames - 1)
+        self.pending = (index, offset, transparent, self.frames - 1)
+
+    def _flush(self, end):
+        """写出挂起的帧，显示时长覆盖到第 end 帧之前"""
+        if self.pending is None:
+            return
+        index, offset, transparent, start = self.pending
+        # 按累计时间取整到 1/100 秒，避免 fps 不能整除 100 时的时长漂移
+        duration = max(round(end * 100 / self.fps) - round(start * 100 / self.fps), MIN_DURATION)
+        frame = Image.fromarray(index, mode="P")
+        frame.putpalette(self.palette.tobytes())
+        params = {"duration": 10 * duration, "disposal": 1}
+        if transparent:
+            params["transparency"] = TRANSPARENT
+        before = self.bytes
+        for data in GifImagePlugin.getdata(frame, offset, **params):
+            self._write(data)
+        self.last_size = self.bytes - before
+        self.written += 1
+        self.pending = None
+
+    def close(self):
+        """写出最后一帧与文件尾"""
+        self._flush(self.frames)
+        self._write(b";")
+        self.file.close()
+
+    def abort(self):
+        """中途放弃：关闭文件并删除写了一半的 GIF"""
+        self.file.close()
+        os.remove(self.filename)
+
+    def report(self):
+        """提交、写入与跳过的帧数，以及文件大小(字节)"""
+        return {"frames": self.frames, "written": self.written, "skipped": self.skipped, "bytes": self.bytes}
+
+
+def _artist_region(artists, renderer, height, pad=2):
+    """部件在画布上的像素范围 (x0, y0, x1, y1)，以图像左上角为原点；无法确定时返回 None"""
+    try:
+        boxes = [artist.get_window_extent(renderer) for artist in artists if artist.get_visible()]
+    except Exception:
+        return None
+    boxes = [box for box in boxes if np.all(np.isfinite(box.get_points()))]
+    if not boxes:
+        return None
+    x0 = min(box.x0 for box in boxes) - pad
+    x1 = max(box.x1 for box in boxes) + pad
+    y0 = min(box.y0 for box in boxes) - pad
+    y1 = max(box.y1 for box in boxes) + pad
+    return int(np.floor(x0)), int(np.floor(height - y1)), int(np.ceil(x1)), int(np.ceil(height - y0))
+
+
+def _union(a, b, width, height):
+    """两个像素区域的并集并裁剪到画布内，任一为 None 时返回 None"""
+    if a is None or b is None:
+        return None
+    x0, y0 = max(min(a[0], b[0]), 0), max(min(a[1], b[1]), 0)
+    x1, y1 = min(max(a[2], b[2]), width), min(max(a[3], b[3]), height)
+    return (x0, y0, x1, y1) if x1 > x0 and y1 > y0 else None
+
+
+def save_gif(animator, filename, frames=500, fps=30, dpi=100, max_bytes=None, palette_frames=10):
+    """
+    以增量方式将 Animator2D 的动画导出为 GIF
+
+    参数:
+        animator: Animator2D 的子类实例
+        filename: 输出文件名
+        frames: 帧数，每帧调用一次 animator.advance()
+        fps: 帧率
+        dpi: 分辨率
+        max_bytes: 文件大小预算(字节)，None 表示不限
+        palette_frames: 用于计算全局调色板的前几帧
+
+    返回:
+        DeltaGifWriter，可查看 written、skipped、bytes 等统计
+    """
+    fig = animator.fig
+    original_dpi = fig.get_dpi()
+    fig.set_dpi(dpi)
+    canvas = fig.canvas
+    artists = animator.draw()
+    for artist in artists:
+        artist.set_animated(True)
+    canvas.draw() # 只渲染静态背景
+    background = canvas.copy_from_bbox(fig.bbox)
+    renderer = canvas.get_renderer()
+    width, height = canvas.get_width_height(physical=True)
+    writer = None
+
+    def render():
+        """恢复背景，只重绘动画部件，返回像素与部件所在区域"""
+        canvas.restore_region(background)
+        for artist in artists:
+            fig.draw_artist(artist)
+        return np.asarray(canvas.buffer_rgba())[..., :3].copy(), _artist_region(artists, renderer, height)
+
+    try:
+        # 前几帧用于计算调色板，之后逐帧写入
+        samples = [render()]
+        for _ in range(min(palette_frames, frames) - 1):
+            animator.advance()
+            artists = animator.draw()
+            samples.append(render())
+        writer = DeltaGifWriter(filename, (width, height), build_palette([rgb for rgb, _ in samples]),
+                                fps=fps, max_bytes=max_bytes, total_frames=frames)
+        previous = None
+        for rgb, region in samples:
+            writer.add(rgb, _union(previous, region, width, height))
+            previous = region
+        for _ in range(frames - len(samples)):
+            animator.advance()
+            artists = animator.draw()
+            rgb, region = render()
+            writer.add(rgb, _union(previous, region, width, height)) # 上一帧与本帧部件所在区域都可能变化
+            previous = region
+        writer.close()
+    finally:
+        if writer is not None and not writer.file.closed: # 中途出错，不留下不完整的文件
+            writer.abort()
+        for artist in artists:
+            artist.set_animated(False)
+        fig.set_dpi(original_dpi) # 之后的 play 与 save_animation 仍按原来的分辨率
+    return writer
@@ -7,6 +7,9 @@
 #------------------------------------------------
 import numpy as np
 from animator import Animator2D
+from neighbor import minimum_image, wrap_positions
+from particle_mesh import ParticleMesh
+from scenario import load_scenario, save_scenario
 from matplotlib.widgets import Button
 from matplotlib.patches import Circle
 import matplotlib.pyplot as plt
@@ -14,8 +17,11 @@ import matplotlib.pyplot as plt
 
 class GravitySimulator(Animator2D):
     """质量点的引力交互模拟"""
-    
-    def __init__(self, tracing=False, N=2, damping=0.995):
+    state_fields = ("pos", "vol", "mass")
+    max_markers  = 500 # 质点数超过此值时合并为一个部件，每个质点画一个像素
+
+    def __init__(self, tracing=False, N=2, damping=0.995, integrator="euler", max_level=6, coarse_levels=5, eta=0.1, softening=0.1, boundary="wall",
+                 solver="direct", grid=128, r_split=2.0, scenario=None):
         """
         初始化模拟参数
         
@@ -27,35 +33,104 @@ class GravitySimulator(Animator2D):
             xlim, ylim: 绘图范围
             figsize: 图形大小
             title: 图形标题
+            integrator: "euler" 为全局统一步长；"block" 为分层块时间步长(KDK)
+            max_level: 块时间步长的最大层数，最小步长为 dt / 2**max_level
+            coarse_levels: 比帧步长 dt 更粗的层数，最大步长为 dt * 2**coarse_levels，平静的质点跨越多帧才计算一次受力
+            eta: 步长判据系数，dt_i = eta * sqrt(softening / |a_i|)；|a_i| < softening * (eta / dt)**2 的质点步长才会超过 dt
+            softening: block 模式与网格求解器的 Plummer 软化长度
+            boundary: "wall" 为反射墙壁；"periodic" 为周期性边界，引力按最小镜像计算(网格求解器下为完整的周期求和)
+            solver: 引力的计算方式，"direct" 为逐对求和；"pm" 为粒子-网格(FFT)，适合大量质点；
+                    "p3m" 在 pm 的基础上对近距离的质点对做短程修正
+            grid: 网格求解器每个方向的节点数
+            r_split: p3m 的长短程分界尺度(以网格边长为单位)
+            scenario: 场景目录或 Scenario，给出时从场景载入初始状态(重置时重新载入)，区域与数量以场景为准
         """
         super().__init__()
+        self.scenario = None if scenario is None else load_scenario(scenario)
+        if self.scenario is not None:
+            N = len(self.scenario)
         
         # 物理参数
         self.G        = 1.0       # 引力常数
         self.dt       = 0.05      # 时间步长
         self.xlim     = [-10, 10]
         self.ylim     = [-10, 10] # 空间范围
+        if self.scenario is not None:
+            self.xlim = self.scenario.metadata.get("xlim", self.xlim)
+            self.ylim = self.scenario.metadata.get("ylim", self.ylim)
         self.N        = N         # 质点数量
         self.damping  = damping   # 阻尼
-        self.is_trace = tracing   # 是否跟踪路径
+        self.is_trace = tracing and N <= self.max_markers # 是否跟踪路径
+        self.boundary = boundary  # 边界类型
+        self.lower    = np.array([self.xlim[0], self.ylim[0]])
+        self.period   = np.array([self.xlim[1] - self.xlim[0], self.ylim[1] - self.ylim[0]]) if boundary == "periodic" else None
+
+        # 块时间步长参数
+        self.integrator = integrator # 积分方式
+        self.max_level  = max_level  # 最大层数(比 dt 更细)
+        self.coarse_levels = coarse_levels # 比 dt 更粗的层数
+        self.eta        = eta        # 步长判据系数
+        self.softening  = softening  # 软化长度
+        self.force_evaluations = 0   # 累计的单质点受力计算次数，用于比较两种积分方式的开销
+
+        # 网格求解器：墙壁边界下为孤立边界(补零)，周期性边界下网格首尾相接
+        self.solver = solver
+        self.mesh = None if solver == "direct" else ParticleMesh(
+            self.lower, [self.xlim[1] - self.xlim[0], self.ylim[1] - self.ylim[0]], grid=grid, G=self.G,
+            softening=softening, periodic=boundary == "periodic", r_split=r_split if solver == "p3m" else None,
+        )
 
         # 初始化图形
         self.initialize_figure(self.xlim, self.ylim, figsize=(8, 8), title="Gravity Simulator")
         self.random_init_parameter()
+        self.initialize_points()
         
         # 添加重置按钮
         ax_reset = plt.axes([0.465, 0.01, 0.1, 0.04])  # 按钮位置
         self.reset_button = Button(ax_reset, 'Reset')
-        self.reset_button.on_clicked(lambda event: self.random_init_parameter())
+        self.reset_button.on_clicked(self.reset)
+
+    def reset(self, event):
+        """重置按钮的回调函数"""
+        self.send_command("restart")
+        if not self.is_background:
+            self.initialize_points()
+
+    def restart(self):
+        """重新随机生成质点，在模拟端执行"""
+        self.random_init_parameter()
+        self.monitor.reset()
+
+    def set_state(self, state):
+        """载入后台模拟的一帧，质量改变说明模拟端已重置，需要重新生成图形"""
+        restarted = not np.array_equal(state["mass"], self.mass)
+        super().set_state(state)
+        if restarted:
+            self.initialize_points()
+            self.monitor.reset()
         
     def random_init_parameter(self):
-        """随机初始化参数"""
-        # 随机初始化
-        self.mass = np.random.uniform(1.0, 5.0, self.N) # 质量
-        self.pos = np.column_stack([np.random.uniform(*self.xlim, size=self.N), np.random.uniform(*self.ylim, size=self.N)]) # 位置
-        self.vol = np.column_stack([np.random.uniform(-1., 1., size=self.N), np.random.uniform(-1., 1., size=self.N)]) # 速度
+        """随机初始化参数，给出场景时从场景载入"""
+        if self.scenario is not None:
+            self.mass = self.scenario["mass"]
+            self.pos = self.scenario["pos"]
+            self.vol = self.scenario["vol"]
+        else:
+            # 随机初始化
+            self.mass = np.random.uniform(1.0, 5.0, self.N) # 质量
+            self.pos = np.column_stack([np.random.uniform(*self.xlim, size=self.N), np.random.uniform(*self.ylim, size=self.N)]) # 位置
+            self.vol = np.column_stack([np.random.uniform(-1., 1., size=self.N), np.random.uniform(-1., 1., size=self.N)]) # 速度
+        self.acc = None  # block 模式下各质点最近一次计算的加速度
+        self.span = None # block 模式下各质点的步长(以最小步长为单位，2 的幂)
+        self.block_time = 0 # block 模式下在当前周期内的时刻(以最小步长为单位)，跨帧保留
 
-        # 创建绘图对象
+    def initialize_points(self):
+        """创建绘图对象，重置时移除旧的质点与轨迹"""
+        for artist in getattr(self, "points", []) + getattr(self, "trajectories", []):
+            artist.remove()
+        if self.N > self.max_markers:
+            self.points = [self.ax.plot(self.pos[:, 0], self.pos[:, 1], 'b,')[0]]
+            return
         self.points = [ self.ax.plot(*self.pos[i], 'bo', markersize=10)[0] for i in range(self.N) ] # 质点
         if self.is_trace:
             self.pos_arr = [np.array([self.pos[i]], dtype=float) for i in range(self.N)] # 位置轨迹
@@ -63,6 +138,9 @@ class GravitySimulator(Animator2D):
 
     def handle_wall_collision(self):
         """处理与墙的碰撞"""
+        if self.period is not None: # 周期性边界：折回盒内
+            self.pos = wrap_positions(self.pos, self.lower, self.period)
+            return
         self.vol[(self.pos[:, 0] >= self.xlim[1]) | (self.pos[:, 0] <= self.xlim[0]), 0] *= -1
         self.vol[(self.pos[:, 1] >= self.ylim[1]) | (self.pos[:, 1] <= self.ylim[0]), 1] *= -1
         # 边界检查
@@ -71,7 +149,7 @@ class GravitySimulator(Animator2D):
 
     def calculate_force(self, i, j):
         """计算一对质点间的引力"""
-        r_vec = self.pos[j] - self.pos[i]
+        r_vec = minimum_image(self.pos[j] - self.pos[i], self.period)
         distance = np.linalg.norm(r_vec)
         if distance < 0.1:  # 防止距离过小导致力过大
             distance = 0.1
@@ -82,12 +160,100 @@ class GravitySimulator(Animator2D):
 
     def damping_high_speed(self):
         """对高速质点设置阻尼"""
-        for i in range(self.N):
-            if np.linalg.vector_norm(self.vol[i]) > 2.0:
-                self.vol[i] *= self.damping
+        self.vol[np.linalg.vector_norm(self.vol, axis=1) > 2.0] *= self.damping
     
+    def calc_accelerations(self, idx=None):
+        """向量化计算 idx 中质点受到的引力加速度(Plummer 软化)，使用网格求解器时一次求出全部质点"""
+        if idx is None:
+            idx = np.arange(self.N)
+        if self.mesh is not None:
+            self.force_evaluations += len(idx)
+            return self.mesh.accelerations(self.pos, self.mass)[idx]
+        r_vec = minimum_image(self.pos[np.newaxis, :, :] - self.pos[idx, np.newaxis, :], self.period) # (k, N, 2)
+        inv_r3 = ((r_vec ** 2).sum(axis=2) + self.softening ** 2) ** -1.5
+        inv_r3[np.arange(len(idx)), idx] = 0.0 # 排除自身
+        self.force_evaluations += len(idx)
+        return self.G * ((inv_r3 * self.mass)[:, :, np.newaxis] * r_vec).sum(axis=1)
+
+    def assign_span(self, idx, t):
+        """
+        依据加速度为质点分配 2 的幂步长，范围为 dt / 2**max_level 到 dt * 2**coarse_levels
+
+        步长只能在与其对齐的时刻变化：质点在时刻 t(以最小步长计)结束一步后，
+        新步长必须整除 t，否则会与其他层失去同步。
+        """
+        n_cycle = 2 ** (self.max_level + self.coarse_levels) # 最大步长，所有质点在其整数倍时刻同步
+        acc = np.linalg.norm(self.acc[idx], axis=1)
+        dt_i = self.eta * np.sqrt(self.softening / np.maximum(acc, 1e-12))
+        level = np.clip(np.ceil(np.log2(self.dt / dt_i)), -self.coarse_levels, self.max_level).astype(int)
+        span = 2 ** (self.max_level - level)
+        aligned = n_cycle if t % n_cycle == 0 else t & -t # 能整除 t 的最大 2 的幂
+        return np.minimum(span, aligned)
+
+    def block_step(self):
+        """
+        分层块时间步长推进一帧(dt)
+
+        每个质点各自以 dt * 2**k (-max_level <= k <= coarse_levels) 为步长做 kick-drift-kick：
+        步首半步 kick，全体 drift，步尾只为到达步长边界的质点重新计算受力并半步 kick。
+        帧步长与块步长解耦：块时刻跨帧保留，步长大于 dt 的平静质点在帧末停在步长中途，
+        位置照常更新，要跨越多帧才计算一次受力；只有近距离交会的质点会被频繁更新。
+        """
+        n_sub = 2 ** self.max_level                          # 一帧包含的最小步长数
+        n_cycle = 2 ** (self.max_level + self.coarse_levels) # 最大步长
+        dt_min = self.dt / n_sub
+        if self.acc is None:
+            self.acc = self.calc_accelerations()
+            self.span = self.assign_span(np.arange(self.N), 0)
+            self.block_time = 0
+
+        # 循环开始时，位于步长边界(t % span == 0)的质点已完成上一步的步尾 kick，等待步首 kick
+        t = self.block_time
+        end = t + n_sub
+        while t < end:
+            # 步首：半步 kick
+            starting = t % self.span == 0
+            self.vol[starting] += 0.5 * self.acc[starting] * (self.span[starting] * dt_min)[:, np.newaxis]
+
+            # 全体 drift 到下一个有质点到达步长边界的时刻，最多到帧末
+            t_next = min(np.min(t - t % self.span + self.span), end)
+            self.pos += self.vol * ((t_next - t) * dt_min)
+            self.handle_wall_collision()
+            t = t_next
+
+            # 步尾：重新计算受力并半步 kick，然后选择新的步长
+            idx = np.flatnonzero(t % self.span == 0)
+            if len(idx) > 0:
+                self.acc[idx] = self.calc_accelerations(idx)
+                self.vol[idx] += 0.5 * self.acc[idx] * (self.span[idx] * dt_min)[:, np.newaxis]
+                self.span[idx] = self.assign_span(idx, t)
+        self.block_time = t % n_cycle # 周期末所有质点都在边界上，回到 0 不影响对齐
+
+    def synchronized_velocities(self):
+        """
+        所有质点在当前时刻的速度
+
+        block 模式下步长跨越帧末的质点只做了步首的半步 kick，按步首的加速度线性插值到当前时刻，
+        用于计算动能等诊断量；其余情形即 vol。
+        """
+        if self.integrator != "block" or self.span is None:
+            return self.vol
+        phase = self.block_time % self.span # 已走过的步长内时间，在边界上为 0
+        mid = phase != 0
+        dt_min = self.dt / 2 ** self.max_level
+        vol = self.vol.copy()
+        vol[mid] += self.acc[mid] * ((phase[mid] - 0.5 * self.span[mid]) * dt_min)[:, np.newaxis]
+        return vol
+
     def update_positions(self):
         """更新位置和速度"""
+        if self.mesh is not None:
+            self.vol += self.calc_accelerations() * self.dt
+            self.pos += self.vol * self.dt
+            self.handle_wall_collision()
+            self.damping_high_speed()
+            return
+        self.force_evaluations += self.N
         force = np.zeros((self.N, 2)) # 计算合力
         for i in range(self.N):
             for j in range(self.N):
@@ -100,16 +266,55 @@ class GravitySimulator(Animator2D):
             self.pos[i] += self.vol[i] * self.dt               # 更新位置
         self.handle_wall_collision() # 处理与墙的碰撞
         self.damping_high_speed() # 限制过高的速度
-        
+    
+    def save_scenario(self, path):
+        """把当前状态保存为场景，之后可以用 scenario=path 复现"""
+        save_scenario(path, self.pos, self.vol, self.mass, xlim=list(self.xlim), ylim=list(self.ylim), boundary=self.boundary)
+
+    @property
+    def conserved(self):
+        """墙壁反弹与高速阻尼会破坏守恒，出现漂移即说明其介入；周期性边界下角动量不守恒"""
+        if self.period is not None:
+            return ("energy", "momentum")
+        return ("energy", "momentum", "angular_momentum")
+
+    def diagnostic_quantities(self):
+        """能量、动量、角动量(相对原点)"""
+        vol = self.synchronized_velocities()
+        kinetic = 0.5 * (self.mass * (vol ** 2).sum(axis=1)).sum()
+        angular = (self.mass * (self.pos[:, 0] * vol[:, 1] - self.pos[:, 1] * vol[:, 0])).sum()
+        momentum = (self.mass[:, np.newaxis] * vol).sum(axis=0)
+        if self.mesh is not None: # 势能同样由网格求出
+            energy = kinetic + self.mesh.potential_energy(self.pos, self.mass)
+            return {"energy": energy, "momentum": momentum, "angular_momentum": angular}
+        # 势能与受力保持一致：euler 模式下距离小于 0.1 时按 0.1 计算，block 模式使用 Plummer 软化
+        delta = minimum_image(self.pos[:, np.newaxis, :] - self.pos[np.newaxis, :, :], self.period)
+        if self.integrator == "block":
+            distance = np.sqrt((delta ** 2).sum(axis=2) + self.softening ** 2)
+        else:
+            distance = np.maximum(np.sqrt((delta ** 2).sum(axis=2)), 0.1)
+        i, j = np.triu_indices(self.N, k=1)
+        potential = -(self.G * self.mass[i] * self.mass[j] / distance[i, j]).sum()
+        return {
+            "energy": kinetic + potential,
+            "momentum": momentum,
+            "angular_momentum": angular,
+        }
+
+    def step(self):
+        """推进一个物理步长"""
+        if self.integrator == "block":
+            self.block_step()
+        else:
+            self.update_positions()
+
+    def draw(self):
+        """更新质点与轨迹，轨迹按绘制的帧记录"""
+        if self.N > self.max_markers:
+            self.points[0].set_data(self.pos[:, 0], self.pos[:, 1])
+            return self.points
         if self.is_trace:
-            # 记录轨迹
             self.pos_arr = [ np.vstack([self.pos_arr[i], self.pos[i].reshape(1, 2)]) for i in range(self.N) ]
-    
-    def update(self, frame):
-        """动画更新函数"""
-        self.update_positions()
-        
-        # 更新点位置
         for i in range(self.N):
             self.points[i].set_data([self.pos[i, 0]], [self.pos[i, 1]])
             if self.is_trace:
@@ -124,7 +329,13 @@ class GravitySimulator(Animator2D):
 if __name__ == "__main__":
     # 创建模拟器实例
     simulator = GravitySimulator(N=3, damping=0.99)
+    # 分层块时间步长：近距离交会的质点自动细分步长，无需阻尼
+    # simulator = GravitySimulator(N=30, integrator="block", eta=0.03, max_level=8)
+    # 粒子-网格求解器：大量质点，每步的开销主要是 FFT
+    # simulator = GravitySimulator(N=100000, solver="pm", grid=256, softening=0.2, boundary="periodic")
     
     # 运行动画
     simulator.play(interval=5)
+    # 物理部分在后台线程中运行
+    # simulator.play(interval=5, background="thread")
     # simulator.save_animation("./example/gravity.mp4", fps=60, interval=1, frames=1000, dpi=200)
@@ -0,0 +1,229 @@
+#------------------------------------------------
+# name: lagrangian.py
+# author: taster
+# date: 2025-05-29 21:06:53 星期四
+# id: 6b1e9d4f2a7c40858d3e0f5a1c7b9e26
+# description: 由拉格朗日量生成向量化的加速度函数
+#------------------------------------------------
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+
+"""
+系统用拉格朗日量 L(q, q_dot) 声明，由 sympy 推导欧拉-拉格朗日方程
+    d/dt (∂L/∂q_dot_i) - ∂L/∂q_i = 0
+展开为 M(q) q_ddot = f(q, q_dot)，其中 M_ij = ∂²L/∂q_dot_i∂q_dot_j，
+f_i = ∂L/∂q_i - Σ_j ∂²L/∂q_dot_i∂q_j q_dot_j。自由度很少，直接用克拉默法则写出 q_ddot，
+化简后做公共子表达式消除，生成与手写函数相同接口的 numpy 源码：
+    accelerations(q, q_dot, **参数)，q[..., i] 为第 i 个广义坐标，前面的维度可以是任意批量。
+生成的源码按声明内容的哈希值缓存在磁盘上，之后载入时直接导入，不再推导，也不需要 sympy。
+"""
+
+VERSION = 1 # 生成器的版本，推导或生成方式改变时递增，使旧的缓存失效
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "kernels")
+
+_loaded = {} # 本进程中已载入的函数，键为缓存键
+
+
+def _sympy():
+    try:
+        import sympy
+    except ImportError as error:
+        raise ImportError("由拉格朗日量推导运动方程需要 sympy (pip install sympy)，已缓存的函数载入时不需要") from error
+    return sympy
+
+
+class LagrangianSystem:
+    """
+    由拉格朗日量声明的系统
+
+    拉格朗日量与中间量都写成字符串，因此不导入 sympy 也能计算缓存键。
+    表达式中可以使用广义坐标、广义速度(坐标名加 _dot)、参数、之前定义的中间量，
+    以及 dt(expr)：expr 对时间的全导数 Σ ∂expr/∂q_i q_dot_i，用于由位置写出速度。
+
+    参数:
+        name: 系统名，用作生成的函数名与缓存文件名
+        coordinates: 广义坐标名，顺序即 q 最后一维的顺序
+        parameters: 参数名，生成的函数以关键字参数接收
+        lagrangian: 拉格朗日量
+        definitions: 中间量，名称 -> 表达式，按顺序定义
+        simplify: 是否化简质量矩阵与广义力(三角恒等式等)，能明显减少生成代码中的运算
+    """
+    def __init__(self, name, coordinates, parameters, lagrangian, definitions=None, simplify=True):
+        self.name        = name
+        self.coordinates = list(coordinates)
+        self.parameters  = list(parameters)
+        self.lagrangian  = lagrangian
+        self.definitions = dict(definitions or {})
+        self.simplify    = simplify
+
+    @property
+    def velocities(self):
+        return [f"{name}_dot" for name in self.coordinates]
+
+    def key(self):
+        """声明内容与生成器版本的哈希值"""
+        description = {
+            "name": self.name,
+            "coordinates": self.coordinates,
+            "parameters": self.parameters,
+            "lagrangian": self.lagrangian,
+            "definitions": list(self.definitions.items()),
+            "simplify": self.simplify,
+            "version": VERSION,
+        }
+        return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+    def equations_of_motion(self):
+        """
+        符号形式的运动方程
+
+        返回:
+            (q, q_dot, M, f)：坐标与速度的符号，质量矩阵 M 与广义力 f，M q_ddot = f
+        """
+        sp = _sympy()
+        q = sp.symbols(self.coordinates, real=True)
+        q_dot = sp.symbols(self.velocities, real=True)
+        namespace = {name: symbol for name, symbol in zip(self.coordinates + self.velocities, q + q_dot)}
+        namespace.update({name: sp.Symbol(name, real=True) for name in self.parameters})
+        namespace["dt"] = lambda expr: sum(sp.diff(expr, q_i) * q_dot_i for q_i, q_dot_i in zip(q, q_dot))
+        for name, expr in self.definitions.items():
+            namespace[name] = sp.sympify(expr, locals=namespace)
+        L = sp.expand(sp.sympify(self.lagrangian, locals=namespace))
+
+        n = len(q)
+        momenta = [sp.diff(L, q_dot_i) for q_dot_i in q_dot]
+        M = sp.Matrix(n, n, lambda i, j: sp.diff(momenta[i], q_dot[j]))
+        f = sp.Matrix([
+            sp.diff(L, q[i]) - sum(sp.diff(momenta[i], q[j]) * q_dot[j] for j in range(n))
+            for i in range(n)
+        ])
+        if self.simplify:
+            M, f = M.applyfunc(sp.simplify), f.applyfunc(sp.simplify)
+        return q, q_dot, M, f
+
+    def generate(self):
+        """推导运动方程并生成 numpy 源码"""
+        sp = _sympy()
+        from sympy.printing.numpy import NumPyPrinter
+
+        q, q_dot, M, f = self.equations_of_motion()
+        # 克拉默法则：q_ddot = adj(M) f / det(M)，各分量共用同一个分母
+        denominator = M.det(method="berkowitz")
+        numerators = list(M.adjugate(method="berkowitz") * f)
+        # 只做因式分解：再化简会把 sin(a)cos(a) 之类合并成 sin(2a)，反而多出三角函数的计算
+        denominator = sp.factor(denominator)
+        numerators = [sp.factor(numerator) for numerator in numerators]
+        # 约去分子与分母的公因子
+        common = denominator
+        for numerator in numerators:
+            common = sp.gcd(common, numerator)
+        denominator = sp.cancel(denominator / common)
+        numerators = [sp.factor(sp.cancel(numerator / common)) for numerator in numerators]
+        constant = [not numerator.free_symbols & set(q + q_dot) for numerator in numerators]
+        # 中间变量以下划线开头，不与坐标名、参数名冲突
+        replacements, (denominator, *numerators) = sp.cse(
+            [denominator] + numerators, symbols=sp.numbered_symbols("_x"), optimizations="basic",
+        )
+
+        printer = NumPyPrinter({"fully_qualified_modules": True})
+        lines = [
+            "# 由 lagrangian.py 自动生成，请勿修改",
+            f"# key: {self.key()}",
+            "import numpy",
+            "",
+            "",
+            f"def {self.name}_accelerations(q, q_dot, {', '.join(self.parameters)}):",
+            f'    """{self.name} 的广义加速度，q = {self.coordinates}，由拉格朗日量推导"""',
+        ]
+        lines += [f"    {name} = q[..., {i}]" for i, name in enumerate(self.coordinates)]
+        lines += [f"    {name} = q_dot[..., {i}]" for i, name in enumerate(self.velocities)]
+        lines += [f"    {symbol} = {printer.doprint(expr)}" for symbol, expr in replacements]
+        lines.append(f"    _denominator = {printer.doprint(denominator)}")
+        results = []
+        for numerator, is_constant in zip(numerators, constant):
+            # 与坐标无关的分量也要有批量的形状
+            padding = " + numpy.zeros_like(q[..., 0])" if is_constant else ""
+            results.append(f"({printer.doprint(numerator)}) / _denominator{padding}")
+        if len(results) == 1:
+            lines.append(f"    return ({results[0]})[..., numpy.newaxis]")
+        else:
+            lines.append(f"    return numpy.stack([{', '.join(results)}], axis=-1)")
+        return "\n".join(lines) + "\n"
+
+    def accelerations(self, cache_dir=CACHE_DIR):
+        """
+        向量化的加速度函数，签名为 (q, q_dot, **参数)
+
+        依次查找本进程已载入的函数、磁盘缓存，都没有时推导并写入缓存。
+        """
+        key = self.key()
+        if key in _loaded:
+            return _loaded[key]
+        filename = os.path.join(cache_dir, f"{self.name}_{key[:16]}.py")
+        if not os.path.exists(filename):
+            source = self.generate()
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再原子地替换，多个进程同时生成时不会读到写了一半的文件
+            fd, temp = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(source)
+            os.replace(temp, filename)
+        spec = importlib.util.spec_from_file_location(f"_kernel_{self.name}_{key[:16]}", filename)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[key] = getattr(module, f"{self.name}_accelerations")
+        return _loaded[key]
+
+
+# 单摆、双摆与移动悬挂点单摆，与各模块中手写的加速度函数参数相同
+SINGLE_PENDULUM = LagrangianSystem(
+    "single_pendulum", ["theta"], ["g", "length"],
+    definitions={"x": "length*sin(theta)", "y": "-length*cos(theta)"},
+    lagrangian="(dt(x)**2 + dt(y)**2)/2 - g*y",
+)
+
+DOUBLE_PENDULUM = LagrangianSystem(
+    "double_pendulum", ["theta1", "theta2"], ["g", "L1", "L2", "m1", "m2"],
+    definitions={
+        "x1": "L1*sin(theta1)", "y1": "-L1*cos(theta1)",
+        "x2": "x1 + L2*sin(theta2)", "y2": "y1 - L2*cos(theta2)",
+    },
+    lagrangian="m1*(dt(x1)**2 + dt(y1)**2)/2 + m2*(dt(x2)**2 + dt(y2)**2)/2 - g*(m1*y1 + m2*y2)",
+)
+
+MOVING_PENDULUM = LagrangianSystem(
+    "moving_pendulum", ["x1", "theta"], ["g", "m1", "m2", "L"],
+    definitions={"x2": "x1 + L*sin(theta)", "y2": "-L*cos(theta)"},
+    lagrangian="m1*dt(x1)**2/2 + m2*(dt(x2)**2 + dt(y2)**2)/2 - m2*g*y2",
+)
+
+
+if __name__ == "__main__":
+    import time
+    import numpy as np
+    from double_pendulum import double_pendulum_accelerations
+    from moving_pendulum import moving_pendulum_accelerations
+    from single_pendulum import pendulum_accelerations
+
+    # 与手写的加速度函数比较结果与速度，状态为一百万个的批量
+    rng = np.random.default_rng(0)
+    cases = [
+        (SINGLE_PENDULUM, pendulum_accelerations, dict(g=9.8, length=1.3)),
+        (DOUBLE_PENDULUM, double_pendulum_accelerations, dict(g=9.8, L1=1.0, L2=0.7, m1=1.0, m2=2.0)),
+        (MOVING_PENDULUM, moving_pendulum_accelerations, dict(g=9.8, m1=3.0, m2=1.0, L=1.2)),
+    ]
+    for system, handwritten, params in cases:
+        start = time.perf_counter()
+        generated = system.accelerations()
+        print(f"{system.name}: 载入用时 {time.perf_counter() - start:.3f} 秒")
+        n = len(system.coordinates)
+        q, q_dot = rng.uniform(-np.pi, np.pi, (2, 1_000_000, n))
+        print("  最大差异", np.abs(generated(q, q_dot, **params) - handwritten(q, q_dot, **params)).max())
+        for label, function in (("手写", handwritten), ("生成", generated)):
+            start = time.perf_counter()
+            for _ in range(5):
+                function(q, q_dot, **params)
+            print(f"  {label}: {(time.perf_counter() - start) / 5 * 1e3:.1f} 毫秒")
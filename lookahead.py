@@ -0,0 +1,142 @@
+#------------------------------------------------
+# name: lookahead.py
+# author: taster
+# date: 2025-05-03 14:26:19 星期六
+# id: 5e8a1c7d3b9f40e2a6d4c1b8f7e02a95
+# description: 摆类系统的预计算轨迹缓冲
+#------------------------------------------------
+from collections import deque
+import threading
+import numpy as np
+
+
+def euler_trajectory(accelerations, q, q_dot, n_steps, dt, damping=1.0):
+    """
+    半隐式欧拉法连续推进 n_steps 步，与各摆类的 step 逐位一致
+
+    每一步先用当前状态计算加速度更新速度，再用新速度更新坐标，最后对速度施加阻尼。
+
+    参数:
+        accelerations: (q, q_dot) -> 广义加速度，形状与 q 相同
+        q, q_dot: 广义坐标与广义速度，形状为 (..., 自由度)，前面的维度为批量
+        n_steps: 推进的步数
+        dt: 时间步长
+        damping: 每步乘在速度上的阻尼系数
+
+    返回:
+        (n_steps, 2, ...) 的轨迹，[:, 0] 为坐标，[:, 1] 为速度
+    """
+    q = np.array(q, dtype=float)
+    q_dot = np.array(q_dot, dtype=float)
+    trajectory = np.empty((n_steps, 2) + q.shape)
+    for k in range(n_steps):
+        q_dot = q_dot + accelerations(q, q_dot) * dt
+        q = q + q_dot * dt
+        q_dot = q_dot * damping
+        trajectory[k, 0] = q
+        trajectory[k, 1] = q_dot
+    return trajectory
+
+
+def euler_batch_step(simulators, accelerations, parameters, damping):
+    """
+    把参数不同的多个同类摆作为一个批量推进一步
+
+    各实例的坐标与参数沿第 0 维堆叠，参数随批量维度广播，算完后再写回各实例。
+
+    参数:
+        simulators: 实现了 get_coordinates/set_coordinates 的摆类实例
+        accelerations: 批量加速度函数
+        parameters: 参数名 -> 各实例的取值
+        damping: 各实例每步的阻尼系数
+    """
+    q, q_dot = (np.array(x, dtype=float) for x in zip(*(sim.get_coordinates() for sim in simulators)))
+    params = {name: np.array(values, dtype=float) for name, values in parameters.items()}
+    dt = np.array([sim.dt for sim in simulators], dtype=float)[:, np.newaxis]
+    damping = np.array(damping, dtype=float)[:, np.newaxis]
+    (q, q_dot), = euler_trajectory(lambda q, q_dot: accelerations(q, q_dot, **params), q, q_dot, 1, dt, damping)
+    for sim, q_k, q_dot_k in zip(simulators, q, q_dot):
+        sim.set_coordinates(q_k, q_dot_k)
+
+
+class TrajectoryBuffer:
+    """
+    预计算轨迹缓冲
+
+    一次推进 chunk 步存入缓冲，动画每一步只需取出下一行；剩余步数低于 low_water 时
+    在后台线程中续算下一段。reset 后旧的缓冲与正在进行的续算全部作废。
+
+    参数:
+        produce: (q, q_dot, n_steps) -> (n_steps, 2, 自由度) 的轨迹
+        chunk: 每次续算的步数
+        low_water: 剩余步数低于此值时开始续算
+    """
+    def __init__(self, produce, chunk=2000, low_water=500):
+        self.produce   = produce
+        self.chunk     = chunk
+        self.low_water = low_water
+        self.cond      = threading.Condition()
+        self.generation = 0    # 每次 reset 加一，用于丢弃过期的续算结果
+        self.pending    = None # 正在进行的续算所属的 generation
+        self.chunks     = deque()
+        self.offset     = 0    # 第一段中下一个要取出的行
+        self.available  = 0    # 剩余的步数
+        self.tail       = None # 已计算部分的最后一个状态
+        self.error      = None # 续算抛出的异常，由 next 在界面线程中重新抛出
+
+    def reset(self, q, q_dot):
+        """从新的初始状态开始，丢弃已有的缓冲"""
+        with self.cond:
+            self.generation += 1
+            self.chunks.clear()
+            self.offset = 0
+            self.available = 0
+            self.tail = (np.array(q, dtype=float), np.array(q_dot, dtype=float))
+            self.error = None
+            self._request_refill()
+
+    def next(self):
+        """取出下一步的 (q, q_dot)，缓冲为空时等待续算完成，续算失败时抛出其异常"""
+        with self.cond:
+            while self.available == 0:
+                if self.error is not None:
+                    raise self.error
+                self._request_refill()
+                self.cond.wait()
+            trajectory = self.chunks[0]
+            q, q_dot = trajectory[self.offset]
+            self.offset += 1
+            self.available -= 1
+            if self.offset == len(trajectory):
+                self.chunks.popleft()
+                self.offset = 0
+            if self.available < self.low_water:
+                self._request_refill()
+            return q, q_dot
+
+    def _request_refill(self):
+        """若当前 generation 没有进行中的续算且没有失败，则启动一个(需持有锁)"""
+        if self.pending == self.generation or self.error is not None:
+            return
+        self.pending = self.generation
+        threading.Thread(target=self._refill, args=(self.generation, *self.tail), daemon=True).start()
+
+    def _refill(self, generation, q, q_dot):
+        """后台续算一段轨迹，失败时记下异常并唤醒等待的 next，而不是让它永远等待"""
+        try:
+            trajectory = self.produce(q, q_dot, self.chunk)
+        except Exception as error:
+            with self.cond:
+                if generation == self.generation:
+                    self.error = error
+                    self.pending = None
+                    self.cond.notify_all()
+            return
+        with self.cond:
+            if generation != self.generation: # 期间发生了 reset
+                return
+            self.chunks.append(trajectory)
+            self.available += len(trajectory)
+            self.tail = (trajectory[-1, 0], trajectory[-1, 1])
+            self.pending = None
+            self.cond.notify_all()
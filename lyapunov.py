@@ -0,0 +1,123 @@
+#------------------------------------------------
+# name: lyapunov.py
+# author: taster
+# date: 2025-05-05 20:37:52 星期一
+# id: a3f07c5e91d24b6880e1c2d9b4a6f713
+# description: 最大李雅普诺夫指数与混沌图
+#------------------------------------------------
+import numpy as np
+
+"""
+切线(变分)方程与状态一起推进：把状态写成复数 x + i h δ，用与 step 完全相同的欧拉映射推进，
+由复步长求导可知虚部除以 h 正是切向量 δ 经映射雅可比矩阵作用后的结果，且不存在差分的舍入误差。
+加速度函数只用到 sin、cos、乘除等解析运算，因此可以直接作用于复数数组。
+"""
+
+def lyapunov_exponent(accelerations, q, q_dot, n_steps, dt, damping=1.0, renorm=10, transient=0, h=1e-20, seed=0):
+    """
+    最大李雅普诺夫指数
+
+    每隔 renorm 步将切向量归一化并累计其对数增长率，前 transient 步只推进、不计入。
+
+    参数:
+        accelerations: (q, q_dot) -> 广义加速度，需支持复数与批量维度
+        q, q_dot: 初始条件，形状为 (..., 自由度)
+        n_steps: 计入统计的步数
+        dt, damping: 与模拟器相同的步长与阻尼
+        renorm: 归一化间隔(步数)
+        transient: 舍弃的暂态步数
+        h: 复步长
+        seed: 初始切向量的随机种子
+
+    返回:
+        形状为 q.shape[:-1] 的指数数组(单位为 1/时间)
+    """
+    q = np.array(q, dtype=float)
+    q_dot = np.array(q_dot, dtype=float)
+    tangent = np.random.default_rng(seed).standard_normal((2,) + q.shape)
+    tangent /= np.sqrt((tangent ** 2).sum(axis=(0, -1)))[..., np.newaxis]
+    z = q + 1j * h * tangent[0]
+    z_dot = q_dot + 1j * h * tangent[1]
+    log_growth = np.zeros(q.shape[:-1])
+
+    total = transient + n_steps
+    for k in range(1, total + 1):
+        z_dot = z_dot + accelerations(z, z_dot) * dt
+        z = z + z_dot * dt
+        z_dot = z_dot * damping
+        if k % renorm == 0 or k == total:
+            # 取出切向量，归一化后重新放回虚部
+            norm = np.sqrt((z.imag ** 2 + z_dot.imag ** 2).sum(axis=-1)) / h
+            if k > transient:
+                log_growth += np.log(norm)
+            z = z.real + 1j * (z.imag / norm[..., np.newaxis])
+            z_dot = z_dot.real + 1j * (z_dot.imag / norm[..., np.newaxis])
+    return log_growth / (n_steps * dt)
+
+
+def lyapunov_map(accelerations, q, q_dot, dt, damping=1.0, n_steps=5000, batch=4096, out=None, callback=None, **kwargs):
+    """
+    在整片初始条件上计算最大李雅普诺夫指数
+
+    初始条件展平后按 batch 个一组向量化计算，每完成一组就写入 out 中对应的像素，
+    因此可以在计算过程中通过 callback 实时显示已完成的部分。
+
+    参数:
+        q, q_dot: (..., 自由度) 的初始条件网格
+        n_steps: 每个初始条件计入统计的步数
+        batch: 每组同时计算的初始条件个数
+        out: 写入结果的数组，形状为 q.shape[:-1]，None 时新建并以 nan 填充
+        callback: callback(done, out)，done 为已完成的像素数
+        **kwargs: 传递给 lyapunov_exponent 的其余参数
+
+    返回:
+        out
+    """
+    shape = np.shape(q)[:-1]
+    q = np.reshape(q, (-1, np.shape(q)[-1]))
+    q_dot = np.reshape(q_dot, q.shape)
+    if out is None:
+        out = np.full(shape, np.nan)
+    flat = out.reshape(-1) # out 连续时为视图，写入即写回 out
+    assert np.shares_memory(flat, out), "out 需为连续数组"
+    for start in range(0, len(q), batch):
+        end = min(start + batch, len(q))
+        flat[start:end] = lyapunov_exponent(accelerations, q[start:end], q_dot[start:end], n_steps, dt, damping, **kwargs)
+        if callback is not None:
+            callback(end, out)
+    return out
+
+
+def angle_grid(resolution, first=(-np.pi, np.pi), second=(-np.pi, np.pi)):
+    """
+    两个坐标的均匀网格，返回 (resolution, resolution, 2) 的数组与 imshow 使用的 extent
+
+    第 0 维对应第二个坐标(图像的行)，第 1 维对应第一个坐标(图像的列)。
+    """
+    x = np.linspace(*first, resolution)
+    y = np.linspace(*second, resolution)
+    X, Y = np.meshgrid(x, y)
+    return np.stack([X, Y], axis=-1), [first[0], first[1], second[0], second[1]]
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    from double_pendulum import DoublePendulum
+
+    # 双摆：以两个初始角度为坐标，初始角速度为 0，边计算边显示
+    pendulum = DoublePendulum(damping=1.0)
+    plt.close(pendulum.fig)
+    fig, ax = plt.subplots(figsize=(6, 5))
+    grid, extent = angle_grid(100)
+    image = np.full(grid.shape[:-1], np.nan)
+    artist = ax.imshow(image, origin="lower", extent=extent, cmap="inferno")
+    ax.set(xlabel=r"$\theta_1$", ylabel=r"$\theta_2$", title="Double Pendulum Lyapunov Map")
+    fig.colorbar(artist, label=r"$\lambda_{max}$")
+
+    def show(done, out):
+        artist.set_data(out)
+        artist.set_clim(np.nanmin(out), np.nanmax(out))
+        plt.pause(0.01)
+
+    pendulum.lyapunov_map(resolution=100, n_steps=2000, batch=1000, out=image, callback=show)
+    plt.show()
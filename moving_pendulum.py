@@ -10,7 +10,35 @@ from matplotlib.patches import Circle, PathPatch
 import matplotlib.animation as animation
 from matplotlib.path import Path
 import numpy as np
+from functools import partial
 from animator import Animator2D
+from lookahead import TrajectoryBuffer, euler_batch_step, euler_trajectory
+from lyapunov import angle_grid, lyapunov_exponent, lyapunov_map
+
+
+def moving_pendulum_component_accelerations(theta, theta_dot, g, m1, m2, L):
+    """悬挂点与摆角的加速度 (x1_ddot, theta_ddot)，各量可以是浮点数或形状相同的数组"""
+    c, s = np.cos(theta), np.sin(theta)
+    denominator = m1 + m2*s**2
+
+    # 角加速度计算
+    term1 = (m1 + m2)*g*s
+    term2 = m2*L*theta_dot**2*s*c
+    theta_double_dot = (-term1 - term2) / (L*denominator)
+
+    # 悬挂点加速度
+    x1_double_dot = (m2*s*(L*theta_dot**2 + g*c)) / denominator
+
+    return x1_double_dot, theta_double_dot
+
+
+def moving_pendulum_accelerations(q, q_dot, g, m1, m2, L):
+    """
+    悬挂点与摆角的加速度，q = [x1, theta]，q_dot = [x1_dot, theta_dot]
+
+    最后一维为自由度，前面的维度可以是任意批量。
+    """
+    return np.stack(moving_pendulum_component_accelerations(q[..., 1], q_dot[..., 1], g, m1, m2, L), axis=-1)
 
 class MovingPendulum(Animator2D):
     def __init__(self, 
@@ -18,7 +46,8 @@ class MovingPendulum(Animator2D):
                  m2=1.0,   # 摆锤质量
                  L=1.0,    # 摆长
                  theta=np.pi/3,  # 初始角度
-                 damping=0.995): # 阻尼系数
+                 damping=0.995,  # 阻尼系数
+                 lookahead=False): # 是否预先成段计算轨迹
         super(MovingPendulum, self).__init__()
         # 系统参数
         self.g           = 9.8
@@ -32,71 +61,109 @@ class MovingPendulum(Animator2D):
         self.x1_dot         = 0.0   # 悬挂点速度
         self.theta          = theta # 摆角（垂直向下为0）
         self.theta_dot      = 0.0   # 角速度
-        self.variable_added = False # 动画部件是否已被添加过
+        self.lookahead      = TrajectoryBuffer(self.trajectory) if lookahead else None # 预计算轨迹缓冲
+        if self.lookahead is not None:
+            self.lookahead.reset(*self.get_coordinates())
 
         # 初始化图形
         self.initialize_figure([-5, 5], [-3, 1], figsize=(6, 3), title="Movable Pendulum System")
         self.plot_variable()
 
     def plot_variable(self):
-        # 更新图形位置
-        bob_x      = self.x1 + self.L*np.sin(self.theta)
-        bob_y      = -self.L*np.cos(self.theta)
-        anchor_pos = (self.x1, 0) # 悬挂点的位置
-        bob_pos    = (bob_x, bob_y) # 摆锤的位置
-        rod_path   = Path([anchor_pos, bob_pos], [Path.MOVETO, Path.LINETO]) # 摆杆的路径
-
-        # 创建图形元素
-        if not self.variable_added:
-            self.anchor = Circle(anchor_pos, radius=0.1, color='red', zorder=3)      # 悬挂点
-            self.bob = Circle(bob_pos, radius=0.1, color='blue', zorder=3)           # 摆锤
-            self.rod = PathPatch(rod_path, lw=2, edgecolor="gray", facecolor='none') # 摆杆
-            
-            for patch in [self.anchor, self.bob, self.rod]:
-                self.ax.add_patch(patch)
-            self.variable_added = True
+        """创建动画部件并登记为每帧更新，摆杆的 Path 之后只原地修改端点"""
+        anchor_pos, bob_pos = self.get_positions()
+        rod_path = Path([anchor_pos, bob_pos], [Path.MOVETO, Path.LINETO]) # 摆杆的路径
+        self.anchor = Circle(anchor_pos, radius=0.1, color='red', zorder=3)      # 悬挂点
+        self.bob = Circle(bob_pos, radius=0.1, color='blue', zorder=3)           # 摆锤
+        self.rod = PathPatch(rod_path, lw=2, edgecolor="gray", facecolor='none') # 摆杆
+        for patch in [self.anchor, self.bob, self.rod]:
+            self.ax.add_patch(patch)
+        self.register_artist("pendulum", [self.rod, self.anchor, self.bob], self.update_pendulum)
+
+    def get_positions(self):
+        """悬挂点与摆锤的坐标"""
+        bob_x = self.x1 + self.L*np.sin(self.theta)
+        bob_y = -self.L*np.cos(self.theta)
+        return (self.x1, 0), (bob_x, bob_y)
+
+    def update_pendulum(self):
+        """更新悬挂点、摆锤与摆杆"""
+        anchor_pos, bob_pos = self.get_positions()
+        self.rod.get_path().vertices[:] = anchor_pos, bob_pos
+        self.rod.stale = True
+        self.anchor.set_center(anchor_pos)
+        self.bob.set_center(bob_pos)
+
+    def get_coordinates(self):
+        """广义坐标与广义速度"""
+        return [self.x1, self.theta], [self.x1_dot, self.theta_dot]
+
+    @property
+    def damping_factor(self):
+        """每步乘在速度上的阻尼系数"""
+        return self.damping
+
+    def equations(self):
+        """绑定了当前参数的加速度函数"""
+        return partial(moving_pendulum_accelerations, g=self.g, m1=self.m1, m2=self.m2, L=self.L)
+
+    def trajectory(self, q, q_dot, n_steps):
+        """从 (q, q_dot) 出发推进 n_steps 步，返回 (n_steps, 2, ..., 2) 的轨迹"""
+        return euler_trajectory(self.equations(), q, q_dot, n_steps, self.dt, self.damping)
+
+    def lyapunov_exponent(self, n_steps=5000, **kwargs):
+        """从当前状态出发的最大李雅普诺夫指数"""
+        return float(lyapunov_exponent(self.equations(), *self.get_coordinates(), n_steps, self.dt, self.damping, **kwargs))
+
+    def lyapunov_map(self, resolution=100, n_steps=5000, theta_dot=(-6, 6), **kwargs):
+        """
+        以初始摆角与角速度为坐标(悬挂点初始静止于原点)的最大李雅普诺夫指数图
+
+        返回 (图像, extent)，图像的行对应 theta_dot，列对应 theta；kwargs 传递给 lyapunov.lyapunov_map
+        """
+        grid, extent = angle_grid(resolution, second=theta_dot)
+        zeros = np.zeros(grid.shape[:-1])
+        q = np.stack([zeros, grid[..., 0]], axis=-1)
+        q_dot = np.stack([zeros, grid[..., 1]], axis=-1)
+        image = lyapunov_map(self.equations(), q, q_dot, self.dt, self.damping, n_steps=n_steps, **kwargs)
+        return image, extent
+
+    @property
+    def conserved(self):
+        """无阻尼时机械能与水平动量守恒"""
+        return ("energy", "momentum") if self.damping == 1.0 else ()
+
+    def set_coordinates(self, q, q_dot):
+        """写入广义坐标与广义速度"""
+        self.x1, self.theta = float(q[0]), float(q[1])
+        self.x1_dot, self.theta_dot = float(q_dot[0]), float(q_dot[1])
+
+    def step(self):
+        """推进一个物理步长"""
+        # 欧拉法更新，阻尼在 euler_trajectory 中施加
+        if self.lookahead is not None:
+            q, q_dot = self.lookahead.next()
         else:
-            self.anchor.set_center(anchor_pos)
-            self.bob.set_center(bob_pos)
-            self.rod.set_path(rod_path)
-
-    def _calc_accelerations(self):
-        """计算加速度核心算法"""
-        theta = self.theta
-        c, s = np.cos(theta), np.sin(theta)
-        denominator = self.m1 + self.m2*s**2
-
-        # 角加速度计算
-        term1 = (self.m1 + self.m2)*self.g*s
-        term2 = self.m2*self.L*self.theta_dot**2*s*c
-        theta_double_dot = (-term1 - term2) / (self.L*denominator)
-
-        # 悬挂点加速度
-        x1_double_dot = (self.m2*s*(self.L*self.theta_dot**2 - self.g*c)) / denominator
-
-        return x1_double_dot, theta_double_dot
-
-    def update(self, frame):
-        """动画更新函数"""
-        # 计算加速度
-        x1_dd, theta_dd = self._calc_accelerations()
-
-        # 欧拉法更新
-        self.x1_dot += x1_dd * self.dt
-        self.x1 += self.x1_dot * self.dt
-        
-        self.theta_dot += theta_dd * self.dt
-        self.theta += self.theta_dot * self.dt
-
-        # 应用阻尼
-        self.x1_dot *= self.damping
-        self.theta_dot *= self.damping
-
-        self.plot_variable()
-        # if frame % 10 == 0:
-        #     print(f"System Energy: {self._calc_energy():.3f} J")
-
-        return self.rod, self.anchor, self.bob
+            # 单步直接用浮点数计算，避免小数组的开销，与 euler_trajectory 逐位一致
+            a_x1, a_theta = moving_pendulum_component_accelerations(self.theta, self.theta_dot, self.g, self.m1, self.m2, self.L)
+            x1_dot = self.x1_dot + a_x1 * self.dt
+            theta_dot = self.theta_dot + a_theta * self.dt
+            q = [self.x1 + x1_dot * self.dt, self.theta + theta_dot * self.dt]
+            q_dot = [x1_dot * self.damping, theta_dot * self.damping]
+        self.set_coordinates(q, q_dot)
+
+    @classmethod
+    def step_batch(cls, simulators):
+        """参数不同的多个可移动悬挂点单摆作为一个批量推进一步"""
+        if any(sim.lookahead is not None for sim in simulators):
+            return super().step_batch(simulators)
+        parameters = {name: [getattr(sim, name) for sim in simulators] for name in ("g", "m1", "m2", "L")}
+        euler_batch_step(simulators, moving_pendulum_accelerations, parameters, [sim.damping for sim in simulators])
+
+    def diagnostic_quantities(self):
+        """机械能与水平动量"""
+        momentum = (self.m1 + self.m2) * self.x1_dot + self.m2 * self.L * self.theta_dot * np.cos(self.theta)
+        return {"energy": self._calc_energy(), "momentum": momentum}
 
     # 能量跟踪功能
     def _calc_energy(self):
@@ -122,6 +189,9 @@ if __name__ == "__main__":
     
     # 案例3：小质量悬挂点剧烈运动
     # system = MovingPendulum(m1=0.5, m2=2, theta=np.pi/2*0.95)
+
+    # 预先成段计算轨迹，每帧只取出缓冲中的下一个状态
+    # system = MovingPendulum(m1=1, m2=1, L=2.0, theta=100*np.pi/180, damping=1.0, lookahead=True)
     
     system.play(interval=5)
     # system.save_animation("./example/moving_pendulum.mp4", fps=60, interval=1, frames=1000, dpi=200)
@@ -0,0 +1,217 @@
+#------------------------------------------------
+# name: neighbor.py
+# author: taster
+# date: 2025-04-19 16:42:05 星期六
+# id: 4b9e27d1c0a3f58e6d1b7c2a9f0e3d86
+# description: 近邻搜索与周期性边界
+#------------------------------------------------
+import numpy as np
+
+
+def minimum_image(delta, period=None):
+    """周期性边界下的最小镜像位移，period 为 None 时原样返回"""
+    if period is None:
+        return delta
+    return delta - period * np.round(delta / period)
+
+
+def wrap_positions(pos, lower, period):
+    """将坐标折回周期盒 [lower, lower + period)"""
+    return lower + np.mod(pos - lower, period)
+
+
+def _cell_offsets(n_cells, periodic):
+    """单个维度上需要检查的相邻格子偏移，格子数过少时去掉折回后重复的偏移"""
+    if periodic and n_cells < 3:
+        return np.arange(n_cells)
+    return np.array([-1, 0, 1])
+
+
+def cell_list_pairs(pos, cutoff, lower, size, periodic=False):
+    """
+    格子链表近邻搜索
+
+    将区域划分为边长不小于 cutoff 的格子，只在相邻的 3x3 个格子内比较距离，
+    复杂度为 O(N)。周期性边界下格子首尾相接，距离取最小镜像。
+
+    参数:
+        pos: (N, 2) 坐标
+        cutoff: 截断距离
+        lower: 区域左下角 (x, y)
+        size: 区域边长 (Lx, Ly)
+        periodic: 是否为周期性边界
+
+    返回:
+        i, j, dist: 满足 i < j 且距离不超过 cutoff 的点对及其距离，按 (i, j) 字典序排列
+    """
+    lower = np.asarray(lower, dtype=float)
+    size = np.asarray(size, dtype=float)
+    N = len(pos)
+    n_cells = np.maximum((size // max(cutoff, 1e-12)).astype(int), 1)
+    cell_size = size / n_cells
+
+    # 计算每个点所在的格子，并按格子排序
+    cell = np.floor((pos - lower) / cell_size).astype(int)
+    cell = np.clip(cell, 0, n_cells - 1) if not periodic else np.mod(cell, n_cells)
+    cell_id = cell[:, 0] * n_cells[1] + cell[:, 1]
+    order = np.argsort(cell_id, kind="stable")
+    counts = np.bincount(cell_id, minlength=n_cells[0] * n_cells[1])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    i_list, j_list = [], []
+    for dx in _cell_offsets(n_cells[0], periodic):
+        for dy in _cell_offsets(n_cells[1], periodic):
+            neighbor = cell + (dx, dy)
+            if periodic:
+                neighbor = np.mod(neighbor, n_cells)
+                valid = np.ones(N, dtype=bool)
+            else:
+                valid = np.all((neighbor >= 0) & (neighbor < n_cells), axis=1)
+            src = np.flatnonzero(valid)
+            neighbor_id = neighbor[src, 0] * n_cells[1] + neighbor[src, 1]
+
+            # 将每个点展开为与目标格子中所有点的组合
+            n_pairs = counts[neighbor_id]
+            i = np.repeat(src, n_pairs)
+            within = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+            j = order[np.repeat(starts[neighbor_id], n_pairs) + within]
+            keep = i < j
+            i_list.append(i[keep])
+            j_list.append(j[keep])
+
+    i = np.concatenate(i_list)
+    j = np.concatenate(j_list)
+    delta = minimum_image(pos[i] - pos[j], size if periodic else None)
+    dist = np.sqrt((delta ** 2).sum(axis=1))
+    keep = dist <= cutoff
+    i, j, dist = i[keep], j[keep], dist[keep]
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort], dist[sort]
+
+
+class VerletList:
+    """
+    带皮层(skin)的 Verlet 近邻表
+
+    以 cutoff + skin 为截断用格子链表建表，记下建表时的位置，之后的查询只检查表中的候选对。
+    自建表以来每个点的位移都不超过 skin / 2 时，两点的距离最多缩短 skin，
+    当前距离不超过 cutoff 的点对在建表时一定不超过 cutoff + skin，必然在表中；
+    有点的位移超过 skin / 2(或点数改变)时重建。查询结果与 cell_list_pairs 完全相同。
+
+    参数:
+        cutoff: 截断距离
+        skin: 皮层厚度，越厚重建越少，但每次查询的候选对越多
+        lower, size, periodic: 同 cell_list_pairs
+    """
+    def __init__(self, cutoff, skin, lower, size, periodic=False):
+        self.cutoff   = cutoff
+        self.skin     = skin
+        self.lower    = np.asarray(lower, dtype=float)
+        self.size     = np.asarray(size, dtype=float)
+        self.periodic = periodic
+        self.period   = self.size if periodic else None # 最小镜像的周期
+        self.builds   = 0 # 建表次数
+        self.queries  = 0 # 查询次数
+        self.reset()
+
+    def reset(self):
+        """丢弃当前的表，下一次查询时重建"""
+        self.reference = None # 建表时的位置
+        self.i = self.j = None
+
+    def needs_rebuild(self, pos):
+        """是否有点自建表以来的位移超过 skin / 2"""
+        if self.reference is None or self.reference.shape != pos.shape:
+            return True
+        if len(pos) == 0:
+            return False
+        delta = minimum_image(pos - self.reference, self.period)
+        return (delta ** 2).sum(axis=1).max() > (0.5 * self.skin) ** 2
+
+    def build(self, pos):
+        """以 cutoff + skin 为截断重建候选对"""
+        self.i, self.j, _ = cell_list_pairs(pos, self.cutoff + self.skin, self.lower, self.size, periodic=self.periodic)
+        self.reference = np.array(pos, dtype=float)
+        self.builds += 1
+
+    def pairs(self, pos):
+        """
+        距离不超过 cutoff 的点对，需要时先重建
+
+        返回:
+            i, j, dist: 与 cell_list_pairs 相同，i < j，按 (i, j) 字典序排列
+        """
+        self.queries += 1
+        if self.needs_rebuild(pos):
+            self.build(pos)
+        delta = minimum_image(pos[self.i] - pos[self.j], self.period)
+        dist = np.sqrt((delta ** 2).sum(axis=1))
+        keep = dist <= self.cutoff
+        return self.i[keep], self.j[keep], dist[keep]
+
+
+class StaticCells:
+    """
+    静止点集的格子索引
+
+    点不动时只建一次，之后只查询动点所在 3x3 个格子中的静止点，
+    代价与动点数及其附近的静止点数成正比，与静止点的总数无关。
+
+    参数:
+        pos: (M, 2) 静止点的坐标
+        cutoff: 截断距离，格子边长不小于它
+        lower, size, periodic: 同 cell_list_pairs
+    """
+    def __init__(self, pos, cutoff, lower, size, periodic=False):
+        self.lower    = np.asarray(lower, dtype=float)
+        self.size     = np.asarray(size, dtype=float)
+        self.periodic = periodic
+        self.cutoff   = cutoff # 不超过它的截断都可以用这套格子查询
+        self.n_cells  = np.maximum((self.size // max(cutoff, 1e-12)).astype(int), 1)
+        cell_id = self.cell_id(self.cell(pos))
+        self.order  = np.argsort(cell_id, kind="stable") # 按格子排列的点编号
+        self.counts = np.bincount(cell_id, minlength=self.n_cells[0] * self.n_cells[1])
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def cell(self, pos):
+        """坐标所在的格子 (列, 行)"""
+        cell = np.floor((pos - self.lower) / (self.size / self.n_cells)).astype(int)
+        return np.clip(cell, 0, self.n_cells - 1) if not self.periodic else np.mod(cell, self.n_cells)
+
+    def cell_id(self, cell):
+        return cell[:, 0] * self.n_cells[1] + cell[:, 1]
+
+    def near(self, pos):
+        """与 pos 中任一点相邻(同一或相邻格子)的静止点编号，升序且不重复"""
+        cell = self.cell(pos)
+        neighbors = []
+        for dx in _cell_offsets(self.n_cells[0], self.periodic):
+            for dy in _cell_offsets(self.n_cells[1], self.periodic):
+                neighbor = cell + (dx, dy)
+                if self.periodic:
+                    neighbor = np.mod(neighbor, self.n_cells)
+                else:
+                    neighbor = neighbor[np.all((neighbor >= 0) & (neighbor < self.n_cells), axis=1)]
+                neighbors.append(self.cell_id(neighbor))
+        cells = np.unique(np.concatenate(neighbors)) if neighbors else np.zeros(0, dtype=int)
+        n_members = self.counts[cells]
+        within = np.arange(n_members.sum()) - np.repeat(np.cumsum(n_members) - n_members, n_members)
+        return np.sort(self.order[np.repeat(self.starts[cells], n_members) + within])
+
+
+def connected_components(n, i, j):
+    """
+    依据点对 (i, j) 计算连通分量
+
+    最小标号传播加指针跳跃，全部为向量化操作。返回的标号为分量中最小的节点编号。
+    """
+    labels = np.arange(n)
+    while True:
+        lowest = np.minimum(labels[i], labels[j])
+        new = labels.copy()
+        np.minimum.at(new, i, lowest)
+        np.minimum.at(new, j, lowest)
+        new = new[new] # 指针跳跃
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
@@ -0,0 +1,336 @@
+#------------------------------------------------
+# name: observables.py
+# author: taster
+# date: 2025-06-02 20:37:14 星期一
+# id: 5e0b8c3d7a1f4926b4c8e2d6f9a3071b
+# description: 流式观测量：在线统计与直方图
+#------------------------------------------------
+import numpy as np
+from neighbor import cell_list_pairs
+
+"""
+大规模气体模拟中不保存轨迹，只在采样时把当前状态并入定长的累加器：
+矩用 Welford 算法在线更新(一批样本先算出自身的均值与二阶中心矩，再与已有结果合并)，
+分布用固定分箱的直方图(np.bincount)累加。内存占用与步数无关。
+
+观测器与 ConservationMonitor 的接口相同(stride、observe(simulator)、reset())，
+用 simulator.add_observer 挂接，由 Animator2D.advance 按步长调用。
+"""
+
+
+def packing_fraction(simulator):
+    """小球所占的面积分数"""
+    return simulator.N * np.pi * simulator.radius ** 2 / simulator.size.prod()
+
+
+class RunningMoments:
+    """
+    在线均值与方差
+
+    参数:
+        shape: 每个样本的形状，() 为标量
+    """
+    def __init__(self, shape=()):
+        self.shape = shape
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean  = np.zeros(self.shape)
+        self.m2    = np.zeros(self.shape) # 二阶中心矩之和
+
+    def update(self, values):
+        """并入一批样本，values 的形状为 (n, *shape)"""
+        values = np.asarray(values, dtype=float).reshape((-1,) + tuple(self.shape))
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        """样本方差(无偏)"""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full(self.shape, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class Histogram:
+    """
+    固定分箱的直方图
+
+    参数:
+        lower, upper: 范围
+        bins: 分箱数
+    """
+    def __init__(self, lower, upper, bins=64):
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.bins  = bins
+        self.width = (self.upper - self.lower) / bins
+        self.reset()
+
+    def reset(self):
+        self.counts   = np.zeros(self.bins)
+        self.outliers = 0 # 落在范围之外的样本数
+
+    def update(self, values, weights=None):
+        """并入一批样本"""
+        values = np.asarray(values, dtype=float).ravel()
+        index = np.floor((values - self.lower) / self.width).astype(np.int64)
+        inside = (index >= 0) & (index < self.bins)
+        if weights is not None:
+            weights = np.broadcast_to(weights, values.shape)[inside]
+        self.counts += np.bincount(index[inside], weights=weights, minlength=self.bins)
+        self.outliers += int(np.count_nonzero(~inside))
+
+    @property
+    def edges(self):
+        return self.lower + self.width * np.arange(self.bins + 1)
+
+    @property
+    def centers(self):
+        return self.lower + self.width * (np.arange(self.bins) + 0.5)
+
+    def density(self):
+        """归一化的概率密度(计入范围之外的样本)"""
+        total = self.counts.sum() + self.outliers
+        return self.counts / (total * self.width) if total else np.zeros(self.bins)
+
+
+class SpeedDistribution:
+    """
+    速率分布，与二维麦克斯韦-玻尔兹曼分布比较
+
+    二维中每个小球的平均动能为 kT，质量为 m 的小球的速率分布为 f(v) = (m v / kT) exp(-m v^2 / 2kT)；
+    质量不同时理论分布是各质量分布的混合，按质量的直方图计算。
+
+    参数:
+        stride: 采样间隔(物理步数)
+        bins: 速率分箱数
+        v_max: 速率范围的上限，None 表示第一次采样时取 4 倍方均根速率
+        mass_bins: 计算理论分布时质量的分箱数
+    """
+    def __init__(self, stride=10, bins=64, v_max=None, mass_bins=32):
+        self.stride    = stride
+        self.bins      = bins
+        self.v_max     = v_max
+        self.mass_bins = mass_bins
+        self.reset()
+
+    def reset(self):
+        self.histogram = None
+        self.kinetic   = RunningMoments() # 每个小球的动能
+        self.masses    = None             # (质量, 权重)
+
+    def observe(self, simulator):
+        speed = np.linalg.norm(simulator.vol, axis=1)
+        if self.histogram is None:
+            v_max = self.v_max or 4 * np.sqrt(np.mean(speed ** 2)) or 1.0
+            self.histogram = Histogram(0.0, v_max, self.bins)
+            counts, edges = np.histogram(simulator.mass, bins=self.mass_bins)
+            self.masses = (0.5 * (edges[1:] + edges[:-1]), counts / counts.sum())
+        self.histogram.update(speed)
+        self.kinetic.update(0.5 * simulator.mass * speed ** 2)
+
+    @property
+    def temperature(self):
+        """kT，二维中等于每个小球的平均动能"""
+        return self.kinetic.mean
+
+    def maxwell_boltzmann(self):
+        """各分箱中心处的理论概率密度"""
+        v = self.histogram.centers
+        mass, weight = self.masses
+        scaled = mass[:, np.newaxis] / self.temperature
+        return (weight[:, np.newaxis] * scaled * v * np.exp(-0.5 * scaled * v ** 2)).sum(axis=0)
+
+    def deviation(self):
+        """与理论分布的总变差距离，0 为完全一致，1 为完全不重叠"""
+        return 0.5 * np.abs(self.histogram.density() - self.maxwell_boltzmann()).sum() * self.histogram.width
+
+
+class WallPressure:
+    """
+    由墙壁冲量计算的压强(二维中为单位长度上的力)
+
+    每次采样取两次采样之间墙壁受到的冲量(simulator.wall_impulse 的增量)，除以时间与周长。
+
+    参数:
+        stride: 采样间隔(物理步数)，越大单次样本的涨落越小
+    """
+    def __init__(self, stride=100):
+        self.stride = stride
+        self.reset()
+
+    def reset(self):
+        self.pressure = RunningMoments()
+        self.last     = None # 上一次采样的 (步数, 冲量)
+
+    def observe(self, simulator):
+        current = (simulator.step_count, simulator.wall_impulse)
+        if self.last is not None and current[0] > self.last[0]:
+            elapsed = (current[0] - self.last[0]) * simulator.dt
+            perimeter = 2 * simulator.size.sum()
+            self.pressure.update([(current[1] - self.last[1]) / (elapsed * perimeter)])
+        self.last = current
+
+    @staticmethod
+    def ideal(simulator):
+        """理想气体的压强 N kT / A，kT 取当前每个小球的平均动能"""
+        kT = 0.5 * (simulator.mass * (simulator.vol ** 2).sum(axis=1)).mean()
+        return simulator.N * kT / simulator.size.prod()
+
+    @staticmethod
+    def hard_disk(simulator):
+        """硬盘气体的压强，Henderson 状态方程 P = N kT / A * (1 + φ^2 / 8) / (1 - φ)^2，φ 为面积分数"""
+        phi = packing_fraction(simulator)
+        return WallPressure.ideal(simulator) * (1 + phi ** 2 / 8) / (1 - phi) ** 2
+
+
+class PairCorrelation:
+    """
+    对关联函数 g(r)
+
+    用格子链表找出距离不超过 r_max 的小球对，把距离累加到直方图中，再除以均匀分布下
+    同一环带中的期望对数。墙壁边界下靠近墙的小球的环带有一部分在盒外，g(r) 在大 r 处略偏低。
+
+    参数:
+        stride: 采样间隔(物理步数)
+        r_max: 最大距离，None 表示第一次采样时取 10 倍半径(不超过盒子边长的一半)
+        bins: 分箱数
+    """
+    def __init__(self, stride=50, r_max=None, bins=100):
+        self.stride = stride
+        self.r_max  = r_max
+        self.bins   = bins
+        self.reset()
+
+    def reset(self):
+        self.histogram = None
+        self.samples   = 0
+
+    def observe(self, simulator):
+        if self.histogram is None:
+            r_max = self.r_max or min(10 * simulator.radius, 0.5 * simulator.size.min())
+            self.histogram = Histogram(0.0, r_max, self.bins)
+            self.N, self.area = simulator.N, simulator.size.prod()
+        _, _, dist = cell_list_pairs(
+            simulator.pos, self.histogram.upper, simulator.lower, simulator.size, periodic=simulator.period is not None,
+        )
+        self.histogram.update(dist)
+        self.samples += 1
+
+    def g(self):
+        """各分箱中心处的 g(r)"""
+        edges = self.histogram.edges
+        shell = np.pi * (edges[1:] ** 2 - edges[:-1] ** 2) / self.area
+        expected = self.samples * 0.5 * self.N * (self.N - 1) * shell
+        return self.histogram.counts / np.maximum(expected, 1e-300)
+
+
+class MeanFreePath:
+    """
+    平均自由程
+
+    两次采样之间所有小球走过的总路程(按采样时的速率之和用梯形公式估计)除以碰撞次数的两倍
+    (每次碰撞结束两段自由程)，碰撞次数取 simulator.collision_count 的增量。
+
+    参数:
+        stride: 采样间隔(物理步数)
+    """
+    def __init__(self, stride=10):
+        self.stride = stride
+        self.reset()
+
+    def reset(self):
+        self.distance   = 0.0  # 累计路程
+        self.collisions = 0    # 累计碰撞次数
+        self.last       = None # 上一次采样的 (步数, 速率之和, 碰撞次数)
+
+    def observe(self, simulator):
+        current = (simulator.step_count, np.linalg.norm(simulator.vol, axis=1).sum(), simulator.collision_count)
+        if self.last is not None:
+            elapsed = (current[0] - self.last[0]) * simulator.dt
+            self.distance += 0.5 * (current[1] + self.last[1]) * elapsed
+            self.collisions += current[2] - self.last[2]
+        self.last = current
+
+    @property
+    def value(self):
+        return self.distance / (2 * self.collisions) if self.collisions else np.inf
+
+    @staticmethod
+    def theory(simulator):
+        """
+        等质量硬盘气体的平均自由程 1 / (sqrt(2) n d χ)
+
+        n 为面密度，d 为直径，χ = (1 - 7φ/16) / (1 - φ)^2 为接触处的对关联函数(Enskog 修正)。
+        质量不同时轻的小球更快，相对速率更大，实际的平均自由程更短。
+        """
+        phi = packing_fraction(simulator)
+        chi = (1 - 7 * phi / 16) / (1 - phi) ** 2
+        return simulator.size.prod() / (np.sqrt(2) * simulator.N * 2 * simulator.radius * chi)
+
+
+def attach_gas_observables(simulator, stride=10, pair_stride=None, pressure_stride=None):
+    """
+    给 CollisionSimulator2D 挂接速率分布、压强、对关联函数与平均自由程
+
+    参数:
+        stride: 速率分布与平均自由程的采样间隔
+        pair_stride: 对关联函数的采样间隔，默认 5 * stride
+        pressure_stride: 压强的采样间隔，默认 10 * stride
+
+    返回:
+        名称 -> 观测器
+    """
+    observers = {
+        "speed": SpeedDistribution(stride),
+        "pressure": WallPressure(pressure_stride or 10 * stride),
+        "pair_correlation": PairCorrelation(pair_stride or 5 * stride),
+        "mean_free_path": MeanFreePath(stride),
+    }
+    for observer in observers.values():
+        simulator.add_observer(observer)
+    return observers
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import time
+    from collision_2d import CollisionSimulator2D
+
+    # 无重力的气体：速率分布趋向麦克斯韦-玻尔兹曼分布
+    np.random.seed(0)
+    simulator = CollisionSimulator2D(xlim=[0, 4], ylim=[0, 4], N=400, placement="grid")
+    simulator.g = 0
+    observables = attach_gas_observables(simulator, stride=10)
+    start = time.perf_counter()
+    simulator.advance(5000)
+    print(f"5000 步用时 {time.perf_counter() - start:.2f} 秒")
+    speed, pressure = observables["speed"], observables["pressure"]
+    mean_free_path, pair = observables["mean_free_path"], observables["pair_correlation"]
+    print(f"kT = {speed.temperature:.3f}，与麦克斯韦-玻尔兹曼分布的总变差距离 {speed.deviation():.3f}")
+    print(
+        f"压强 {pressure.pressure.mean:.2f} ± {pressure.pressure.std:.2f}，"
+        f"理想气体 {WallPressure.ideal(simulator):.2f}，硬盘气体 {WallPressure.hard_disk(simulator):.2f}"
+    )
+    print(f"平均自由程 {mean_free_path.value:.4f}，理论值 {MeanFreePath.theory(simulator):.4f}")
+
+    fig, (ax_speed, ax_pair) = plt.subplots(1, 2, figsize=(10, 4))
+    ax_speed.bar(speed.histogram.centers, speed.histogram.density(), width=speed.histogram.width, alpha=0.5, label="simulation")
+    ax_speed.plot(speed.histogram.centers, speed.maxwell_boltzmann(), "r-", label="Maxwell-Boltzmann")
+    ax_speed.set(xlabel="v", ylabel="f(v)")
+    ax_speed.legend()
+    ax_pair.plot(pair.histogram.centers, pair.g())
+    ax_pair.set(xlabel="r", ylabel="g(r)")
+    plt.show()
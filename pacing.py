@@ -0,0 +1,128 @@
+#------------------------------------------------
+# name: pacing.py
+# author: taster
+# date: 2025-05-31 16:22:09 星期六
+# id: c3a9e5172f0d4b6e81d7b2f4a0e6c958
+# description: 实时节拍：按模拟时间与墙上时间之比调节每帧的步数并跳帧
+#------------------------------------------------
+import time
+from collections import deque
+
+"""
+固定的帧间隔加每帧固定步数时，模拟时间的流速取决于机器快慢与负载。实时节拍以
+"模拟时间 / 墙上时间 = ratio" 为目标：每帧先算出按目标应当到达的模拟时间，
+落后多少步就补多少步；补步数受帧预算(帧间隔减去绘制耗时)限制，步长与绘制的耗时
+用指数平均实时测量。补不上时跳过绘制，把整帧的时间都用来推进；连续跳过 max_skip 帧后
+必须绘制一次。落后超过 max_lag 秒时放弃追赶，记为丢弃的模拟时间，此时实际速率低于目标。
+"""
+
+
+class RealTimeClock:
+    """
+    实时节拍
+
+    参数:
+        dt: 每个物理步长对应的模拟时间
+        ratio: 目标速率，模拟时间 / 墙上时间，1.0 为实时，0.5 为慢放
+        interval: 帧间隔(秒)
+        max_skip: 最多连续跳过的绘制次数
+        max_lag: 落后超过此墙上时间(秒)时不再追赶
+        smoothing: 耗时指数平均的权重
+        window: 统计实际速率的时间窗口(秒)
+    """
+    def __init__(self, dt, ratio=1.0, interval=0.01, max_skip=4, max_lag=0.25, smoothing=0.2, window=1.0):
+        self.dt        = dt
+        self.ratio     = ratio
+        self.interval  = interval
+        self.max_skip  = max_skip
+        self.max_lag   = max_lag
+        self.smoothing = smoothing
+        self.window    = window
+        self.start()
+
+    def start(self, now=None):
+        """从当前时刻开始计时"""
+        now = time.perf_counter() if now is None else now
+        self.origin    = now  # 模拟时间为 0 时对应的墙上时间(放弃追赶时向后平移)
+        self.sim_time  = 0.0  # 已推进的模拟时间
+        self.step_cost = None # 每步耗时(秒)
+        self.draw_cost = 0.0  # 每次绘制耗时(秒)
+        self.skipped   = 0    # 当前连续跳过的绘制次数
+        self.skips     = 0    # 因落后而跳过的绘制总数
+        self.idle      = False # 本帧是否因超前而无需推进
+        self.draws     = 0    # 绘制次数
+        self.steps     = 0    # 步数
+        self.dropped   = 0.0  # 放弃追赶的模拟时间
+        self.samples   = deque([(now, 0.0, 0, 0)]) # (墙上时间, 模拟时间, 步数, 绘制次数)
+
+    def _average(self, previous, value):
+        return value if previous is None else (1 - self.smoothing) * previous + self.smoothing * value
+
+    def plan(self, now=None):
+        """
+        本帧推进的步数与是否绘制
+
+        返回:
+            (n_steps, draw)
+        """
+        now = time.perf_counter() if now is None else now
+        lag = now - self.origin - self.sim_time / self.ratio # 落后的墙上时间
+        if lag > self.max_lag:
+            self.dropped += (lag - self.max_lag) * self.ratio
+            self.origin += lag - self.max_lag
+            lag = self.max_lag
+        owed = max(int(lag * self.ratio / self.dt), 0)
+        self.idle = owed == 0
+        if self.step_cost is None:
+            return min(owed, 1), owed > 0 # 尚未测得步长耗时，先推进一步
+        affordable = max(int((self.interval - self.draw_cost) / self.step_cost), 1)
+        draw = True
+        if owed > affordable and self.skipped < self.max_skip:
+            draw = False
+            affordable = max(int(self.interval / self.step_cost), 1)
+        n_steps = min(owed, affordable)
+        return n_steps, draw and n_steps > 0
+
+    def record_steps(self, n_steps, seconds):
+        """记录本帧推进的步数与耗时"""
+        self.steps += n_steps
+        self.sim_time += n_steps * self.dt
+        if n_steps:
+            self.step_cost = self._average(self.step_cost, seconds / n_steps)
+
+    def record_draw(self, seconds=None):
+        """记录一次绘制及其耗时，seconds 为 None 表示本帧没有绘制"""
+        if seconds is None:
+            if self.idle:
+                return # 超前于目标，本帧没有推进，不算跳帧
+            self.skipped += 1
+            self.skips += 1
+        else:
+            self.skipped = 0
+            self.draws += 1
+            self.draw_cost = self._average(self.draw_cost, seconds)
+        now = time.perf_counter()
+        self.samples.append((now, self.sim_time, self.steps, self.draws))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+
+    def report(self):
+        """最近一个时间窗口内的实际速率、每帧步数与绘制帧率，以及累计跳过的绘制与丢弃的模拟时间"""
+        (t0, sim0, steps0, draws0), (t1, sim1, steps1, draws1) = self.samples[0], self.samples[-1]
+        elapsed = max(t1 - t0, 1e-9)
+        return {
+            "target": self.ratio,
+            "achieved": (sim1 - sim0) / elapsed,
+            "steps_per_draw": (steps1 - steps0) / max(draws1 - draws0, 1),
+            "fps": (draws1 - draws0) / elapsed,
+            "skipped": self.skips,
+            "dropped": self.dropped,
+        }
+
+    def __str__(self):
+        report = self.report()
+        return (
+            f"速率 {report['achieved']:.2f}/{report['target']:.2f}x  "
+            f"{report['fps']:.0f} fps  每帧 {report['steps_per_draw']:.1f} 步  "
+            f"跳过 {report['skipped']} 帧  丢弃 {report['dropped']:.2f} 秒"
+        )
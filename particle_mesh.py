@@ -0,0 +1,230 @@
+#------------------------------------------------
+# name: particle_mesh.py
+# author: taster
+# date: 2025-05-20 19:36:14 星期二
+# id: c58e1f3a7b2d4e06918f4a6d0b3c5e27
+# description: 粒子-网格(PM/P3M)引力求解
+#------------------------------------------------
+import math
+import numpy as np
+from neighbor import cell_list_pairs, minimum_image
+
+"""
+质点在平面内运动，但引力仍是三维的 1/r 势，因此平面上的势不满足二维泊松方程，
+其核函数在二维傅里叶空间中为 2πG/k(软化后为 2πG e^{-kε}/k)，而不是 4πG/k²。
+求解流程：
+1. 云中格点(CIC)法把质量分配到网格节点；
+2. 网格质量与核函数做 FFT 卷积得到网格上的势，计算量为 O(G log G)；
+3. 对势求梯度得到网格上的加速度，再用同样的 CIC 权重插值回质点。
+周期性边界直接在傅里叶空间中给出核函数(去掉 k=0 分量，即扣除平均密度)；
+孤立边界把网格补零到两倍大小，在实空间采样核函数后做 FFT，避免周期镜像的干扰。
+P3M：按三维中的高斯分解把 1/r 分为长程的 erf(r/2r_s)/r 与短程的 erfc(r/2r_s)/r，
+前者限制在平面上的二维傅里叶变换为 2π erfc(k r_s)/k，由网格计算；后者按高斯衰减，
+在 r_cut 以内由格子链表逐对计算。分解按软化后的距离 sqrt(r² + ε²) 进行，
+两部分之和恰为直接求和中的 Plummer 软化对势。
+"""
+
+
+erf = np.vectorize(math.erf, otypes=[float])
+erfc = np.vectorize(math.erfc, otypes=[float])
+
+
+def long_range_inverse_r(r, r_split, softening=0.0):
+    """
+    长程对势的形状 erf(ρ / 2r_s) / ρ，ρ = sqrt(r² + ε²)
+
+    按软化后的距离 ρ 分解，长程部分是 r² 的光滑函数，与短程部分 erfc(ρ / 2r_s) / ρ 相加
+    恰为软化的对势。ρ = 0 处取极限 1 / (r_s sqrt(π))。
+    """
+    rho = np.sqrt(np.asarray(r, dtype=float) ** 2 + softening ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = erf(rho / (2 * r_split)) / rho
+    return np.where(rho > 0, value, 1 / (r_split * np.sqrt(np.pi)))
+
+
+class ParticleMesh:
+    """
+    粒子-网格引力求解器
+
+    参数:
+        lower: 区域左下角 (x, y)
+        size: 区域边长 (Lx, Ly)，质点需位于区域内(周期性边界下会自动折回)
+        grid: 每个方向的网格节点数，整数或 (Gx, Gy)
+        G: 引力常数
+        softening: Plummer 软化长度，与直接求和的对力一致
+        periodic: True 为周期性边界，False 为孤立边界(补零)
+        r_split: 长短程的分界尺度(以网格边长为单位)，None 表示纯 PM(不做短程修正)
+        r_cut: 短程修正的截断距离(以 r_split 为单位)
+
+    P3M 的短程部分逐对计算，开销正比于 r_cut 圆内的平均质点数，质点很多时应相应加密网格。
+    """
+    def __init__(self, lower, size, grid=128, G=1.0, softening=0.1, periodic=False, r_split=None, r_cut=4.5):
+        self.lower     = np.asarray(lower, dtype=float)
+        self.size      = np.asarray(size, dtype=float)
+        self.shape     = tuple(int(n) for n in np.broadcast_to(grid, (2,)))
+        self.G         = G
+        self.softening = softening
+        self.periodic  = periodic
+        # 周期性边界下节点 G 与节点 0 重合；孤立边界下节点覆盖区域的两端
+        self.cell      = self.size / (np.array(self.shape) - (0 if periodic else 1))
+        self.r_split   = None if r_split is None else r_split * self.cell.max()
+        self.r_cut     = None if r_split is None else r_cut * self.r_split
+        self.padded    = self.shape if periodic else tuple(2 * n for n in self.shape)
+        self.green     = self.green_function()
+        # 实空间中相邻 3x3 个节点的离散核函数，用于从网格势中扣除质点的自能
+        kernel = np.fft.irfft2(self.green, s=self.padded)
+        self.near_kernel = kernel[np.ix_(np.arange(-1, 2) % self.padded[0], np.arange(-1, 2) % self.padded[1])]
+        if self.r_split is not None:
+            self.build_short_range_table()
+
+    def green_function(self):
+        """网格上的核函数(rfft2 后的频域形式)，与 rfft2 后的网格质量相乘即得网格势"""
+        kx = 2 * np.pi * np.fft.fftfreq(self.padded[0], d=self.cell[0])
+        ky = 2 * np.pi * np.fft.rfftfreq(self.padded[1], d=self.cell[1])
+        k = np.sqrt(kx[:, np.newaxis] ** 2 + ky[np.newaxis, :] ** 2)
+        r = self.grid_distance()
+        if self.periodic:
+            # 连续核函数的傅里叶变换除以单个网格的面积即为离散核函数
+            with np.errstate(divide="ignore"):
+                if self.r_split is None:
+                    green = -2 * np.pi * self.G * np.exp(-k * self.softening) / k
+                else:
+                    green = -2 * np.pi * self.G * erfc(k * self.r_split) / k
+            green[0, 0] = 0.0 # 扣除平均密度
+            green /= self.cell.prod()
+            if self.r_split is not None:
+                # 软化带来的修正按 1/r³ 衰减，可以直接在实空间中按最小镜像采样
+                correction = long_range_inverse_r(r, self.r_split, self.softening) - long_range_inverse_r(r, self.r_split)
+                green = green - self.G * np.fft.rfft2(correction)
+        else:
+            # 在两倍大小的网格上按最小镜像距离采样实空间核函数
+            if self.r_split is None:
+                kernel = -self.G / np.sqrt(r ** 2 + self.softening ** 2)
+            else:
+                kernel = -self.G * long_range_inverse_r(r, self.r_split, self.softening)
+            green = np.fft.rfft2(kernel)
+        if self.r_split is not None:
+            # P3M 中长程核函数已足够平滑，对 CIC 分配与插值各做一次反卷积
+            wx = np.sinc(np.fft.fftfreq(self.padded[0], d=self.cell[0]) * self.cell[0]) ** 2
+            wy = np.sinc(np.fft.rfftfreq(self.padded[1], d=self.cell[1]) * self.cell[1]) ** 2
+            green = green / (wx[:, np.newaxis] * wy[np.newaxis, :]) ** 2
+        return green
+
+    def grid_distance(self):
+        """(补零后的)网格上各节点到原点的最小镜像距离"""
+        nx = np.fft.fftfreq(self.padded[0], d=1 / self.padded[0]) * self.cell[0]
+        ny = np.fft.fftfreq(self.padded[1], d=1 / self.padded[1]) * self.cell[1]
+        return np.sqrt(nx[:, np.newaxis] ** 2 + ny[np.newaxis, :] ** 2)
+
+    def build_short_range_table(self, n=4096):
+        """
+        短程对势 φ_S(r) 及 φ_S'(r)/r 的插值表，φ_S = -G erfc(ρ / 2r_s) / ρ，ρ = sqrt(r² + ε²)
+        """
+        r = np.linspace(0.0, self.r_cut, n)
+        rho = np.sqrt(r ** 2 + self.softening ** 2)
+        phi = -self.G * erfc(rho / (2 * self.r_split)) / rho
+        slope = np.gradient(phi, r, edge_order=2)
+        self.table_r = r
+        self.table_phi = phi
+        self.table_g = np.concatenate([[slope[1] / r[1]], slope[1:] / r[1:]])
+
+    def cic(self, pos):
+        """CIC 权重：质点所在网格左下节点的下标 (N, 2) 与相对位置 (N, 2)"""
+        u = (pos - self.lower) / self.cell
+        index = np.floor(u).astype(int)
+        if not self.periodic:
+            index = np.clip(index, 0, np.array(self.shape) - 2) # 恰在上边界的质点归入最后一格
+        return index, u - index
+
+    def corners(self, index, frac):
+        """四个相邻节点的展平下标与权重"""
+        for dx in (0, 1):
+            for dy in (0, 1):
+                ix, iy = index[:, 0] + dx, index[:, 1] + dy
+                if self.periodic:
+                    ix, iy = ix % self.shape[0], iy % self.shape[1]
+                weight = (frac[:, 0] if dx else 1 - frac[:, 0]) * (frac[:, 1] if dy else 1 - frac[:, 1])
+                yield ix * self.shape[1] + iy, weight
+
+    def deposit(self, index, frac, mass):
+        """把质量分配到网格节点"""
+        size = self.shape[0] * self.shape[1]
+        grid = np.zeros(size)
+        for flat, weight in self.corners(index, frac):
+            grid += np.bincount(flat, weights=mass * weight, minlength=size)
+        return grid.reshape(self.shape)
+
+    def interpolate(self, field, index, frac):
+        """用同样的 CIC 权重把网格上的量插值回质点，field 形状为 (..., Gx, Gy)"""
+        field = field.reshape(field.shape[:-2] + (-1,))
+        return sum(field[..., flat] * weight for flat, weight in self.corners(index, frac))
+
+    def mesh_potential(self, grid):
+        """网格质量与核函数卷积得到网格势"""
+        phi = np.fft.irfft2(np.fft.rfft2(grid, s=self.padded) * self.green, s=self.padded)
+        return phi[:self.shape[0], :self.shape[1]]
+
+    def mesh_gradient(self, grid):
+        """网格势的梯度，形状为 (2, Gx, Gy)；周期性边界在频域中求导"""
+        if self.periodic:
+            phi_k = np.fft.rfft2(grid) * self.green
+            kx = 2 * np.pi * np.fft.fftfreq(self.shape[0], d=self.cell[0])
+            ky = 2 * np.pi * np.fft.rfftfreq(self.shape[1], d=self.cell[1])
+            if self.shape[0] % 2 == 0:
+                kx[self.shape[0] // 2] = 0.0 # Nyquist 分量的导数没有意义
+            if self.shape[1] % 2 == 0:
+                ky[-1] = 0.0
+            return np.stack([
+                np.fft.irfft2(1j * kx[:, np.newaxis] * phi_k, s=self.shape),
+                np.fft.irfft2(1j * ky[np.newaxis, :] * phi_k, s=self.shape),
+            ])
+        return np.stack(np.gradient(self.mesh_potential(grid), *self.cell, edge_order=2))
+
+    def short_range_pairs(self, pos):
+        """截断距离以内的点对、从 j 指向 i 的位移与距离"""
+        i, j, dist = cell_list_pairs(pos, self.r_cut, self.lower, self.size, periodic=self.periodic)
+        delta = minimum_image(pos[i] - pos[j], self.size if self.periodic else None)
+        return i, j, delta, dist
+
+    def prepare(self, pos):
+        """周期性边界下把坐标折回区域内"""
+        pos = np.asarray(pos, dtype=float)
+        if self.periodic:
+            pos = self.lower + np.mod(pos - self.lower, self.size)
+        return pos
+
+    def accelerations(self, pos, mass):
+        """全部质点的引力加速度 (N, 2)"""
+        pos = self.prepare(pos)
+        index, frac = self.cic(pos)
+        grad = self.mesh_gradient(self.deposit(index, frac, mass))
+        acc = -self.interpolate(grad, index, frac).T
+        if self.r_split is not None:
+            i, j, delta, dist = self.short_range_pairs(pos)
+            g = np.interp(dist, self.table_r, self.table_g)[:, np.newaxis] * delta
+            for axis in range(2):
+                acc[:, axis] -= np.bincount(i, weights=mass[j] * g[:, axis], minlength=len(pos))
+                acc[:, axis] += np.bincount(j, weights=mass[i] * g[:, axis], minlength=len(pos))
+        return acc
+
+    def potential_energy(self, pos, mass):
+        """
+        总引力势能，扣除每个质点与自身在网格上的相互作用
+
+        周期性边界下扣除了平均密度，势能相差一个常数，只适合观察漂移。
+        """
+        pos = self.prepare(pos)
+        index, frac = self.cic(pos)
+        phi = self.interpolate(self.mesh_potential(self.deposit(index, frac, mass)), index, frac)
+        # 自能：质点自身的四个节点权重两两之间的离散核函数
+        weights = list(self.corners(index, frac))
+        offsets = [(dx, dy) for dx in (0, 1) for dy in (0, 1)]
+        self_phi = 0.0
+        for (ax, ay), (_, wa) in zip(offsets, weights):
+            for (bx, by), (_, wb) in zip(offsets, weights):
+                self_phi = self_phi + wa * wb * self.near_kernel[ax - bx + 1, ay - by + 1]
+        energy = 0.5 * (mass * (phi - mass * self_phi)).sum()
+        if self.r_split is not None:
+            i, j, _, dist = self.short_range_pairs(pos)
+            energy += (mass[i] * mass[j] * np.interp(dist, self.table_r, self.table_phi)).sum()
+        return energy
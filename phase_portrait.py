@@ -0,0 +1,97 @@
+#------------------------------------------------
+# name: phase_portrait.py
+# author: taster
+# date: 2025-06-07 11:02:47 星期六
+# id: 7c1d4a9e0b3f46258e6a2d0c5f8b1e37
+# description: 相空间密度图：固定分辨率的二维直方图代替不断增长的相图曲线
+#------------------------------------------------
+import numpy as np
+from matplotlib.colors import to_rgb
+
+"""
+相图曲线保存全部历史点，数据量与绘制耗时都随运行时间增长。相空间密度图把 (θ, θ') 样本
+落入固定分辨率的二维直方图，用一张 imshow 图像显示并原地更新，内存与绘制耗时与运行时间无关，
+显示的是轨道在相空间中的停留密度而不是层层叠画的折线。
+
+样本先放入待处理列表，刷新时(或积攒到 chunk 个时)用 np.bincount 一次并入直方图。
+decay < 1 时每个新样本使已有密度乘以 decay，较早的轨道逐渐淡出。
+多条曲线(如双摆的两个摆)各占一层，按各自的颜色在白色背景上叠加为一张 RGBA 图像。
+"""
+
+
+class PhaseDensity:
+    """
+    相空间密度图
+
+    参数:
+        xlim, ylim: 坐标范围
+        resolution: 图像的 (列数, 行数)
+        colors: 各层的颜色，层数等于颜色数
+        decay: 每个新样本使已有密度乘以的系数，1 表示不衰减
+        wrap: 横坐标(角度)是否折回 [-π, π)
+        log: 是否按 log(1 + 密度) 显示，使稀疏的区域也能看见
+        chunk: 待处理样本积攒到此数目时自动并入直方图
+    """
+    def __init__(self, xlim, ylim, resolution=(200, 200), colors=("blue",), decay=1.0, wrap=True, log=True, chunk=4096):
+        self.xlim       = tuple(xlim)
+        self.ylim       = tuple(ylim)
+        self.resolution = tuple(resolution)
+        self.colors     = np.array([to_rgb(color) for color in colors])
+        self.decay      = decay
+        self.wrap       = wrap
+        self.log        = log
+        self.chunk      = chunk
+        self.reset()
+
+    @property
+    def extent(self):
+        """imshow 的 extent"""
+        return self.xlim + self.ylim
+
+    def reset(self):
+        """清空密度与待处理样本"""
+        nx, ny = self.resolution
+        self.counts  = np.zeros((len(self.colors), ny, nx)) # 各层的密度，行对应纵坐标
+        self.pending = []                                    # 每个元素为各层的 (x, y)
+        self.samples = 0                                     # 已并入的样本数
+
+    def push(self, *points):
+        """记录一个时刻各层的样本 (x, y)"""
+        self.pending.append(points)
+        if len(self.pending) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        """把待处理样本并入直方图"""
+        if not self.pending:
+            return
+        samples = np.asarray(self.pending, dtype=float) # (n, 层数, 2)
+        self.pending = []
+        n = len(samples)
+        x, y = samples[..., 0], samples[..., 1]
+        if self.wrap:
+            x = (x + np.pi) % (2 * np.pi) - np.pi
+        nx, ny = self.resolution
+        col = np.floor((x - self.xlim[0]) / (self.xlim[1] - self.xlim[0]) * nx).astype(np.int64)
+        row = np.floor((y - self.ylim[0]) / (self.ylim[1] - self.ylim[0]) * ny).astype(np.int64)
+        inside = (col >= 0) & (col < nx) & (row >= 0) & (row < ny)
+        layer = np.broadcast_to(np.arange(len(self.colors)), x.shape)
+        index = (layer * ny + row) * nx + col
+        weights = None
+        if self.decay != 1.0:
+            # 第 i 个样本之后还有 n - 1 - i 个样本，各自使它衰减一次
+            self.counts *= self.decay ** n
+            weights = np.broadcast_to((self.decay ** np.arange(n - 1, -1, -1))[:, np.newaxis], x.shape)[inside]
+        self.counts += np.bincount(index[inside], weights=weights, minlength=self.counts.size).reshape(self.counts.shape)
+        self.samples += n
+
+    def image(self):
+        """(行数, 列数, 4) 的 RGBA 图像，各层按颜色在白色背景上相乘叠加，空白处透明"""
+        self.flush()
+        intensity = np.log1p(self.counts) if self.log else self.counts.copy()
+        peak = intensity.max(axis=(1, 2), keepdims=True)
+        intensity /= np.where(peak > 0, peak, 1.0)
+        # 每一层按强度把白色混合为该层的颜色，多层相乘
+        rgb = np.prod(1 - intensity[..., np.newaxis] * (1 - self.colors[:, np.newaxis, np.newaxis]), axis=0)
+        alpha = 1 - np.prod(1 - intensity, axis=0)
+        return np.concatenate([rgb, alpha[..., np.newaxis]], axis=-1)
@@ -23,6 +23,7 @@ class RigidRodSimulator(Animator2D):
         self.g       = 9.8             # 重力加速度
         self.e       = restitution     # 碰撞恢复系数
         self.floor_y = 0.0             # 地面高度
+        self.dt      = 0.01            # 时间步长
         
         # 初始状态 (质心坐标x,y; 速度vx,vy; 角度theta; 角速度omega)
         self.x_cm  = 0.0        # 质心x初始在原点
@@ -103,18 +104,32 @@ class RigidRodSimulator(Animator2D):
         penetration = self.floor_y - self.min_y
         self.y_cm += penetration + 1e-3
 
-    def update(self, frame):
-        """动画更新函数"""
-        dt = 0.01  # 时间步长
-        
+    @property
+    def conserved(self):
+        """完全弹性碰撞时机械能守恒"""
+        return ("energy",) if self.e == 1.0 else ()
+
+    def diagnostic_quantities(self):
+        """机械能、动量与绕质心的角动量"""
+        kinetic = 0.5 * self.m * (self.vx_cm**2 + self.vy_cm**2) + 0.5 * self.I_cm * self.omega**2
+        potential = self.m * self.g * (self.y_cm - self.floor_y)
+        return {
+            "energy": kinetic + potential,
+            "momentum": (self.m * self.vx_cm, self.m * self.vy_cm),
+            "angular_momentum": self.I_cm * self.omega,
+        }
+
+    def step(self):
+        """推进一个物理步长"""
         # 更新物理状态
-        self._update_physics(dt)
+        self._update_physics(self.dt)
         
         # 检测并处理碰撞
         if self._check_collision():
             self._handle_collision()
-        
-        # 更新杆的图形
+
+    def draw(self):
+        """更新杆的图形"""
         half_L = self.L / 2
         x1 = self.x_cm + half_L * np.cos(self.theta)
         y1 = self.y_cm + half_L * np.sin(self.theta)
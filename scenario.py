@@ -0,0 +1,171 @@
+#------------------------------------------------
+# name: scenario.py
+# author: taster
+# date: 2025-05-24 15:18:40 星期六
+# id: 9d3a6f1e0c7b42d58e2f4b1a6c0d8e73
+# description: 场景文件与无重叠的初始条件生成
+#------------------------------------------------
+import json
+import os
+import numpy as np
+
+"""
+场景文件是一个目录：每个数组一个 .npy 文件(pos、vol、mass，以及可选的 radius)，
+其余信息(质点数、区域范围、半径、生成方式等)存于 metadata.json。
+.npy 可以用 np.load(mmap_mode=...) 直接映射到内存，载入时不读取数据，用到哪一页才读哪一页；
+默认的 "c" 为写时复制，模拟器原地修改数组时不会改动文件。
+"""
+
+FIELDS = ("pos", "vol", "mass", "radius")
+
+
+def save_scenario(path, pos, vol, mass, radius=None, **metadata):
+    """
+    保存场景
+
+    参数:
+        path: 场景目录，不存在时创建
+        pos, vol: (N, 2) 的位置与速度
+        mass: (N,) 的质量
+        radius: (N,) 的半径，或所有质点相同的半径(存入 metadata)
+        **metadata: 写入 metadata.json 的其余信息，需可 JSON 序列化
+    """
+    os.makedirs(path, exist_ok=True)
+    if radius is not None and np.ndim(radius) == 0:
+        metadata["radius"], radius = float(radius), None
+    arrays = {"pos": pos, "vol": vol, "mass": mass, "radius": radius}
+    for name, array in arrays.items():
+        if array is not None:
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(array))
+        elif os.path.exists(os.path.join(path, f"{name}.npy")):
+            os.remove(os.path.join(path, f"{name}.npy")) # 覆盖旧场景时去掉多余的数组
+    metadata["N"] = len(pos)
+    with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+class Scenario:
+    """
+    惰性载入的场景
+
+    scenario["pos"] 等数组在访问时才映射到内存，每次访问得到新的映射，因此写时复制模式下
+    模拟器修改过的数组不影响下一次载入(例如重置)。所有质点半径相同时 scenario["radius"]
+    返回 metadata 中的半径，不存在的数组返回 None。
+
+    参数:
+        path: 场景目录
+        mmap_mode: 传给 np.load 的映射方式，"c" 为写时复制，"r" 为只读，None 为全部读入内存
+    """
+    def __init__(self, path, mmap_mode="c"):
+        self.path      = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, "metadata.json"), encoding="utf-8") as f:
+            self.metadata = json.load(f)
+
+    def __len__(self):
+        return self.metadata["N"]
+
+    def __getitem__(self, name):
+        assert name in FIELDS, f"场景中没有 {name}，可用的数组为 {FIELDS}"
+        filename = os.path.join(self.path, f"{name}.npy")
+        if os.path.exists(filename):
+            return np.load(filename, mmap_mode=self.mmap_mode)
+        return self.metadata.get(name)
+
+
+def load_scenario(scenario, mmap_mode="c"):
+    """场景目录或已载入的 Scenario"""
+    return scenario if isinstance(scenario, Scenario) else Scenario(scenario, mmap_mode=mmap_mode)
+
+
+def poisson_disk(n, lower, size, min_dist, seed=None, rounds=30):
+    """
+    泊松圆盘采样：在矩形内生成 n 个两两距离不小于 min_dist 的随机点
+
+    背景网格的边长为 min_dist / sqrt(2)，每个格子最多容纳一个点，与新点冲突的点只可能在
+    周围 5x5 个格子内。格子按下标模 3 分为 9 组，同组的格子相距超过 min_dist，
+    因此每组可以同时向所有空格子各投一个点并向量化地检查冲突。重复若干轮直到点数足够，
+    再从中随机选出 n 个，整体复杂度为 O(格子数)。
+
+    参数:
+        n: 点数
+        lower: 矩形左下角 (x, y)
+        size: 矩形边长 (Lx, Ly)
+        min_dist: 最小间距
+        seed: 随机种子
+        rounds: 最多投点的轮数
+
+    返回:
+        (n, 2) 的坐标
+    """
+    rng = np.random.default_rng(seed)
+    lower = np.asarray(lower, dtype=float)
+    size = np.asarray(size, dtype=float)
+    cell = min_dist / np.sqrt(2)
+    shape = np.maximum(np.ceil(size / cell).astype(int), 1)
+    # 每个格子中的点的坐标，nan 表示空；四周各补两圈空格子，检查邻居时无需判断越界
+    width = shape[1] + 4
+    gx = np.full((shape[0] + 4, width), np.nan)
+    gy = np.full((shape[0] + 4, width), np.nan)
+    fx, fy = gx.reshape(-1), gy.reshape(-1)
+    offsets = [dx * width + dy for dx in range(-2, 3) for dy in range(-2, 3) if (dx, dy) != (0, 0)]
+    count = 0
+
+    for _ in range(rounds):
+        added = 0
+        for px in range(3):
+            for py in range(3):
+                ix, iy = np.nonzero(np.isnan(gx[2 + px:2 + shape[0]:3, 2 + py:2 + shape[1]:3]))
+                ix, iy = 3 * ix + px, 3 * iy + py
+                cx = lower[0] + (ix + rng.random(len(ix))) * cell
+                cy = lower[1] + (iy + rng.random(len(iy))) * cell
+                keep = (cx <= lower[0] + size[0]) & (cy <= lower[1] + size[1]) # 最后一行(列)格子可能超出矩形
+                index = (ix + 2) * width + iy + 2
+                for offset in offsets:
+                    # 与 nan 比较总为 False，空格子不会造成冲突
+                    dx = fx[index + offset] - cx
+                    dy = fy[index + offset] - cy
+                    keep &= ~(dx * dx + dy * dy < min_dist ** 2)
+                fx[index[keep]], fy[index[keep]] = cx[keep], cy[keep]
+                added += keep.sum()
+        count += added
+        if count >= n or added == 0:
+            break
+    filled = ~np.isnan(fx)
+    points = np.column_stack([fx[filled], fy[filled]])
+    assert len(points) >= n, f"区域内只放下了 {len(points)} 个间距不小于 {min_dist} 的点，少于 {n} 个"
+    return points[rng.choice(len(points), n, replace=False)]
+
+
+def grid_positions(n, lower, size, min_dist, seed=None):
+    """
+    在间距为 min_dist 的正方形格点中随机选出 n 个，比泊松圆盘采样更密，复杂度为 O(格点数)
+
+    参数与返回值同 poisson_disk。
+    """
+    rng = np.random.default_rng(seed)
+    lower = np.asarray(lower, dtype=float)
+    size = np.asarray(size, dtype=float)
+    shape = np.floor(size / min_dist + 1e-9).astype(int) + 1 # 容许舍入误差，边长恰为间距整数倍时不丢格点
+    assert shape.prod() >= n, f"区域内只有 {shape.prod()} 个间距为 {min_dist} 的格点，少于 {n} 个"
+    margin = (size - (shape - 1) * min_dist) / 2 # 格点整体居中
+    chosen = rng.choice(shape.prod(), n, replace=False)
+    return lower + margin + np.column_stack(np.unravel_index(chosen, shape)) * min_dist
+
+
+if __name__ == "__main__":
+    import time
+
+    # 生成并保存一百万个互不重叠的小球，再惰性载入
+    N, radius = 1_000_000, 2e-4
+    start = time.perf_counter()
+    pos = poisson_disk(N, [radius, radius], [1 - 2 * radius, 1 - 2 * radius], 2 * radius, seed=0)
+    rng = np.random.default_rng(0)
+    save_scenario(
+        "./example/million_balls", pos, rng.uniform(0.0, 5.0, (N, 2)), rng.uniform(1, 10, N),
+        radius=radius, xlim=[0, 1], ylim=[0, 1], generator="poisson_disk", seed=0,
+    )
+    print(f"生成并保存用时 {time.perf_counter() - start:.2f} 秒")
+    start = time.perf_counter()
+    scenario = load_scenario("./example/million_balls")
+    print(f"载入 {len(scenario)} 个小球用时 {time.perf_counter() - start:.4f} 秒，第一个位置 {scenario['pos'][0]}")
@@ -0,0 +1,176 @@
+#------------------------------------------------
+# name: scheduler.py
+# author: taster
+# date: 2025-05-14 21:03:36 星期三
+# id: 0b7d4e2f9a6c4531b8e0d3f6a2c9e715
+# description: 动画部件的刷新计划与分层 blit
+#------------------------------------------------
+import time
+import numpy as np
+
+
+class ArtistSchedule:
+    """
+    动画部件的刷新计划
+
+    每组部件登记一个更新函数与刷新条件：每 every 帧检查一次，给出 key 时只有 key 的值
+    相对上次刷新变化超过 tolerance 才执行更新。同名的组重复登记时替换旧的登记。
+    """
+    def __init__(self):
+        self.entries = {}    # 组名 -> 登记信息
+        self.frame   = 0     # 已刷新的帧数
+        self.updated = []    # 最近一次刷新中更新过的部件
+        self.version = 0     # 登记发生变化时加一
+        self.force   = True  # 下一帧是否强制刷新全部部件
+
+    def add(self, name, artists, update, every=1, key=None, tolerance=0.0):
+        """
+        登记一组部件
+
+        参数:
+            name: 组名
+            artists: 单个部件或部件列表
+            update: 无参数的更新函数，依据模拟器状态修改部件
+            every: 每隔多少帧检查一次
+            key: 无参数函数，返回用于判断是否变化的值，None 表示到期即更新
+            tolerance: key 的变化超过此值才更新
+        """
+        artists = list(artists) if isinstance(artists, (list, tuple)) else [artists]
+        self.entries[name] = {
+            "artists": artists, "update": update, "every": every,
+            "key": key, "tolerance": tolerance, "last": None,
+        }
+        self.version += 1
+        self.force = True
+
+    def invalidate(self):
+        """下一帧强制刷新全部部件，在重置后调用"""
+        self.force = True
+
+    def is_due(self, entry):
+        """该组部件本帧是否需要更新"""
+        if self.frame % entry["every"]:
+            return False
+        if entry["key"] is None:
+            return True
+        value = np.asarray(entry["key"](), dtype=float)
+        last = entry["last"]
+        if last is not None and last.shape == value.shape and np.all(np.abs(value - last) <= entry["tolerance"]):
+            return False
+        entry["last"] = value
+        return True
+
+    def refresh(self):
+        """执行到期的更新，返回本帧更新过的部件"""
+        self.updated = []
+        for entry in self.entries.values():
+            if self.force or self.is_due(entry):
+                if self.force and entry["key"] is not None:
+                    entry["last"] = np.asarray(entry["key"](), dtype=float)
+                entry["update"]()
+                self.updated.extend(entry["artists"])
+        self.force = False
+        self.frame += 1
+        return self.updated
+
+    @property
+    def artists(self):
+        """全部登记的部件"""
+        return [artist for entry in self.entries.values() for artist in entry["artists"]]
+
+    @property
+    def fast_artists(self):
+        """每帧都更新的部件"""
+        return [
+            artist for entry in self.entries.values() if entry["every"] == 1 and entry["key"] is None
+            for artist in entry["artists"]
+        ]
+
+    @property
+    def slow_artists(self):
+        """按较低频率或按变化更新的部件"""
+        fast = set(map(id, self.fast_artists))
+        return [artist for artist in self.artists if id(artist) not in fast]
+
+
+class LayeredBlitter:
+    """
+    分层 blit 动画循环
+
+    画面分为三层：静态背景(坐标轴、网格等，只在整幅重绘时渲染)、慢层(低频部件，
+    只在其中有部件更新时重新渲染并缓存)、快层(每帧更新的部件)。每帧只恢复缓存并绘制快层，
+    慢层部件没有到期时不会被重新渲染。
+
+    参数:
+        fig: 画布
+        schedule: ArtistSchedule
+        func: 每帧调用的函数 func(frame)，负责推进模拟并调用 schedule.refresh()
+        interval: 帧间隔(毫秒)
+        frames: 推进的帧数，到达后停止计时器；None 表示一直运行
+    """
+    def __init__(self, fig, schedule, func, interval=10, frames=None):
+        self.fig      = fig
+        self.canvas   = fig.canvas
+        self.schedule = schedule
+        self.func     = func
+        self.frame    = 0
+        self.frames   = frames
+        self.static   = None # 静态背景的缓存
+        self.layer    = None # 静态背景 + 慢层的缓存
+        self.version  = None # 缓存对应的登记版本
+        self.render_time = 0.0 # 最近一次 blit 的耗时(秒)
+        self.sync() # 首次整幅重绘前就把部件排除在静态背景之外
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.timer = self.canvas.new_timer(interval=interval)
+        self.timer.add_callback(self.tick)
+        self.timer.start()
+
+    def sync(self):
+        """登记变化后，把全部部件设为 animated，使其不进入静态背景"""
+        if self.version != self.schedule.version:
+            for artist in self.schedule.artists:
+                artist.set_animated(True)
+            self.version = self.schedule.version
+            self.layer = None
+
+    def on_draw(self, event):
+        """整幅重绘(首次显示、缩放窗口等)后重新缓存静态背景"""
+        self.sync()
+        self.static = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.layer = None
+        self.blit(self.schedule.fast_artists)
+
+    def tick(self):
+        """计时器回调：推进一帧并按层重绘"""
+        if self.frames is not None and self.frame >= self.frames:
+            self.stop()
+            return
+        self.schedule.updated = []
+        self.func(self.frame)
+        self.frame += 1
+        self.sync()
+        if self.static is None or not self.schedule.updated:
+            return # 尚未完成首次绘制，或本帧没有部件变化
+        slow = set(map(id, self.schedule.slow_artists))
+        if any(id(artist) in slow for artist in self.schedule.updated):
+            self.layer = None # 慢层有部件更新，需要重新渲染
+        start = time.perf_counter()
+        self.blit(self.schedule.fast_artists)
+        self.render_time = time.perf_counter() - start
+
+    def blit(self, fast):
+        """恢复缓存(必要时重建慢层)，绘制快层并推送到屏幕"""
+        if self.layer is None:
+            self.canvas.restore_region(self.static)
+            for artist in self.schedule.slow_artists:
+                self.fig.draw_artist(artist)
+            self.layer = self.canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            self.canvas.restore_region(self.layer)
+        for artist in fast:
+            self.fig.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+
+    def stop(self):
+        """停止计时器"""
+        self.timer.stop()
@@ -12,17 +12,78 @@ from matplotlib.widgets import Button
 import matplotlib.animation as animation
 import numpy as np
 import datetime
+from functools import partial
 import matplotlib.gridspec as gridspec
 from animator import Animator2D
+from elliptic import M_MAX, ellipj, ellipk, ellipkinc
+from lookahead import TrajectoryBuffer, euler_batch_step, euler_trajectory
+from phase_portrait import PhaseDensity
 
 """
 此系统中，广义坐标仅有theta与其一阶导，即L(theta, theta_dot)
 即在动画更新过程中本质上只是这一个变量的变化，其后的所有绘制均基于此变化
 """
 
+def pendulum_angular_acceleration(theta, g, length):
+    """单摆的角加速度，theta 可以是浮点数或任意形状的数组"""
+    return - (g / length) * np.sin(theta)
+
+
+def pendulum_accelerations(q, q_dot, g, length):
+    """单摆的角加速度，q = [theta]，最后一维为自由度，前面的维度可以是任意批量"""
+    return pendulum_angular_acceleration(q[..., 0], g, length)[..., np.newaxis]
+
+
+def pendulum_exact(theta, theta_dot, t, g, length):
+    """
+    无阻尼单摆的解析解：从 (theta, theta_dot) 出发经过时间 t 后的角度与角速度
+
+    记 ω = sqrt(g / length)，m = sin²(θ/2) + (θ'/2ω)² 由能量决定：
+    m < 1 为摆动，sin(θ/2) = k sn(ωt + u0, m)，θ' = 2kω cn(ωt + u0, m)，k = sqrt(m)；
+    m > 1 为转动，θ/2 = am(±kωt + v0, 1/m)，θ' = ±2kω dn(±kωt + v0, 1/m)。
+    各参数可以是任意形状的数组，按 numpy 规则广播，可以一次计算许多时刻或许多摆；
+    初始相位只按初始条件的形状计算一次。转动时角度连续增长(不折回)，
+    摆动时保持在初始角度所在的 2π 区间内。
+    """
+    theta, theta_dot, g, length = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (theta, theta_dot, g, length)))
+    omega = np.sqrt(g / length)
+    m = np.sin(0.5 * theta) ** 2 + (0.5 * theta_dot / omega) ** 2
+    k = np.sqrt(m)
+    librating = m < 1
+
+    # 初始相位：摆动时初始角度折回 (-π, π]，先在 sn 的四分之一周期内求解，cn < 0 时取另一半周期；
+    # 转动时直接由 F(θ/2) 给出，振幅函数连续增长
+    offset = 2 * np.pi * np.round(theta / (2 * np.pi))
+    parameter = np.where(librating, np.minimum(m, M_MAX), np.minimum(1 / np.maximum(m, 1.0), M_MAX))
+    ratio = np.clip(np.sin(0.5 * (theta - offset)) / np.where(k > 0, k, 1.0), -1.0, 1.0)
+    phase = ellipkinc(np.where(librating, np.arcsin(ratio), 0.5 * theta), parameter)
+    phase = np.where(librating & (theta_dot < 0), 2 * ellipk(parameter) - phase, phase)
+    sign = np.where(theta_dot < 0, -1.0, 1.0)
+    rate = np.where(librating, omega, sign * k * omega) # 自变量随时间的变化率
+
+    sn, cn, dn, am = ellipj(phase + rate * np.asarray(t, dtype=float), parameter)
+    angle = np.where(librating, 2 * np.arcsin(np.clip(k * sn, -1.0, 1.0)) + offset, 2 * am)
+    velocity = np.where(librating, 2 * k * omega * cn, 2 * sign * k * omega * dn)
+    return angle, velocity
+
+
+def pendulum_period(theta, theta_dot, g, length):
+    """无阻尼单摆的周期：摆动时为往返一次的时间 4K(m)/ω，转动时为转过一圈的时间 2K(1/m)/(kω)"""
+    theta, theta_dot = np.asarray(theta, dtype=float), np.asarray(theta_dot, dtype=float)
+    omega = np.sqrt(np.asarray(g, dtype=float) / length)
+    m = np.sin(0.5 * theta) ** 2 + (0.5 * theta_dot / omega) ** 2
+    return np.where(m < 1, 4 * ellipk(np.minimum(m, M_MAX)) / omega, 2 * ellipk(1 / np.maximum(m, 1.0)) / (np.sqrt(m) * omega))
+
+
 class SinglePendulum(Animator2D):
     """单摆系统"""
-    def __init__(self, length=1.0, mass=1.0, theta=np.pi / 3, damping=False):
+    def __init__(self, length=1.0, mass=1.0, theta=np.pi / 3, damping=False, lookahead=False, exact=False, phase_decay=1.0):
+        """
+        参数:
+            lookahead: 是否预先成段计算轨迹，动画每一步只从缓冲中取出下一个状态
+            exact: 无阻尼时是否用椭圆函数的解析解代替欧拉积分，没有累积误差，能量严格守恒
+            phase_decay: 相图密度每个新样本的衰减系数，1 表示保留全部历史
+        """
         super(SinglePendulum, self).__init__()
         # 全局参数设置
         self.g          = 9.8     # 重力加速度
@@ -31,9 +92,14 @@ class SinglePendulum(Animator2D):
         self.length     = length  # 杆长
         self.mass       = mass    # 摆锤的质量
         self.dt         = 1e-2    # 时间步长
+        self.exact      = exact   # 解析解模式
+        self.anchor     = None    # 解析解模式下的起点 (角度, 角速度)
+        self.elapsed    = 0       # 解析解模式下自起点推进的步数
+        self.written    = None    # 解析解模式下最近一次写入的状态
 
         # 变量
-        self.variable_added = False # 动画部件是否已被添加过
+        self.lookahead = TrajectoryBuffer(self.trajectory) if lookahead else None # 预计算轨迹缓冲
+        self.phase     = PhaseDensity([-np.pi, np.pi], [-6, 6], colors=("blue",), decay=phase_decay) # 相图密度
         self.random_init()
 
         self.initialize_figure([-1.5, 1.5], [-1.5, 1.5], title="Single Pendulum", figsize=(10, 5)) # 初始化matplotlib画布
@@ -51,8 +117,8 @@ class SinglePendulum(Animator2D):
         self.ax.set_title("Single Pendulum")
 
         # 配置相图
-        self.ax_phase.set(xlim=[-4, 4], ylim=[-6, 6], xlabel=r'$\theta$', ylabel=r'$\dot{\theta}$')
-        self.ax_phase.set_aspect('equal')
+        self.ax_phase.set(xlim=self.phase.xlim, ylim=self.phase.ylim, xlabel=r'$\theta$', ylabel=r'$\dot{\theta}$')
+        self.ax_phase.set_aspect('auto') # 角度只跨 2π，等比例时面板会很窄
         self.ax_phase.grid(True)
         self.ax_phase.set_title("Phase Diagram")
 
@@ -63,58 +129,137 @@ class SinglePendulum(Animator2D):
 
     def reset(self, event):
         self.random_init()
+        self.monitor.reset()
+        self.schedule.invalidate()
+
+    @property
+    def conserved(self):
+        """无阻尼时机械能守恒"""
+        return () if self.is_damping else ("energy",)
+
+    def diagnostic_quantities(self):
+        """机械能与角动量(相对悬挂点)"""
+        angular = self.mass * self.length ** 2 * self.theta_dot
+        energy = 0.5 * self.mass * self.length ** 2 * self.theta_dot ** 2 - self.mass * self.g * self.length * np.cos(self.theta)
+        return {"energy": energy, "angular_momentum": angular}
 
     def random_init(self):
         self.theta             = np.random.uniform(-np.pi, np.pi) # 初始角度
         self.theta_dot         = 0.0 # 角速度
-        # 相图的存储
-        self.theta_history     = []
-        self.theta_dot_history = []
+        self.phase.reset() # 清空相图
+        if self.lookahead is not None:
+            self.lookahead.reset(*self.get_coordinates())
 
     def plot_variable(self):
-        """依据系统变量绘制动画部件"""
-        # 绘制摆锤、杆
-        ball_pos = (self.length * np.sin(self.theta), -self.length * np.cos(self.theta))
+        """创建动画部件，并登记各自的刷新频率：摆每帧更新，相图每 5 帧更新"""
+        ball_pos = self.ball_position()
         # self.pole, = self.ax.plot([0, ball_position[0]], [0, ball_position[1]], lw="2", c="blue")
-        # 创建杆的PathPatch
-        pole_vertices = [(0, 0), ball_pos]
-        pole_codes = [path.Path.MOVETO, path.Path.LINETO]
-        pole_path = path.Path(pole_vertices, pole_codes)
-
-        if not self.variable_added: # 动画部件的初始添加
-            self.ball = Circle(ball_pos, radius=0.1, fill=True, color="blue")
-            self.pole = PathPatch(pole_path, lw=2, edgecolor="gray", facecolor='none')
-            self.ax.add_patch(self.pole)
-            self.ax.add_patch(self.ball)
-            self.phase_line, = self.ax_phase.plot(self.theta_history, self.theta_dot_history, 'b-', lw=1) # 相图曲线
-            self.variable_added = True
+        # 创建杆的PathPatch，之后只原地修改其端点
+        pole_path = path.Path([(0, 0), ball_pos], [path.Path.MOVETO, path.Path.LINETO])
+        self.ball = Circle(ball_pos, radius=0.1, fill=True, color="blue")
+        self.pole = PathPatch(pole_path, lw=2, edgecolor="gray", facecolor='none')
+        self.ax.add_patch(self.pole)
+        self.ax.add_patch(self.ball)
+        self.register_artist("pendulum", [self.pole, self.ball], self.update_pendulum)
+        if self.ax_phase is not None:
+            # 相图为固定分辨率的密度图像，绘制耗时不随运行时间增长
+            self.phase_image = self.ax_phase.imshow(self.phase.image(), extent=self.phase.extent, origin="lower", interpolation="nearest", aspect="auto")
+            self.register_artist("phase", self.phase_image, self.update_phase, every=5)
+
+    def ball_position(self):
+        """摆锤的坐标"""
+        return (self.length * np.sin(self.theta), -self.length * np.cos(self.theta))
+
+    def update_pendulum(self):
+        """更新摆锤与杆，杆的 Path 原地修改而不重建"""
+        ball_pos = self.ball_position()
+        self.pole.get_path().vertices[1] = ball_pos
+        self.pole.stale = True
+        self.ball.set_center(ball_pos)
+
+    def update_phase(self):
+        """更新相图"""
+        self.phase_image.set_data(self.phase.image())
+        # self.ax_phase.relim() # 调整坐标轴范围
+        # self.ax_phase.autoscale_view()
+
+    @property
+    def analytic(self):
+        """是否使用解析解，有阻尼时仍用欧拉积分"""
+        return self.exact and not self.is_damping
+
+    @property
+    def integrator(self):
+        """推进方式，用于轨迹缓存的键"""
+        return "elliptic" if self.analytic else "semi-implicit-euler"
+
+    @property
+    def damping_factor(self):
+        """每步乘在速度上的阻尼系数"""
+        return self.damping if self.is_damping else 1.0
+
+    def equations(self):
+        """绑定了当前参数的加速度函数"""
+        return partial(pendulum_accelerations, g=self.g, length=self.length)
+
+    def trajectory(self, q, q_dot, n_steps):
+        """从 q = [theta], q_dot = [theta_dot] 出发推进 n_steps 步，返回 (n_steps, 2, 1) 的轨迹"""
+        if self.analytic:
+            theta, theta_dot = self.exact_state(self.dt * np.arange(1, n_steps + 1), q[0], q_dot[0])
+            return np.stack([theta, theta_dot], axis=-1)[..., np.newaxis]
+        return euler_trajectory(self.equations(), q, q_dot, n_steps, self.dt, self.damping_factor)
+
+    def exact_state(self, t, theta=None, theta_dot=None):
+        """无阻尼时从给定状态(默认为当前状态)出发经过时间 t 后的角度与角速度，t 可以是数组"""
+        theta = self.theta if theta is None else theta
+        theta_dot = self.theta_dot if theta_dot is None else theta_dot
+        return pendulum_exact(theta, theta_dot, t, self.g, self.length)
+
+    def get_coordinates(self):
+        """广义坐标与广义速度"""
+        return [self.theta], [self.theta_dot]
+
+    def set_coordinates(self, q, q_dot):
+        """写入广义坐标与广义速度，并记录相图数据"""
+        self.theta, self.theta_dot = float(q[0]), float(q_dot[0])
+        self.phase.push((self.theta, self.theta_dot))
+
+    def step(self):
+        """推进一个物理步长"""
+        # 更新系统变量(欧拉法，阻尼在 euler_trajectory 中施加)
+        if self.lookahead is not None:
+            q, q_dot = self.lookahead.next()
+        elif self.analytic:
+            # 总是从起点直接求值，误差不随步数累积；状态被外部修改(重置等)时以当前状态为新的起点
+            if self.written != (self.theta, self.theta_dot):
+                self.anchor, self.elapsed = (self.theta, self.theta_dot), 0
+            self.elapsed += 1
+            q, q_dot = ([x] for x in self.exact_state(self.elapsed * self.dt, *self.anchor))
         else:
-            self.pole.set_path(pole_path)
-            self.ball.set_center(ball_pos)
-            self.phase_line.set_data(self.theta_history, self.theta_dot_history)
-            # self.ax_phase.relim() # 调整坐标轴范围
-            # self.ax_phase.autoscale_view()
-
-    def update(self, frame):
-        """每一帧更新时调用的方法"""
-        # 更新系统变量
-        theta_double_dot = - (self.g / self.length) * np.sin(self.theta) # 计算角加速度
-        # 欧拉法更新速度和角度
-        self.theta_dot += theta_double_dot * self.dt
-        self.theta += self.theta_dot * self.dt
-        if self.is_damping:
-            self.theta_dot *= self.damping # 应用阻尼
-        # 更新相图数据
-        self.theta_history.append(self.theta)
-        self.theta_dot_history.append(self.theta_dot)
+            # 单步直接用浮点数计算，避免小数组的开销，与 euler_trajectory 逐位一致
+            theta_dot = self.theta_dot + pendulum_angular_acceleration(self.theta, self.g, self.length) * self.dt
+            theta = self.theta + theta_dot * self.dt
+            q, q_dot = [theta], [theta_dot * self.damping_factor]
+        self.set_coordinates(q, q_dot)
+        if self.analytic:
+            self.written = (self.theta, self.theta_dot)
 
-        self.plot_variable()
-        return self.ball, self.pole, self.phase_line
+    @classmethod
+    def step_batch(cls, simulators):
+        """参数不同的多个单摆作为一个批量推进一步"""
+        if any(sim.lookahead is not None or sim.analytic for sim in simulators):
+            return super().step_batch(simulators)
+        parameters = {name: [getattr(sim, name) for sim in simulators] for name in ("g", "length")}
+        euler_batch_step(simulators, pendulum_accelerations, parameters, [sim.damping_factor for sim in simulators])
 
 
 if __name__ == "__main__":
     # 使用示例
     simulator = SinglePendulum(length=1.0, damping=False)
+    # 预先成段计算轨迹，每帧只取出缓冲中的下一个状态
+    # simulator = SinglePendulum(length=1.0, lookahead=True)
+    # 无阻尼时用椭圆函数的解析解，能量严格守恒
+    # simulator = SinglePendulum(length=1.0, exact=True)
     simulator.play(interval=3)
     # simulator.save_animation("./example/single_pendulum.mp4", fps=60, interval=1, frames=1000, dpi=200)
 
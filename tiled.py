@@ -0,0 +1,83 @@
+#------------------------------------------------
+# name: tiled.py
+# author: taster
+# date: 2025-05-17 10:48:25 星期六
+# id: e41b7a0c2d9f45638a1e6c3b0f7d2958
+# description: 多场景拼图：一个画布中并排显示多个模拟器
+#------------------------------------------------
+import matplotlib.pyplot as plt
+import numpy as np
+from animator import Animator2D
+
+
+class TiledAnimator(Animator2D):
+    """
+    多场景拼图
+
+    把 K 个模拟器画在同一个画布的子图中：同类的模拟器每步通过 step_batch 作为一个批量推进，
+    全部部件登记在同一个刷新计划里，每帧只做一次分层 blit，只有一个计时器。
+    """
+    def __init__(self, simulators, ncols=None, labels=None, figsize=None, title=None):
+        """
+        参数:
+            simulators: 模拟器列表，需实现 plot_variable
+            ncols: 每行的子图数，默认接近正方形
+            labels: 各子图的标题
+            figsize: 画布大小，默认每个子图 3x3 英寸
+            title: 画布标题
+        """
+        super().__init__()
+        self.simulators = list(simulators)
+        K = len(self.simulators)
+        ncols = ncols or int(np.ceil(np.sqrt(K)))
+        nrows = int(np.ceil(K / ncols))
+        self.fig, axes = plt.subplots(nrows, ncols, figsize=figsize or (3 * ncols, 3 * nrows), squeeze=False)
+        if title:
+            self.fig.suptitle(title)
+        self.axes = axes.ravel()
+        for k, (simulator, ax) in enumerate(zip(self.simulators, self.axes)):
+            simulator.attach(ax, schedule=self.schedule) # 共用拼图的刷新计划
+            ax.tick_params(labelsize=6)
+            if labels is not None:
+                ax.set_title(labels[k], fontsize=8)
+        for ax in self.axes[K:]:
+            ax.set_visible(False)
+        self.ax = self.axes[0]
+        self.fig.tight_layout()
+
+        # 按类分组，同类的模拟器批量推进
+        self.groups = {}
+        for simulator in self.simulators:
+            self.groups.setdefault(type(simulator), []).append(simulator)
+
+    @property
+    def dt(self):
+        """步长，实时节拍按第一个模拟器的步长计算模拟时间"""
+        return self.simulators[0].dt
+
+    def step(self):
+        """每一类模拟器作为一个批量推进一步"""
+        for cls, group in self.groups.items():
+            cls.step_batch(group)
+
+    def advance(self, n_steps=1):
+        """推进 n_steps 步，各模拟器的观测器照常按步长采样"""
+        for _ in range(n_steps):
+            self.step()
+            for simulator in self.simulators:
+                simulator.notify_observers()
+            self.notify_observers()
+
+
+if __name__ == "__main__":
+    from double_pendulum import DoublePendulum
+
+    # 4x4 的双摆，质量比从左上到右下逐渐增大，初始角度相同
+    ratios = np.linspace(0.2, 3.0, 16)
+    pendulums = []
+    for ratio in ratios:
+        pendulum = DoublePendulum(m1=1.0, m2=ratio, damping=1.0)
+        pendulum.theta1, pendulum.theta2 = 2.0, 2.5
+        pendulums.append(pendulum)
+    tiles = TiledAnimator(pendulums, labels=[f"m2/m1 = {ratio:.2f}" for ratio in ratios], title="Double Pendulum")
+    tiles.play(interval=10)
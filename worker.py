@@ -0,0 +1,186 @@
+#------------------------------------------------
+# name: worker.py
+# author: taster
+# date: 2025-04-26 21:08:44 星期六
+# id: 9d2f6b1e7a4c3058b1e6f0a2d7c9e4b3
+# description: 后台模拟线程/进程与共享内存帧缓冲
+#------------------------------------------------
+import multiprocessing as mp
+import pickle
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedFrameBuffer:
+    """
+    双缓冲的共享内存帧
+
+    内存布局为一个 int64 头部 [计数, 前台槽位] 加上两个槽位，每个槽位按 layout 依次存放各个数组。
+    头部的计数是顺序锁(seqlock)：写端开始写入时把计数加一变为奇数，写入后台槽位并切换前台槽位后
+    再加一变回偶数，帧序号为计数的一半。读端在计数为偶数时复制前台槽位，复制后计数不变才接受，
+    否则说明复制期间写端写过(可能正是正在读的槽位)，重试几次后仍失败就放弃这一帧。
+    """
+    HEADER = 2 # 头部的 int64 个数
+
+    def __init__(self, layout, name=None):
+        """
+        参数:
+            layout: 量名 -> (形状, dtype)
+            name: 已存在的共享内存名，None 时新建
+        """
+        self.layout = {key: (tuple(shape), np.dtype(dtype)) for key, (shape, dtype) in layout.items()}
+        self.slot_bytes = sum(int(np.prod(shape)) * dtype.itemsize for shape, dtype in self.layout.values())
+        size = self.HEADER * 8 + 2 * self.slot_bytes
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.slots = [self._map_slot(k) for k in range(2)]
+        if self.owner:
+            self.header[:] = 0
+
+    def _map_slot(self, k):
+        """把第 k 个槽位映射为各个数组"""
+        offset = self.HEADER * 8 + k * self.slot_bytes
+        arrays = {}
+        for key, (shape, dtype) in self.layout.items():
+            arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            offset += int(np.prod(shape)) * dtype.itemsize
+        return arrays
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, state):
+        """写端：写入后台槽位并发布"""
+        self.header[0] += 1 # 奇数：正在写入
+        back = 1 - int(self.header[1])
+        for key, array in self.slots[back].items():
+            array[...] = state[key]
+        self.header[1] = back
+        self.header[0] += 1 # 偶数：写入完成
+
+    def read(self, last_seq=-1, retries=3):
+        """读端：若有比 last_seq 新的帧，返回 (序号, 状态副本)，否则返回 None"""
+        for _ in range(retries):
+            count = int(self.header[0])
+            if count % 2: # 写端正在写入
+                continue
+            seq = count // 2
+            if seq == 0 or seq == last_seq:
+                return None
+            front = int(self.header[1])
+            state = {key: array.copy() for key, array in self.slots[front].items()}
+            if int(self.header[0]) == count: # 复制期间没有写入
+                return seq, state
+        return None
+
+    def close(self):
+        """释放共享内存，创建者负责删除"""
+        self.header = None
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_simulation(simulator, buffer_name, layout, commands, stop, steps_per_frame, rate):
+    """
+    模拟循环：执行交互命令，推进 steps_per_frame 步，把最新状态写入共享内存
+
+    rate 为每秒发布的最大帧数，None 表示不限速。线程与进程都以此为入口。
+    """
+    buffer = SharedFrameBuffer(layout, name=buffer_name)
+    interval = 1.0 / rate if rate else 0.0
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            while True:
+                try:
+                    name, args = commands.get_nowait()
+                except queue.Empty:
+                    break
+                simulator.handle_command(name, *args)
+            simulator.advance(steps_per_frame)
+            buffer.write(simulator.get_state())
+            remaining = interval - (time.perf_counter() - start)
+            if remaining > 0:
+                stop.wait(remaining)
+    finally:
+        buffer.close()
+
+
+class SimulationWorker:
+    """
+    在后台线程或进程中运行模拟器的物理部分
+
+    模拟器经 pickle 复制一份(只含物理状态，不含 matplotlib 对象)交给后台，
+    界面端通过 poll() 读取最新一帧，通过 send() 把拖拽、重置等交互命令发送给后台。
+    """
+    def __init__(self, simulator, mode="thread", steps_per_frame=1, rate=None):
+        """
+        参数:
+            simulator: Animator2D 的子类实例，需实现 get_state/set_state/handle_command
+            mode: "thread" 或 "process"
+            steps_per_frame: 每发布一帧推进的物理步数
+            rate: 每秒发布的最大帧数，None 表示不限速
+        """
+        assert mode in ("thread", "process"), f"未知的运行方式 {mode}"
+        self.simulator = simulator
+        self.mode = mode
+        self.steps_per_frame = steps_per_frame
+        self.rate = rate
+        self.last_seq = -1    # 界面端最近读取的帧序号
+        self.dropped = 0      # 界面端来不及绘制而跳过的帧数
+        self.running = False
+
+    def start(self):
+        """启动后台模拟"""
+        state = self.simulator.get_state()
+        layout = {key: (np.shape(value), np.asarray(value).dtype) for key, value in state.items()}
+        self.buffer = SharedFrameBuffer(layout)
+        self.buffer.write(state)
+        if self.mode == "thread":
+            backend = pickle.loads(pickle.dumps(self.simulator)) # 与界面端互不共享数组
+            self.commands, self.stop_event = queue.Queue(), threading.Event()
+            self.runner = threading.Thread(
+                target=run_simulation, daemon=True,
+                args=(backend, self.buffer.name, layout, self.commands, self.stop_event, self.steps_per_frame, self.rate),
+            )
+        else:
+            self.commands, self.stop_event = mp.Queue(), mp.Event()
+            self.runner = mp.Process(
+                target=run_simulation, daemon=True,
+                args=(self.simulator, self.buffer.name, layout, self.commands, self.stop_event, self.steps_per_frame, self.rate),
+            )
+        self.runner.start()
+        self.running = True
+        return self
+
+    def send(self, name, *args):
+        """发送交互命令"""
+        self.commands.put((name, args))
+
+    def poll(self):
+        """读取最新一帧并载入界面端的模拟器，没有新帧时返回 False"""
+        frame = self.buffer.read(self.last_seq)
+        if frame is None:
+            return False
+        seq, state = frame
+        if self.last_seq >= 0:
+            self.dropped += max(seq - self.last_seq - 1, 0)
+        self.last_seq = seq
+        self.simulator.set_state(state)
+        return True
+
+    def stop(self):
+        """停止后台模拟并释放共享内存"""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        self.runner.join(timeout=5)
+        self.buffer.close()